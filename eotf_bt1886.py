@@ -36,6 +36,11 @@ def L(V):
         return 0
     return a * max(V + b, 0) ** gamma
 
+def L_array(V):
+    """ITU-R BT.1886 EOTF of numpy array"""
+    import numpy
+    return numpy.where(V <= 0, 0, a * numpy.maximum(V + b, 0) ** gamma)
+
 def main():
     """ITU-R BT.1886 test"""
     print('a', a)
@@ -9,3 +9,7 @@ peak = 100
 def L(V):
     """Gamma 2.2"""
     return V ** 2.2
+
+def L_array(V):
+    """Gamma 2.2 of numpy array"""
+    return V ** 2.2
@@ -9,3 +9,7 @@ peak = 100
 def L(V):
     """Gamma 2.4"""
     return V ** 2.4
+
+def L_array(V):
+    """Gamma 2.4 of numpy array"""
+    return V ** 2.4
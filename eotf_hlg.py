@@ -24,6 +24,12 @@ def L(N):
     
     return E**(gamma-1)*E
 
+def L_array(N):
+    """HLG[0:1] EOTF of numpy array"""
+    import numpy
+    E = numpy.where(N <= 1 / 2, N ** 2 / 3, numpy.exp((N - c) / a) + b)
+    return E**(gamma-1)*E
+
 def main():
     """Hybrid Log Gamma test"""
     for i in range(11):
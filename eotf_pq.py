@@ -18,6 +18,14 @@ def L(N):
     N_1_m2 = N ** (1/m2)
     return ((N_1_m2 - c1) / (c2 - c3 * N_1_m2)) ** (1 / m1)
 
+def L_array(N):
+    """SMPTE ST 2084 EOTF of numpy array"""
+    import numpy
+    N_1_m2 = N ** (1/m2)
+    with numpy.errstate(invalid='ignore'):
+        L = ((N_1_m2 - c1) / (c2 - c3 * N_1_m2)) ** (1 / m1)
+    return numpy.where(N == 0, 0, L)
+
 def main():
     """SMPTE ST 2084 EOTF test"""
     print('m1', m1)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+"""JVC projector network traffic capture and replay
+
+A capture file starts with MAGIC followed by records. Each record is a
+RECORD header (kind, seconds since capture start, data length) followed by
+the data. Record JVCNetwork traffic by passing capture=<filename> to
+JVCNetwork, JVCConnection or JVCCommand (or their asyncio versions), and replay
+it by passing network=ReplayNetwork(<filename>) to JVCConnection or JVCCommand.
+"""
+
+import struct
+import sys
+import time
+
+import dumpdata
+import jvc_network
+
+MAGIC = b'JVCCAP\x01\n'
+RECORD = struct.Struct('<BdI')
+
+CONNECT = 1
+SEND = 2
+RECV = 3
+CLOSE = 4
+
+KIND_NAMES = {CONNECT: 'connect', SEND: 'send', RECV: 'recv', CLOSE: 'close'}
+
+class CaptureWriter:
+    """Write network traffic to a capture file"""
+    def __init__(self, filename):
+        self.file = open(filename, 'wb')
+        self.file.write(MAGIC)
+        self.start = time.monotonic()
+
+    def record(self, kind, data=b''):
+        """Write a single record"""
+        self.file.write(RECORD.pack(kind, time.monotonic() - self.start, len(data)))
+        self.file.write(data)
+        self.file.flush()
+
+    def record_connect(self, host_port):
+        """Record connection to projector address"""
+        self.record(CONNECT, '{}:{}'.format(*host_port).encode())
+
+    def record_send(self, data):
+        """Record sent data"""
+        self.record(SEND, data)
+
+    def record_recv(self, data):
+        """Record received data"""
+        self.record(RECV, data)
+
+    def record_close(self):
+        """Record closed connection"""
+        self.record(CLOSE)
+
+    def close(self):
+        """Close capture file"""
+        self.file.close()
+
+def read_capture(filename):
+    """Return list of (kind, time, data) records from capture file"""
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError('{} is not a capture file'.format(filename))
+    records = []
+    pos = len(MAGIC)
+    while pos < len(data):
+        kind, timestamp, size = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        records.append((kind, timestamp, data[pos:pos + size]))
+        pos += size
+    return records
+
+class ReplayMismatch(jvc_network.Error):
+    """Replayed session diverged from capture"""
+    pass
+
+class ReplayNetwork(jvc_network.JVCNetwork):
+    """Network connection that replays a capture file instead of using a socket
+
+    Data sent must match the capture (unless strict is False). Received data is
+    returned as recorded, either as fast as possible or, if realtime is True,
+    with the recorded delay after the preceding send. Waiting for data where
+    the capture has none raises Timeout, as the recorded session did.
+    """
+    def __init__(self, filename, realtime=False, strict=True, **args):
+        super().__init__(**args)
+        self.records = read_capture(filename)
+        self.pos = 0
+        self.realtime = realtime
+        self.strict = strict
+        self.offset = None
+        for kind, _, data in self.records:
+            if kind == CONNECT:
+                host, port = data.decode().rsplit(':', 1)
+                self.host_port = (host, int(port))
+                break
+
+    def next_record(self, kind):
+        """Return next record if it is of kind, or None"""
+        if self.pos < len(self.records) and self.records[self.pos][0] == kind:
+            self.pos += 1
+            return self.records[self.pos - 1]
+        return None
+
+    def sync(self, timestamp):
+        """Align replay clock with capture time"""
+        self.offset = time.monotonic() - timestamp
+
+    def _open(self):
+        record = self.next_record(CONNECT)
+        if record is None and self.strict:
+            raise jvc_network.Error('Connection failed', 'No more connections in capture')
+        if record is not None:
+            self.sync(record[1])
+
+    def close(self):
+        if self.print_send:
+            print('    - close socket')
+        self.next_record(CLOSE)
+
+    def send(self, data):
+        if self.print_send:
+            dumpdata.dumpdata('    > Send:    ', '{:02x}', data)
+        record = self.next_record(SEND)
+        if record is None:
+            if self.strict:
+                raise ReplayMismatch('Unexpected send', bytes(data))
+            return
+        if self.strict and record[2] != data:
+            raise ReplayMismatch('Sent data does not match capture', record[2], bytes(data))
+        self.sync(record[1])
+
+    def _fill(self, timeout=None):
+        if self.pos >= len(self.records) or self.records[self.pos][0] != RECV:
+            if timeout is None:
+                raise jvc_network.Closed('End of capture')
+            if self.realtime:
+                time.sleep(timeout)
+            raise jvc_network.Timeout
+        _, timestamp, data = self.records[self.pos]
+        if self.realtime and self.offset is not None:
+            delay = self.offset + timestamp - time.monotonic()
+            if timeout is not None and delay > timeout:
+                time.sleep(timeout)
+                raise jvc_network.Timeout
+            if delay > 0:
+                time.sleep(delay)
+        self.pos += 1
+        self._make_room(len(data))
+        self.view[self.end:self.end + len(data)] = data
+        self._received(len(data))
+
+def main():
+    """Print capture file"""
+    if len(sys.argv) != 2:
+        print('usage: {} <capture file>'.format(sys.argv[0]))
+        return
+    for kind, timestamp, data in read_capture(sys.argv[1]):
+        dumpdata.dumpdata('{:10.6f} {:<7}'.format(timestamp, KIND_NAMES.get(kind, kind)),
+                          '{:02x}', data)
+
+if __name__ == "__main__":
+    main()
@@ -2,26 +2,37 @@
 
 """JVC projector low level command module"""
 
+import argparse
+import asyncio
+import json
+import math
+import operator
+import struct
+import time
 from enum import Enum
 
 import dumpdata
 import jvc_protocol
+import jvc_stats
 from jvc_protocol import CommandNack
 
+capabilities_conf_file = 'jvc_capabilities.conf'
+
 class ReadOnly():
     """Common base class for read-only command arguments"""
-    pass
+    __slots__ = ()
 
 class NoVerify():
     """Common base class for command arguments that cannot be read back"""
+    __slots__ = ()
 
 class WriteOnly(NoVerify):
     """Common base class for write-only command arguments"""
-    pass
+    __slots__ = ()
 
 class BinaryData():
     """Common base class for binary command arguments"""
-    pass
+    __slots__ = ()
 
 class Model(ReadOnly, Enum):
     """Projector model code"""
@@ -29,8 +40,22 @@ class Model(ReadOnly, Enum):
     DLA_XC6890 = b'ILAFPJ -- XHP2'
     DLA_X750R_X7000_XC7890R_RS500_X950R_X9000_RS600_PX1 = b'ILAFPJ -- XHP3'
 
+def is_array(table):
+    """Return True if table is a numpy array"""
+    return hasattr(table, 'dtype') and hasattr(table, 'tobytes')
+
+def array_to_bytes(table, dtype, low, high):
+    """Convert numpy array of integers to bytes after checking range"""
+    if table.dtype.kind not in 'iub':
+        raise TypeError('{} is not an integer array'.format(table.dtype))
+    if table.size:
+        assert low <= table.min() and table.max() <= high, '{} out of range'.format(table)
+    return table.astype(dtype).tobytes()
+
 def s8_bytes_to_list(bstr):
     """Convert 8bit signed bytes to list"""
+    if isinstance(bstr, (bytes, bytearray)):
+        return memoryview(bstr).cast('b').tolist()
     return [b if b < 0x80 else b - 0x100 for b in bstr]
 
 def num_to_s8(num):
@@ -40,10 +65,18 @@ def num_to_s8(num):
 
 def list_to_s8_bytes(numlist):
     """Convert list of signed numbers to 8bit bytes"""
-    return bytes(num_to_s8(num) for num in numlist)
+    if is_array(numlist):
+        return array_to_bytes(numlist, 'i1', -0x80, 0x7f)
+    try:
+        return struct.pack('<{}b'.format(len(numlist)), *numlist)
+    except (struct.error, TypeError):
+        # Not a list of 8 bit numbers, raise the same error as a single conversion
+        return bytes(num_to_s8(num) for num in numlist)
 
 def le16_bytes_to_list(bstr):
     """Convert 16bit little-endian bytes to list"""
+    if isinstance(bstr, (bytes, bytearray)) and not len(bstr) % 2:
+        return list(struct.unpack('<{}H'.format(len(bstr) // 2), bstr))
     i = iter(bstr)
     return [lb + 256*next(i) for lb in i]
 
@@ -56,49 +89,80 @@ def le16_split(table):
 
 def list_to_le16_bytes(table):
     """Convert list to 16bit little-endian bytes"""
-    return bytes(le16_split(table))
+    if is_array(table):
+        return array_to_bytes(table, '<u2', 0, 0xffff)
+    try:
+        return struct.pack('<{}H'.format(len(table)), *table)
+    except (struct.error, TypeError):
+        # Not a list of 16 bit numbers, raise the same error as a single conversion
+        return bytes(le16_split(table))
 
 class Numeric(int):
     """Signed 16 bit values as ascii hex data"""
+    __slots__ = ()
+
     def __new__(cls, value):
         if isinstance(value, bytes):
             assert len(value) == 4, '{} is not 4 bytes'.format(value)
-            cls.value = value
+            num = int(value, 16)
+            if num & 0x8000:
+                num = num - 0x10000
         else:
-            assert -0x8000 <= value <= 0x7fff, '{} out of range'.format(value)
-            cls.value = bytes('{:04X}'.format(value & 0xffff), 'ascii')
-        num = int(cls.value, 16)
-        if num & 0x8000:
-            num = num - 0x10000
+            num = operator.index(value)
+            assert -0x8000 <= num <= 0x7fff, '{} out of range'.format(value)
         return super(Numeric, cls).__new__(cls, num)
 
+    @property
+    def value(self):
+        """Ascii hex data"""
+        return b'%04X' % (self & 0xffff)
+
 class NumericReadOnly(ReadOnly, Numeric):
     """Read only numeric value"""
-    pass
+    __slots__ = ()
+
+LE16_TABLE = struct.Struct('<256H')
+S8_TABLE = struct.Struct('<256b')
 
 class CustomGammaTable(BinaryData, list):
     """Custom gamma table data"""
+    __slots__ = ()
+    size = 512
+
     def __init__(self, value):
         if isinstance(value, bytes):
-            assert len(value) == 512, '{} is not 512 bytes'.format(value)
-            self.value = value
+            assert len(value) == self.size, '{} is not {} bytes'.format(value, self.size)
+            super(CustomGammaTable, self).__init__(LE16_TABLE.unpack(value))
         else:
             assert len(value) == 256, '{} does not have 256 entries'.format(value)
-            self.value = list_to_le16_bytes(value)
+            for val in value:
+                assert not val >> 16
+            super(CustomGammaTable, self).__init__(value)
 
-        super(CustomGammaTable, self).__init__(le16_bytes_to_list(self.value))
+    @property
+    def value(self):
+        """16bit little-endian data"""
+        return LE16_TABLE.pack(*self)
 
 class PanelAlignment(BinaryData, list):
     """Panel Alignment Data"""
+    __slots__ = ()
+    size = 256
+
     def __init__(self, value):
         if isinstance(value, bytes):
-            assert len(value) == 256, '{} is not 256 bytes'.format(value)
-            self.value = value
+            assert len(value) == self.size, '{} is not {} bytes'.format(value, self.size)
+            super(PanelAlignment, self).__init__(S8_TABLE.unpack(value))
         else:
             assert len(value) == 256, '{} does not have 256 entries'.format(value)
-            self.value = list_to_s8_bytes(value)
+            for num in value:
+                assert -0x80 <= num < 0x80, '{} out of range'.format(num)
+            super(PanelAlignment, self).__init__(value)
 
-        super(PanelAlignment, self).__init__(s8_bytes_to_list(self.value))
+    @property
+    def value(self):
+        """8bit signed data"""
+        return S8_TABLE.pack(*self)
 
 class SourceAsk(ReadOnly, Enum):
     """Source Asking State"""
@@ -526,13 +590,349 @@ class Command(Enum):
     PMCalibratorInformation = b'PMCI' # Calibrator Information transmission/display (*5)
     LanSetup = b'LS'   # LAN setup [Lan Setup]
 
+def enum_decoder(valtype):
+    """Return function that looks up Enum member from wire data"""
+    members = valtype._value2member_map_
+    def decode(data):
+        try:
+            return members[data]
+        except KeyError:
+            raise ValueError('{!r} is not a valid {}'.format(data, valtype.__name__)) from None
+    return decode
+
+def instance_converter(valtype):
+    """Return function that converts value to valtype unless it already is one"""
+    def convert(val):
+        if val.__class__ is valtype:
+            return val
+        return valtype(val)
+    return convert
+
+class Codec:
+    """Conversion between values and wire data for a command"""
+    __slots__ = ('cmd', 'code', 'valtype', 'size', 'decode', 'convert')
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.code, self.valtype = cmd.value
+        self.size = getattr(self.valtype, 'size', None)
+        self.decode = self.valtype
+        self.convert = self.valtype
+        if issubclass(self.valtype, Enum):
+            self.decode = enum_decoder(self.valtype)
+        if not issubclass(self.valtype, BinaryData):
+            # Binary values are mutable lists, always copy them
+            self.convert = instance_converter(self.valtype)
+
+    def encode(self, val):
+        """Return wire data for value"""
+        return self.convert(val).value
+
+CODECS = {cmd: Codec(cmd) for cmd in Command if not isinstance(cmd.value, bytes)}
+
+# Seconds to reuse a value read from or written to the projector. Most settings
+# can also be changed with the remote control, so clear the cache after asking
+# the user to change something.
+CACHE_TTL = 10.0
+CACHE_TTL_VOLATILE = 1.0
+CACHE_SESSION_COMMANDS = {Command.Model}
+CACHE_VOLATILE_COMMANDS = {Command.Power, Command.SourceAsk}
+
+GAMMA_DATA_COMMANDS = {Command.GammaRed, Command.GammaGreen, Command.GammaBlue,
+                       Command.PMGammaRed, Command.PMGammaGreen, Command.PMGammaBlue}
+
+# Setting these commands can change any other value
+CACHE_INVALIDATE_ALL = {Command.Power, Command.Input, Command.Remote}
+
+# Values that can change when setting a command
+CACHE_DEPENDENCIES = {
+    Command.PictureMode: {cmd for cmd in Command
+                          if not isinstance(cmd.value, bytes) and cmd.value[0].startswith(b'PM')
+                          } | GAMMA_DATA_COMMANDS,
+    Command.GammaTable: {Command.GammaCorrection} | GAMMA_DATA_COMMANDS,
+    Command.GammaCorrection: GAMMA_DATA_COMMANDS,
+    Command.GammaRed: {Command.PMGammaRed},
+    Command.GammaGreen: {Command.PMGammaGreen},
+    Command.GammaBlue: {Command.PMGammaBlue},
+    Command.PMGammaRed: {Command.GammaRed},
+    Command.PMGammaGreen: {Command.GammaGreen},
+    Command.PMGammaBlue: {Command.GammaBlue},
+    }
+
+# Remote codes that only open and close menus
+NAVIGATION_CODES = {RemoteCode.Back, RemoteCode.Menu, RemoteCode.PictureAdjust}
+
+def changed_by(cmd, val=None):
+    """Return set of other commands that can change when setting cmd, or None for all"""
+    if cmd == Command.Remote and val in NAVIGATION_CODES:
+        return set()
+    if cmd in CACHE_INVALIDATE_ALL:
+        return None
+    return CACHE_DEPENDENCIES.get(cmd, set())
+
+def cache_ttl(cmd):
+    """Return number of seconds to cache value of cmd"""
+    if cmd in CACHE_SESSION_COMMANDS:
+        return math.inf
+    if cmd in CACHE_VOLATILE_COMMANDS or cmd.value[0].startswith(b'IF'):
+        return CACHE_TTL_VOLATILE
+    return CACHE_TTL
+
+class StateCache:
+    """Values read from or written to the projector on a connection"""
+    def __init__(self, stats=None, ttl=cache_ttl):
+        self.stats = stats
+        self.ttl = ttl
+        self.entries = dict()
+
+    def get(self, cmd):
+        """Return cached value of cmd, or None if not cached or expired"""
+        entry = self.entries.get(cmd)
+        if entry is None or time.monotonic() >= entry[1]:
+            if self.stats is not None:
+                self.stats.count('cache_miss', cmd.value[0])
+            return None
+        if self.stats is not None:
+            self.stats.count('cache_hit', cmd.value[0])
+        value = entry[0]
+        if isinstance(value, BinaryData):
+            return type(value)(value.value)
+        return value
+
+    def put(self, cmd, value):
+        """Cache value of cmd
+
+        Binary data is a mutable list, so the cache keeps its own copy and
+        returns a new copy on each hit.
+        """
+        ttl = self.ttl(cmd)
+        if ttl > 0:
+            if isinstance(value, BinaryData):
+                value = type(value)(value.value)
+            self.entries[cmd] = (value, time.monotonic() + ttl)
+
+    def invalidate(self, cmd, val=None):
+        """Remove cmd and values that can change when setting cmd to val"""
+        changes = changed_by(cmd, val)
+        if changes is None:
+            self.entries.clear()
+            return
+        self.entries.pop(cmd, None)
+        for dependency in changes:
+            self.entries.pop(dependency, None)
+
+    def clear(self):
+        """Remove all values"""
+        self.entries.clear()
+
+# Capability probe results
+ACKED = 'ack'            # Command acknowledged and answered
+NOT_ACKED = 'nack'       # Command not acknowledged, not supported by the model
+NO_RESPONSE = 'timeout'  # Command acknowledged but the response timed out
+
+# Saved in capability maps probed without a signal, which do not include nacks
+NO_SIGNAL_MARK = '-no-signal'
+
+FIRMWARE_CMD = Command.InfoSoftVersion.value
+
+class CommandUnsupported(CommandNack):
+    """Command not sent as the projector model does not support it"""
+    pass
+
+def capability_key(model, firmware):
+    """Return capability map key for model code and firmware version"""
+    return '{}/{}'.format(model.decode('latin-1'), firmware.decode('latin-1'))
+
+def load_capability_conf():
+    """Load saved capability maps, return empty dict if not available"""
+    try:
+        with open(capabilities_conf_file, 'r') as f:
+            return json.load(f)
+    except Exception:
+        return dict()
+
+class Capabilities:
+    """Probed command support of one projector model and firmware version
+
+    Commands that have not been probed, like write only commands, are
+    assumed to be supported.
+    """
+    def __init__(self, key=None, results=None, signal=True):
+        self.key = key
+        self.results = results or dict()
+        # Probed with a signal, so nacks are not caused by a missing signal
+        self.signal = signal
+
+    def supported(self, cmd):
+        """Return False if cmd is known not to be supported"""
+        return self.results.get(cmd.name, ACKED) == ACKED
+
+    def check(self, cmd):
+        """Raise CommandUnsupported if cmd is known not to be supported"""
+        result = self.results.get(cmd.name, ACKED)
+        if result != ACKED:
+            raise CommandUnsupported('{} is not supported by {} ({})'.format(
+                cmd.name, self.key, 'not acknowledged' if result == NOT_ACKED else 'no response'),
+                cmd.name)
+
+    def load(self):
+        """Load saved results for key, return False if there are none"""
+        results = load_capability_conf().get(self.key)
+        if results is None:
+            return False
+        self.signal = not results.pop(NO_SIGNAL_MARK, False)
+        self.results = results
+        return True
+
+    def save(self):
+        """Save results for key
+
+        Timeouts can be caused by the network or a busy projector, so they are
+        only used for the current session. Some commands are not acknowledged
+        without a signal, so nacks are only saved if the probe had a signal.
+        """
+        conf = load_capability_conf()
+        saved = {ACKED} if not self.signal else {ACKED, NOT_ACKED}
+        results = {name: result for name, result in self.results.items() if result in saved}
+        if not self.signal:
+            results[NO_SIGNAL_MARK] = True
+        conf[self.key] = results
+        with open(capabilities_conf_file, 'w') as f:
+            json.dump(conf, f, indent=2, sort_keys=True)
+
+    def probe(self, conn, cmds, signal=True):
+        """Send reference command for each of cmds and record the result
+
+        Returns False if the circuit breaker kept some commands from being
+        sent, their results are not known.
+        """
+        self.results = dict()
+        self.signal = signal
+        text = [cmd for cmd in cmds if get_request(cmd).size is None]
+        responses = list(zip(text, conn.cmd_ref_many([cmd.value[0] for cmd in text])))
+        for cmd in cmds:
+            codec = get_request(cmd)
+            if codec.size is None:
+                continue
+            try:
+                response = conn.cmd_ref_bin(codec.code, size=codec.size)
+            except (CommandNack, jvc_protocol.jvc_network.Timeout) as err:
+                response = err
+            responses.append((cmd, response))
+        complete = True
+        for cmd, response in responses:
+            result = probe_result(response)
+            if result is None:
+                complete = False
+            else:
+                self.results[cmd.name] = result
+        return complete
+
+def probe_result(response):
+    """Return capability probe result for response or exception returned by cmd_ref_many
+
+    Returns None if the command was not sent as the circuit breaker was open.
+    """
+    if isinstance(response, jvc_protocol.CircuitOpen):
+        return None
+    if isinstance(response, CommandNack):
+        return NOT_ACKED
+    if isinstance(response, jvc_protocol.jvc_network.Timeout):
+        return NO_RESPONSE
+    # A malformed response was still acknowledged
+    return ACKED
+
+def probe_commands():
+    """Return list of commands that can be probed by reading them"""
+    commands = []
+    for cmd in Command:
+        try:
+            get_request(cmd)
+        except (TypeError, NotImplementedError):
+            continue
+        commands.append(cmd)
+    return commands
+
+class StateTimeout(CommandNack):
+    """Command did not reach the expected value before the deadline"""
+    pass
+
+# First and maximum seconds between polls while waiting for a value, by current
+# value or by command. Warming up and cooling down take a minute or more, a
+# signal locks within a second or two.
+WAIT_INTERVALS_BY_VALUE = {
+    PowerState.Starting: (1.0, 3.0),
+    PowerState.Cooling: (1.0, 3.0),
+    }
+WAIT_INTERVALS = {
+    Command.Power: (0.5, 2.0),
+    Command.SourceAsk: (0.1, 0.5),
+    }
+WAIT_INTERVAL_DEFAULT = (0.25, 2.0)
+WAIT_BACKOFF = 1.5
+
+# Seconds to wait for the projector to warm up or cool down
+POWER_DEADLINE = 180.0
+
+def wait_predicate(predicate):
+    """Return function testing a value against a value, set of values or function"""
+    if callable(predicate):
+        return predicate
+    if isinstance(predicate, (set, frozenset, list, tuple)):
+        return lambda value: value in predicate
+    return lambda value: value == predicate
+
+class WaitSchedule:
+    """Poll intervals while waiting for the value of a command to change"""
+    def __init__(self, cmd, deadline=None):
+        self.cmd = cmd
+        self.deadline = None if deadline is None else time.monotonic() + deadline
+        self.timeout = deadline
+        self.value = None
+        self.interval = None
+        self.max_interval = None
+
+    def next_delay(self, value):
+        """Return seconds to wait before polling again after reading value
+
+        The interval starts over when the value changes and backs off while it
+        does not. Raises StateTimeout if the deadline has passed.
+        """
+        if isinstance(value, Exception):
+            value = None
+        if self.interval is None or value != self.value:
+            self.value = value
+            intervals = None
+            if isinstance(value, Enum):
+                intervals = WAIT_INTERVALS_BY_VALUE.get(value)
+            self.interval, self.max_interval = (
+                intervals or WAIT_INTERVALS.get(self.cmd, WAIT_INTERVAL_DEFAULT))
+        else:
+            self.interval = min(self.max_interval, self.interval * WAIT_BACKOFF)
+        if self.deadline is None:
+            return self.interval
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise StateTimeout('{} did not reach expected value in {:.1f} seconds'.format(
+                self.cmd.name, self.timeout), self.cmd.name, value)
+        return min(self.interval, remaining)
+
 class JVCCommand:
     """JVC projector low level command processing class"""
-    def __init__(self, print_cmd_send=False, print_cmd_res=False, print_all=False, **args):
+    def __init__(self, print_cmd_send=False, print_cmd_res=False, print_all=False, cache=False,
+                 capabilities=False, **args):
         self.print_cmd_send = print_cmd_send or print_all
         self.print_cmd_res = print_cmd_res or print_all
         self.print_cmd_bin_res = print_all
         self.conn = jvc_protocol.JVCConnection(print_all=print_all, **args)
+        if cache is True:
+            cache = StateCache(stats=self.conn.stats)
+        self.cache = cache or None
+        if capabilities is True:
+            capabilities = Capabilities()
+        self.capabilities = capabilities or None
+        # Projector was not on when capabilities were needed, probe when it is seen on
+        self.capabilities_deferred = False
 
     def __enter__(self):
         self.conn.__enter__()
@@ -541,48 +941,395 @@ class JVCCommand:
     def __exit__(self, exception, value, traceback):
         self.conn.__exit__(exception, value, traceback)
 
+    def cache_clear(self):
+        """Forget cached values, call after the user may have changed settings"""
+        if self.cache is not None:
+            self.cache.clear()
+        self.capabilities_deferred = False
+
+    def capability_map(self, reprobe=False):
+        """Return Capabilities of the projector, probing it if not known
+
+        Returns None if capabilities are not used, or if the projector is not
+        on, as most commands are not acknowledged in standby. The power state
+        is then not queried again until the projector is seen on, or the cache
+        is cleared.
+        """
+        caps = self.capabilities
+        if caps is None or (caps.key is not None and not reprobe):
+            return caps
+        if self.capabilities_deferred and not reprobe:
+            return None
+        if self.conn.cmd_ref(Command.Power.value[0]) != PowerState.LampOn.value:
+            self.capabilities_deferred = True
+            return None
+        self.capabilities_deferred = False
+        if self.conn.model is None:
+            self.conn.model = self.conn.cmd_ref(Command.Model.value[0])
+        model = self.conn.model
+        # Models without a firmware version query are saved with an empty version
+        if capability_key(model, b'') in load_capability_conf():
+            firmware = b''
+        else:
+            try:
+                firmware = self.conn.cmd_ref(FIRMWARE_CMD)
+            except (CommandNack, jvc_protocol.jvc_network.Timeout):
+                firmware = b''
+        caps.key = capability_key(model, firmware)
+        loaded = not reprobe and caps.load()
+        if loaded and caps.signal:
+            return caps
+        # A map probed without a signal is probed again once there is a signal
+        signal = self.signal_available()
+        if not loaded or signal:
+            print('Probing commands supported by', caps.key)
+            if caps.probe(self.conn, probe_commands(), signal=signal):
+                caps.save()
+        return caps
+
+    def signal_available(self):
+        """Return True if the projector reports an input signal"""
+        try:
+            return self.conn.cmd_ref(Command.SourceAsk.value[0]) == SourceAsk.SignalAvailable.value
+        except (CommandNack, jvc_protocol.jvc_network.Timeout):
+            return False
+
+    def check_supported(self, cmd):
+        """Raise CommandUnsupported if the projector is known not to support cmd"""
+        caps = self.capability_map()
+        if caps is None:
+            return
+        try:
+            caps.check(cmd)
+        except CommandUnsupported:
+            if self.conn.stats is not None:
+                self.conn.stats.count('unsupported', cmd.value[0])
+            raise
+
+    def supported(self, cmd):
+        """Return False if the projector is known not to support cmd"""
+        caps = self.capability_map()
+        return caps is None or caps.supported(cmd)
+
+    def observe(self, cmd, value):
+        """Note value read from the projector"""
+        if cmd == Command.Power and value == PowerState.LampOn:
+            self.capabilities_deferred = False
+
     def get(self, cmd):
+        """Send reference command and convert response, or return cached value"""
+        if self.cache is not None:
+            value = self.cache.get(cmd)
+            if value is not None:
+                return value
+        value = self._get(cmd)
+        if self.cache is not None:
+            self.cache.put(cmd, value)
+        return value
+
+    def _get(self, cmd):
         """Send reference command and convert response"""
-        if isinstance(cmd.value, bytes):
-            raise NotImplementedError('Get is not implemented for {}'.format(cmd.name))
-        cmdcode, valtype = cmd.value
-        if issubclass(valtype, WriteOnly):
-            raise TypeError('{} is a write only command'.format(cmd.name))
+        codec = get_request(cmd)
+        if self.capabilities is not None:
+            self.check_supported(cmd)
         try:
-            if issubclass(valtype, BinaryData):
-                response = self.conn.cmd_ref_bin(cmdcode)
+            if codec.size is not None:
+                response = self.conn.cmd_ref_bin(codec.code, size=codec.size)
             else:
-                response = self.conn.cmd_ref(cmdcode)
-            return valtype(response)
+                response = self.conn.cmd_ref(codec.code)
+            value = codec.decode(response)
         except CommandNack as err:
             raise CommandNack('Get: ' + err.args[0], cmd.name)
+        self.observe(cmd, value)
+        return value
+
+    def get_many(self, cmds, cached=True):
+        """Send reference commands, pipelined if possible, and return dict of converted responses
+
+        Commands that fail have the exception as value. If cached is False
+        all commands are sent, and the cache is only updated.
+        """
+        values = dict()
+        if self.cache is not None and cached:
+            for cmd in cmds:
+                value = self.cache.get(cmd)
+                if value is not None:
+                    values[cmd] = value
+        if self.capabilities is not None:
+            for cmd in cmds:
+                if cmd not in values:
+                    try:
+                        self.check_supported(cmd)
+                    except CommandUnsupported as err:
+                        values[cmd] = err
+        requests = [(cmd, get_request(cmd)) for cmd in cmds if cmd not in values]
+        responses = iter(self.conn.cmd_ref_many(
+            [codec.code for _, codec in requests if codec.size is None]))
+        for cmd, codec in requests:
+            if codec.size is not None:
+                try:
+                    values[cmd] = self.get(cmd) if cached else self._get(cmd)
+                except GET_ERRORS as err:
+                    values[cmd] = err
+                continue
+            values[cmd] = decode_many_response(cmd, codec, next(responses))
+            if not isinstance(values[cmd], Exception):
+                self.observe(cmd, values[cmd])
+                if self.cache is not None:
+                    self.cache.put(cmd, values[cmd])
+        return {cmd: values[cmd] for cmd in cmds}
+
+    def wait_for(self, cmd, predicate, deadline=None, then=()):
+        """Poll cmd until its value matches predicate and return the value
+
+        predicate is a value, a set of values or a function of the value.
+        Commands that are not acknowledged, like most commands while the
+        projector warms up, or not answered in time are polled again. Raises StateTimeout if deadline
+        seconds pass first. As soon as the value matches, each (cmd, value) in
+        then is set in order.
+        """
+        test = wait_predicate(predicate)
+        schedule = WaitSchedule(cmd, deadline)
+        while True:
+            try:
+                value = self._get(cmd)
+            except CommandUnsupported:
+                raise
+            except (CommandNack, jvc_protocol.jvc_network.Timeout) as err:
+                value = err
+            else:
+                if self.cache is not None:
+                    self.cache.put(cmd, value)
+                if test(value):
+                    break
+            time.sleep(schedule.next_delay(value))
+        for setcmd, val in then:
+            self.set(setcmd, val)
+        return value
+
+    def power_on(self, deadline=POWER_DEADLINE):
+        """Turn projector on if it is not on and wait until it is ready
+
+        deadline is the total number of seconds to wait for the projector to
+        cool down and warm up.
+        """
+        end = None if deadline is None else time.monotonic() + deadline
+        power_state = self.wait_for(Command.Power, lambda state: state != PowerState.Cooling,
+                                    deadline)
+        if power_state == PowerState.Error:
+            raise CommandNack('Projector is in error state')
+        if power_state == PowerState.StandBy:
+            self.set(Command.Power, PowerState.LampOn)
+        remaining = None if end is None else max(0.0, end - time.monotonic())
+        return self.wait_for(Command.Power, PowerState.LampOn, remaining)
 
     def set(self, cmd, val, verify=True):
         """Send operation command"""
-        cmdcode, valtype = cmd.value
-        assert not issubclass(valtype, ReadOnly), '{} is a read only command'.format(cmd)
-        val = valtype(val)
-        assert(isinstance(val, valtype)), '{} is not {}'.format(val, valtype)
+        cmddata, codec, val, kwargs = set_request(cmd, val)
+        if self.capabilities is not None:
+            self.check_supported(cmd)
+        if self.cache is not None:
+            self.cache.invalidate(cmd, val)
         try:
-            if issubclass(valtype, BinaryData):
-                self.conn.cmd_op(cmdcode, sendrawdata=val.value)
+            self.conn.cmd_op(cmddata, **kwargs)
+        except CommandNack as err:
+            raise CommandNack('Set: ' + err.args[0], cmd.name, val)
+
+        if issubclass(codec.valtype, NoVerify):
+            return
+        if not verify:
+            if self.cache is not None:
+                self.cache.put(cmd, val)
+            return
+
+        verify_val = self._get(cmd)
+        if self.cache is not None:
+            self.cache.put(cmd, verify_val)
+        check_verify(cmd, val, verify_val)
+
+# Errors returned in place of values by get_many
+GET_ERRORS = (CommandNack, ValueError, AssertionError, jvc_protocol.Error,
+              jvc_protocol.jvc_network.Timeout)
+
+def decode_many_response(cmd, codec, response):
+    """Return value decoded from cmd_ref_many response, or the error in its place"""
+    if isinstance(response, CommandNack):
+        return CommandNack('Get: ' + response.args[0], cmd.name)
+    if isinstance(response, Exception):
+        return response
+    try:
+        return codec.decode(response)
+    except (ValueError, AssertionError) as err:
+        return err
+
+def get_request(cmd):
+    """Check that cmd can be read and return its Codec"""
+    codec = CODECS.get(cmd)
+    if codec is None:
+        raise NotImplementedError('Get is not implemented for {}'.format(cmd.name))
+    if issubclass(codec.valtype, WriteOnly):
+        raise TypeError('{} is a write only command'.format(cmd.name))
+    return codec
+
+def set_request(cmd, val):
+    """Convert val for cmd and return command data, Codec, value and cmd_op arguments"""
+    codec = CODECS.get(cmd)
+    if codec is None:
+        raise NotImplementedError('Set is not implemented for {}'.format(cmd.name))
+    valtype = codec.valtype
+    assert not issubclass(valtype, ReadOnly), '{} is a read only command'.format(cmd)
+    val = codec.convert(val)
+    assert(isinstance(val, valtype)), '{} is not {}'.format(val, valtype)
+    if codec.size is not None:
+        return codec.code, codec, val, {'sendrawdata': val.value}
+    return codec.code + val.value, codec, val, {}
+
+def check_verify(cmd, val, verify_val):
+    """Raise CommandNack if value read back does not match value written"""
+    if verify_val != val:
+        raise CommandNack('Verify error: ' + cmd.name, val, verify_val)
+
+class AsyncJVCCommand:
+    """JVC projector command processing class for asyncio
+
+    Commands go through the same protocol core as JVCCommand. Capability
+    maps are not supported, probe them with JVCCommand.
+    """
+    def __init__(self, print_cmd_send=False, print_cmd_res=False, print_all=False, cache=False,
+                 **args):
+        self.print_cmd_send = print_cmd_send or print_all
+        self.print_cmd_res = print_cmd_res or print_all
+        self.print_cmd_bin_res = print_all
+        self.conn = jvc_protocol.AsyncJVCConnection(print_all=print_all, **args)
+        if cache is True:
+            cache = StateCache(stats=self.conn.stats)
+        self.cache = cache or None
+
+    async def __aenter__(self):
+        await self.conn.__aenter__()
+        return self
+
+    async def __aexit__(self, exception, value, traceback):
+        await self.conn.__aexit__(exception, value, traceback)
+
+    def cache_clear(self):
+        """Forget cached values, call after the user may have changed settings"""
+        if self.cache is not None:
+            self.cache.clear()
+
+    async def get(self, cmd):
+        """Send reference command and convert response, or return cached value"""
+        if self.cache is not None:
+            value = self.cache.get(cmd)
+            if value is not None:
+                return value
+        value = await self._get(cmd)
+        if self.cache is not None:
+            self.cache.put(cmd, value)
+        return value
+
+    async def _get(self, cmd):
+        """Send reference command and convert response"""
+        codec = get_request(cmd)
+        try:
+            if codec.size is not None:
+                response = await self.conn.cmd_ref_bin(codec.code, size=codec.size)
             else:
-                self.conn.cmd_op(cmdcode+val.value, acktimeout=5)
+                response = await self.conn.cmd_ref(codec.code)
+            return codec.decode(response)
+        except CommandNack as err:
+            raise CommandNack('Get: ' + err.args[0], cmd.name)
+
+    async def get_many(self, cmds, cached=True):
+        """Send reference commands, pipelined if possible, and return dict, see JVCCommand"""
+        values = dict()
+        if self.cache is not None and cached:
+            for cmd in cmds:
+                value = self.cache.get(cmd)
+                if value is not None:
+                    values[cmd] = value
+        requests = [(cmd, get_request(cmd)) for cmd in cmds if cmd not in values]
+        responses = iter(await self.conn.cmd_ref_many(
+            [codec.code for _, codec in requests if codec.size is None]))
+        for cmd, codec in requests:
+            if codec.size is not None:
+                try:
+                    values[cmd] = await (self.get(cmd) if cached else self._get(cmd))
+                except GET_ERRORS as err:
+                    values[cmd] = err
+                continue
+            values[cmd] = decode_many_response(cmd, codec, next(responses))
+            if self.cache is not None and not isinstance(values[cmd], Exception):
+                self.cache.put(cmd, values[cmd])
+        return {cmd: values[cmd] for cmd in cmds}
+
+    async def wait_for(self, cmd, predicate, deadline=None, then=()):
+        """Poll cmd until its value matches predicate and return the value, see JVCCommand"""
+        test = wait_predicate(predicate)
+        schedule = WaitSchedule(cmd, deadline)
+        while True:
+            try:
+                value = await self._get(cmd)
+            except (CommandNack, jvc_protocol.jvc_network.Timeout) as err:
+                value = err
+            else:
+                if self.cache is not None:
+                    self.cache.put(cmd, value)
+                if test(value):
+                    break
+            await asyncio.sleep(schedule.next_delay(value))
+        for setcmd, val in then:
+            await self.set(setcmd, val)
+        return value
+
+    async def power_on(self, deadline=POWER_DEADLINE):
+        """Turn projector on if it is not on and wait until it is ready, see JVCCommand"""
+        end = None if deadline is None else time.monotonic() + deadline
+        power_state = await self.wait_for(
+            Command.Power, lambda state: state != PowerState.Cooling, deadline)
+        if power_state == PowerState.Error:
+            raise CommandNack('Projector is in error state')
+        if power_state == PowerState.StandBy:
+            await self.set(Command.Power, PowerState.LampOn)
+        remaining = None if end is None else max(0.0, end - time.monotonic())
+        return await self.wait_for(Command.Power, PowerState.LampOn, remaining)
+
+    async def set(self, cmd, val, verify=True):
+        """Send operation command"""
+        cmddata, codec, val, kwargs = set_request(cmd, val)
+        if self.cache is not None:
+            self.cache.invalidate(cmd, val)
+        try:
+            await self.conn.cmd_op(cmddata, **kwargs)
         except CommandNack as err:
             raise CommandNack('Set: ' + err.args[0], cmd.name, val)
 
-        if not verify or issubclass(valtype, NoVerify):
+        if issubclass(codec.valtype, NoVerify):
+            return
+        if not verify:
+            if self.cache is not None:
+                self.cache.put(cmd, val)
             return
 
-        verify_val = self.get(cmd)
-        if verify_val != val:
-            raise CommandNack('Verify error: ' + cmd.name, val, verify_val)
+        verify_val = await self._get(cmd)
+        if self.cache is not None:
+            self.cache.put(cmd, verify_val)
+        check_verify(cmd, val, verify_val)
 
 def main():
     """JVC command class test"""
+    parser = argparse.ArgumentParser(description='Read all settings from projector')
+    parser.add_argument('--reprobe', action='store_true',
+                        help='probe which commands the projector supports again')
+    parser.add_argument('--stats', action='store_true',
+                        help='print command latency and retry statistics at exit')
+    args = parser.parse_args()
+    if args.stats:
+        jvc_stats.enable(dump_at_exit=True)
     print('test jvc command class')
     try:
-        with JVCCommand(print_all=False) as jvc:
+        with JVCCommand(print_all=False, capabilities=True,
+                        policy=jvc_protocol.SESSION_POLICY) as jvc:
             jvc.set(Command.Null, Null.Null)
             model = jvc.get(Command.Model)
             print('Model:', model)
@@ -593,26 +1340,37 @@ def main():
                     power_state.name))
                 res = input('Enter "on" to send power on command, or "i" to ignore: ')
                 if res == 'on':
+                    print('Waiting for projector to turn on...')
                     try:
-                        jvc.set(Command.Power, PowerState.LampOn)
-                    except jvc_protocol.CommandNack:
-                        print('Failed to set power')
+                        power_state = jvc.power_on()
+                    except jvc_protocol.CommandNack as err:
+                        print('Failed to turn on:', err.args[0])
+                        power_state = jvc.get(Command.Power)
                 elif res == 'i':
                     break
-                power_state = jvc.get(Command.Power)
+                else:
+                    power_state = jvc.get(Command.Power)
+
+            if args.reprobe:
+                jvc.capability_map(reprobe=True)
 
+            commands = []
             skipped = []
             for command in Command:
                 try:
-                    res = jvc.get(command)
-                    if isinstance(res, list):
-                        dumpdata.dumpdata(command.name, '{:4}', res, limit=16)
-                    else:
-                        print('{}: {!s}'.format(command.name, res))
-                except CommandNack as err:
-                    print('-{}: {!s}'.format(command.name, err.args[0]))
+                    get_request(command)
+                    commands.append(command)
                 except (TypeError, NotImplementedError) as err:
                     skipped.append((command, err))
+            for command, res in jvc.get_many(commands).items():
+                if isinstance(res, CommandUnsupported):
+                    print('-Unsupported {}'.format(command.name))
+                elif isinstance(res, Exception):
+                    print('-{}: {!s}'.format(command.name, res.args[0]))
+                elif isinstance(res, list):
+                    dumpdata.dumpdata(command.name, '{:4}', res, limit=16)
+                else:
+                    print('{}: {!s}'.format(command.name, res))
             for command, err in skipped:
                 print('-Skipped {}: {!s}'.format(command.name, err))
 
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+"""JVC projector discovery
+
+Probe a list of hosts or networks concurrently for the projector port, confirm
+the PJ_OK greeting and identify each projector with the model query.
+"""
+
+import argparse
+import asyncio
+import ipaddress
+import json
+import socket
+import time
+
+import jvc_network
+import jvc_protocol
+from jvc_command import Command, Model
+
+cache_file = 'jvc_discover.cache'
+
+CACHE_TTL = 600
+DEFAULT_DEADLINE = 1.0
+MAX_CONCURRENT = 256
+
+class Projector:
+    """Discovered projector"""
+    def __init__(self, host, port, model_code):
+        self.host = host
+        self.port = port
+        self.model_code = model_code
+
+    @property
+    def model(self):
+        """Return Model enum or None if model is not known"""
+        try:
+            return Model(self.model_code)
+        except ValueError:
+            return None
+
+    @property
+    def host_port(self):
+        """Return (host, port) tuple"""
+        return (self.host, self.port)
+
+    def __repr__(self):
+        model = self.model
+        return '{}:{} {}'.format(self.host, self.port,
+                                 model.name if model else self.model_code.decode(errors='replace'))
+
+    def to_conf(self):
+        """Return json serializable dict"""
+        return {'host': self.host, 'port': self.port,
+                'model': self.model_code.decode('latin-1')}
+
+    @classmethod
+    def from_conf(cls, conf):
+        """Create from dict returned by to_conf"""
+        return cls(conf['host'], conf['port'], conf['model'].encode('latin-1'))
+
+def local_network():
+    """Return the /24 network of the interface used for the default route"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.connect(('192.0.2.1', 9)) # No packets are sent for udp connect
+        address = sock.getsockname()[0]
+    except OSError:
+        address = socket.gethostbyname(socket.gethostname())
+    finally:
+        sock.close()
+    return ipaddress.ip_network(address + '/24', strict=False)
+
+def expand_hosts(targets):
+    """Expand list of hostnames, addresses and networks to list of hosts"""
+    hosts = []
+    for target in targets:
+        try:
+            network = ipaddress.ip_network(target, strict=False)
+        except ValueError:
+            hosts.append(target)
+            continue
+        if network.num_addresses == 1:
+            hosts.append(str(network.network_address))
+        else:
+            hosts.extend(str(host) for host in network.hosts())
+    return hosts
+
+async def probe(host, port, semaphore):
+    """Return Projector if host answers with the projector handshake and model, or None"""
+    async with semaphore:
+        conn = jvc_protocol.AsyncJVCConnection(host_port=(host, port))
+        try:
+            await conn.conn.connect()
+        except (jvc_network.Error, jvc_network.Timeout, jvc_network.Closed):
+            return None
+        try:
+            return Projector(host, port, await conn.cmd_ref(Command.Model.value[0]))
+        except Exception:
+            return Projector(host, port, b'')
+        finally:
+            await conn.conn.close()
+
+async def async_discover(hosts, port=jvc_network.DEFAULT_PORT, deadline=DEFAULT_DEADLINE):
+    """Probe all hosts concurrently and return the projectors found before the deadline"""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+    tasks = [asyncio.ensure_future(probe(host, port, semaphore)) for host in hosts]
+    if not tasks:
+        return []
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    return [task.result() for task in tasks
+            if task in done and not task.exception() and task.result() is not None]
+
+def load_cache(key, ttl):
+    """Return cached projectors for key if any were found not longer than ttl ago, or None"""
+    try:
+        with open(cache_file, 'r') as f:
+            entry = json.load(f).get(key)
+    except Exception:
+        return None
+    if not entry or not entry['projectors'] or time.time() - entry['time'] > ttl:
+        return None
+    return [Projector.from_conf(conf) for conf in entry['projectors']]
+
+def save_cache(key, projectors):
+    """Save projectors found for key to cache file"""
+    try:
+        with open(cache_file, 'r') as f:
+            cache = json.load(f)
+    except Exception:
+        cache = dict()
+    now = time.time()
+    cache = {k: v for k, v in cache.items() if now - v['time'] <= CACHE_TTL}
+    cache[key] = {'time': now, 'projectors': [p.to_conf() for p in projectors]}
+    with open(cache_file, 'w') as f:
+        json.dump(cache, f)
+
+def discover(targets=None, port=jvc_network.DEFAULT_PORT, deadline=DEFAULT_DEADLINE,
+             ttl=CACHE_TTL, use_cache=True):
+    """Find projectors on hosts or networks in targets (default local /24 network)"""
+    if not targets:
+        targets = [str(local_network())]
+    key = '{} {}'.format(' '.join(targets), port)
+    if use_cache:
+        projectors = load_cache(key, ttl)
+        if projectors is not None:
+            return projectors
+    projectors = asyncio.run(async_discover(expand_hosts(targets), port, deadline))
+    # A projector in standby or still booting may answer the next search
+    if projectors:
+        save_cache(key, projectors)
+    return projectors
+
+def main():
+    """Find projectors on the local network"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('targets', nargs='*',
+                        help='hosts or networks to probe (default local /24 network)')
+    parser.add_argument('--port', type=int, default=jvc_network.DEFAULT_PORT)
+    parser.add_argument('--deadline', type=float, default=DEFAULT_DEADLINE,
+                        help='total time to wait for answers in seconds')
+    parser.add_argument('--refresh', action='store_true', help='ignore cached results')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    projectors = discover(args.targets, port=args.port, deadline=args.deadline,
+                          use_cache=not args.refresh)
+    for projector in projectors:
+        print(projector)
+    print('Found {} projector(s) in {:.3f}s'.format(len(projectors), time.perf_counter() - start))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+
+"""JVC projector emulator
+
+Local TCP server that speaks the projector network protocol for testing and
+benchmarking without a projector. It performs the PJ_OK/PJREQ/PJACK handshake,
+acks commands, returns reference responses for every Command with a defined
+type, accepts binary gamma table uploads and keeps settings between commands.
+Like the projector it only serves a single connection at a time.
+"""
+
+import argparse
+import socket
+import socketserver
+import threading
+import time
+from enum import Enum
+
+import jvc_network
+from jvc_command import (
+    Command, BinaryData, CustomGammaTable, PanelAlignment, Numeric, ReadOnly, WriteOnly,
+    GammaTable, GammaCorrection, Model, PictureMode, PowerState, SourceAsk,
+    list_to_le16_bytes)
+from jvc_protocol import Header, UNIT_ID, END, ack_packet
+
+# Approximate response times in seconds, scaled by latency_scale
+DEFAULT_LATENCY = {
+    'handshake': 0.05,
+    'ack': 0.02,
+    'response': 0.03,
+    'data_ack': 0.3,
+    }
+
+# Extra ack latency for slow operation commands in seconds, scaled by latency_scale
+DEFAULT_COMMAND_LATENCY = {
+    Command.PictureMode.value[0]: 0.5,
+    Command.Input.value[0]: 0.5,
+    }
+
+DEFAULT_STATE = {
+    Command.Model: Model.DLA_X750R_X7000_XC7890R_RS500_X950R_X9000_RS600_PX1.value,
+    Command.Power: PowerState.LampOn.value,
+    Command.SourceAsk: SourceAsk.SignalAvailable.value,
+    Command.PictureMode: PictureMode.User1.value,
+    Command.GammaTable: GammaTable.Custom1.value,
+    Command.GammaCorrection: GammaCorrection.Import.value,
+    Command.InfoSource: b'19',
+    Command.InfoDeepColor: b'1',
+    Command.InfoColorSpace: b'1',
+    Command.InfoHorizontalResolution: b'0F00',
+    Command.InfoVerticalResolution: b'0870',
+    Command.InfoHorizontalFrequency: b'0546',
+    Command.InfoVerticalFrequency: b'0960',
+    Command.InfoLampTime: b'01F4',
+    }
+
+GAMMA_COLORS = {
+    Command.GammaRed.value[0]: 0,
+    Command.GammaGreen.value[0]: 1,
+    Command.GammaBlue.value[0]: 2,
+    Command.PMGammaRed.value[0]: 0,
+    Command.PMGammaGreen.value[0]: 1,
+    Command.PMGammaBlue.value[0]: 2,
+    }
+
+# Commands the projector responds to when the lamp is not on
+STANDBY_COMMANDS = {Command.Null, Command.Power, Command.Model}
+
+def default_value(cmd):
+    """Return default wire value for command"""
+    if cmd in DEFAULT_STATE:
+        return DEFAULT_STATE[cmd]
+    _, valtype = cmd.value
+    if issubclass(valtype, Enum):
+        return next(iter(valtype)).value
+    if issubclass(valtype, Numeric):
+        return b'0000'
+    return None
+
+class ProjectorState:
+    """Emulated projector settings"""
+    def __init__(self, warmup=0.0, cooldown=0.0, strict_power=True, unsupported=()):
+        self.warmup = warmup
+        self.cooldown = cooldown
+        self.strict_power = strict_power
+        self.unsupported = set(unsupported)
+        self.lock = threading.Lock()
+        self.commands = dict()
+        self.values = dict()
+        for cmd in Command:
+            if isinstance(cmd.value, bytes):
+                continue
+            self.commands[cmd.value[0]] = cmd
+            value = default_value(cmd)
+            if value is not None:
+                self.values[cmd] = value
+        self.codes = sorted(self.commands, key=len, reverse=True)
+        linear = list_to_le16_bytes([round(i * 1023 / 255) for i in range(256)])
+        self.gamma = {(slot.value, color): linear
+                      for slot in (GammaTable.Custom1, GammaTable.Custom2, GammaTable.Custom3)
+                      for color in range(3)}
+        self.panel_alignment = {cmd: bytes(PanelAlignment.size)
+                                for cmd in (Command.PanelAlignRed, Command.PanelAlignBlue)}
+        self.power_transition = None
+
+    def find(self, cmdtype, cmd):
+        """Return Command and operation argument for command bytes"""
+        if cmdtype == Header.reference:
+            return self.commands.get(cmd), b''
+        for code in self.codes:
+            if cmd.startswith(code):
+                return self.commands[code], cmd[len(code):]
+        return None, b''
+
+    def power(self):
+        """Return power state after completing any timed transition"""
+        if self.power_transition is not None:
+            target, done = self.power_transition
+            if time.monotonic() >= done:
+                self.values[Command.Power] = target
+                self.power_transition = None
+        return self.values[Command.Power]
+
+    def supported(self, cmdtype, command, arg):
+        """Return True if the projector would ack the command"""
+        if command is None or command in self.unsupported:
+            return False
+        valtype = command.value[1]
+        if self.strict_power and command not in STANDBY_COMMANDS:
+            if self.power() != PowerState.LampOn.value:
+                return False
+        if cmdtype == Header.reference:
+            return not issubclass(valtype, WriteOnly)
+        if issubclass(valtype, ReadOnly):
+            return False
+        if issubclass(valtype, BinaryData):
+            return arg == b''
+        if issubclass(valtype, Enum):
+            return arg in valtype._value2member_map_
+        if issubclass(valtype, Numeric):
+            try:
+                int(arg, 16)
+            except ValueError:
+                return False
+            return len(arg) == 4
+        return False
+
+    def get(self, command):
+        """Return wire response for reference command"""
+        if command == Command.Power:
+            return self.power()
+        valtype = command.value[1]
+        if issubclass(valtype, CustomGammaTable):
+            slot = self.values[Command.GammaTable]
+            return self.gamma.get((slot, GAMMA_COLORS[command.value[0]]), bytes(valtype.size))
+        if issubclass(valtype, PanelAlignment):
+            return self.panel_alignment[command]
+        return self.values.get(command, b'')
+
+    def set(self, command, arg):
+        """Apply operation command argument"""
+        if command == Command.Power:
+            power = self.power()
+            if arg == PowerState.LampOn.value and power == PowerState.StandBy.value:
+                self.values[Command.Power] = PowerState.Starting.value
+                self.power_transition = (arg, time.monotonic() + self.warmup)
+            elif arg == PowerState.StandBy.value and power == PowerState.LampOn.value:
+                self.values[Command.Power] = PowerState.Cooling.value
+                self.power_transition = (arg, time.monotonic() + self.cooldown)
+            self.power()
+        elif not issubclass(command.value[1], WriteOnly):
+            self.values[command] = arg
+
+    def set_binary(self, command, data):
+        """Store binary data"""
+        valtype = command.value[1]
+        if issubclass(valtype, CustomGammaTable):
+            slot = self.values[Command.GammaTable]
+            self.gamma[(slot, GAMMA_COLORS[command.value[0]])] = data
+        else:
+            self.panel_alignment[command] = data
+
+class JVCEmulatorHandler(socketserver.StreamRequestHandler):
+    """Handle a single emulated projector connection"""
+    disable_nagle_algorithm = True
+
+    def delay(self, phase, code=None):
+        """Sleep for the configured latency of phase"""
+        server = self.server
+        delay = server.latency.get(phase, 0)
+        if code is not None and phase == 'ack':
+            delay += server.command_latency.get(code, 0)
+        delay *= server.latency_scale
+        if delay > 0:
+            time.sleep(delay)
+
+    def send(self, data):
+        """Send data to client"""
+        self.request.sendall(data)
+
+    def done(self):
+        """Finish command, discarding commands received while busy if not pipelining"""
+        if self.server.pipelining:
+            return
+        self.request.setblocking(False)
+        try:
+            while self.rfile.read1(4096):
+                pass
+        except (BlockingIOError, TypeError):
+            pass
+        finally:
+            self.request.settimeout(self.server.idle_timeout)
+
+    def handle(self):
+        server = self.server
+        state = server.state
+        self.request.settimeout(server.idle_timeout)
+        self.delay('handshake')
+        self.send(jvc_network.PJ_OK)
+        if self.rfile.read(len(jvc_network.PJREQ)) != jvc_network.PJREQ:
+            return
+        self.send(jvc_network.PJACK)
+        while True:
+            try:
+                packet = self.rfile.readline()
+            except socket.timeout:
+                return
+            if not packet.endswith(END):
+                return
+            try:
+                cmdtype = Header(packet[:1])
+            except ValueError:
+                continue
+            if cmdtype not in (Header.operation, Header.reference) or packet[1:3] != UNIT_ID:
+                continue
+            cmd = packet[3:-1]
+            server.command_count += 1
+            with state.lock:
+                command, arg = state.find(cmdtype, cmd)
+                if not state.supported(cmdtype, command, arg):
+                    server.nack_count += 1
+                    self.done()
+                    continue
+            self.delay('ack', command.value[0] if cmdtype == Header.operation else None)
+            valtype = command.value[1]
+            if cmdtype == Header.operation and not issubclass(valtype, BinaryData):
+                self.done()
+            self.send(ack_packet(cmd))
+
+            if cmdtype == Header.reference:
+                self.delay('response')
+                with state.lock:
+                    value = state.get(command)
+                self.done()
+                if issubclass(valtype, BinaryData):
+                    self.send(value)
+                else:
+                    self.send(Header.response.value + UNIT_ID + cmd[:2] + value + END)
+                continue
+
+            if issubclass(valtype, BinaryData):
+                data = self.rfile.read(valtype.size)
+                if len(data) != valtype.size:
+                    return
+                with state.lock:
+                    state.set_binary(command, data)
+                self.delay('data_ack')
+                self.done()
+                self.send(ack_packet(cmd))
+                continue
+
+            with state.lock:
+                state.set(command, arg)
+
+class JVCEmulator(socketserver.TCPServer):
+    """Emulated JVC projector, serving one connection at a time"""
+    allow_reuse_address = True
+
+    def __init__(self, host_port=('127.0.0.1', 0), latency_scale=1.0, latency=None,
+                 command_latency=None, idle_timeout=None, pipelining=True, **state_args):
+        super().__init__(host_port, JVCEmulatorHandler)
+        self.latency_scale = latency_scale
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.command_latency = dict(DEFAULT_COMMAND_LATENCY, **(command_latency or {}))
+        self.idle_timeout = idle_timeout
+        self.pipelining = pipelining
+        self.state = ProjectorState(**state_args)
+        self.command_count = 0
+        self.nack_count = 0
+        self.thread = None
+
+    @property
+    def host_port(self):
+        """Address clients should connect to"""
+        return self.server_address[:2]
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exception, value, traceback):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+def selftest(emulator):
+    """Read every command and write a gamma curve to the emulator"""
+    import jvc_command
+    from jvc_gamma import GammaCurve
+
+    with jvc_command.JVCCommand(host_port=emulator.host_port) as jvc:
+        for command in Command:
+            try:
+                print('{}: {!s}'.format(command.name, jvc.get(command)))
+            except (TypeError, NotImplementedError):
+                pass
+        start = time.perf_counter()
+        GammaCurve().write_jvc(jvc, verify=True)
+        print('write_jvc {:.3f}s'.format(time.perf_counter() - start))
+    print('commands {}, not acked {}'.format(emulator.command_count, emulator.nack_count))
+
+def main():
+    """Run projector emulator"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--listen', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=jvc_network.DEFAULT_PORT,
+                        help='port to listen on (0 picks a free port)')
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help='scale factor for emulated response times')
+    parser.add_argument('--warmup', type=float, default=10.0, help='power on time in seconds')
+    parser.add_argument('--no-pipelining', action='store_true',
+                        help='discard commands received while busy')
+    parser.add_argument('--unsupported', default='',
+                        help='comma separated command names the emulated model does not ack')
+    parser.add_argument('--test', action='store_true', help='run self test against emulator')
+    args = parser.parse_args()
+    unsupported = [Command[name] for name in args.unsupported.split(',') if name]
+
+    with JVCEmulator((args.listen, args.port), latency_scale=args.latency_scale,
+                     warmup=args.warmup, cooldown=args.warmup,
+                     pipelining=not args.no_pipelining, unsupported=unsupported) as emulator:
+        print('Emulating projector on {}:{}'.format(*emulator.host_port))
+        if args.test:
+            selftest(emulator)
+            return
+        try:
+            emulator.thread.join()
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
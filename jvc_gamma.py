@@ -2,14 +2,19 @@
 
 """JVC projector low level command module"""
 
+import collections
 import json
 import enum
 import math
+import operator
 from distutils.util import strtobool
 
 import dumpdata
 import eotf
-from jvc_command import JVCCommand, Command, GammaTable, GammaCorrection, HDMIInputLevel
+import jvc_plan
+from jvc_command import (
+    JVCCommand, Command, GammaTable, GammaCorrection, HDMIInputLevel, GAMMA_DATA_COMMANDS)
+from jvc_protocol import SESSION_POLICY
 
 HDMI_INPUT_LEVEL_MAP = {
     HDMIInputLevel.Standard: (0, 255),
@@ -63,6 +68,193 @@ def oscale(l):
         oi = omax
     return oi
 
+# Generate gamma tables with numpy, if it is installed
+USE_NUMPY = True
+
+# Relative distance from a threshold or rounding boundary within which numpy
+# results are computed again with the scalar code
+FRAGILE_TOLERANCE = 1e-9
+
+numpy_module = False
+
+def get_numpy():
+    """Return numpy module, or None if it is not installed or USE_NUMPY is False"""
+    global numpy_module
+    if numpy_module is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        numpy_module = numpy
+    return numpy_module if USE_NUMPY else None
+
+def near(np, values, target, scale=0):
+    """Return mask of values that rounding differences could move across target"""
+    return np.isfinite(target) & (
+        np.abs(values - target) <= FRAGILE_TOLERANCE * (np.abs(values) + np.abs(target) + scale))
+
+def bezier_coefficients(P0, P1, P2, P3, quadratic=False):
+    """Return polynomial coefficients, highest power first, of the Bézier curve of generate_table
+
+    Like the quadratic curve of generate_table, P2 is ignored if quadratic is True.
+    """
+    if quadratic:
+        return (0, P0 - 2 * P1 + P3, 2 * (P1 - P0), P0)
+    return (P3 - P0 + 3 * (P1 - P2), 3 * (P0 - 2 * P1 + P2), 3 * (P1 - P0), P0)
+
+def polynomial(coefficients, t):
+    """Evaluate cubic polynomial at t, a number or numpy array"""
+    a, b, c, d = coefficients
+    return ((a * t + b) * t + c) * t + d
+
+# Maximum error of the Bézier curve parameter of soft clipped points, the
+# bisection used before stopped at intervals of 0.00001
+BEZIER_TOLERANCE = 0.00001 / 2
+
+def bezier_refine(coefficients, p, t):
+    """Return t after Newton steps towards polynomial(coefficients, t) == p, limited to 0-1"""
+    a, b, c, _ = coefficients
+    for _ in range(2):
+        slope = (3 * a * t + 2 * b) * t + c
+        if slope:
+            t -= (polynomial(coefficients, t) - p) / slope
+    return min(max(t, 0), 1)
+
+def bezier_solve(coefficients, p):
+    """Return t between 0 and 1 where the monotonic Bézier curve of coefficients is p
+
+    The quadratic or cubic is solved in closed form and refined with Newton
+    steps. Returns None if the curve is not monotonic or t cannot be shown
+    to be within BEZIER_TOLERANCE of the solution.
+    """
+    a, b, c, d = coefficients
+    d -= p
+    if a == 0 and b == 0:
+        t = -d / c if c else 0
+    elif a == 0:
+        q = -(c + math.copysign(math.sqrt(max(c * c - 4 * b * d, 0)), c)) / 2
+        t = min((q / b, d / q if q else -1), key=lambda t: abs(t - 0.5))
+    else:
+        # One real root of the depressed cubic x**3 + P*x + Q, t = x - B/3,
+        # a monotonic curve has no other roots
+        B = b / a
+        C = c / a
+        P = C - B * B / 3
+        Q = 2 * B ** 3 / 27 - B * C / 3 + d / a
+        u = -Q / 2 - math.copysign(math.sqrt(max((Q / 2) ** 2 + (P / 3) ** 3, 0)), Q)
+        u = math.copysign(abs(u) ** (1 / 3), u)
+        t = (u - P / (3 * u) if u else 0) - B / 3
+    t = bezier_refine(coefficients, p, t)
+    if (t - BEZIER_TOLERANCE > 0 and polynomial(coefficients, t - BEZIER_TOLERANCE) > p or
+            t + BEZIER_TOLERANCE < 1 and polynomial(coefficients, t + BEZIER_TOLERANCE) < p):
+        return None
+    return t
+
+def bezier_solve_array(np, coefficients, p):
+    """Solve bezier_solve for each point of numpy array p
+
+    Returns array of t and mask of points where t could be computed.
+    """
+    a, b, c, d = coefficients
+    d = d - p
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if a == 0 and b == 0:
+            t = -d / c if c else np.zeros_like(p)
+        elif a == 0:
+            q = -(c + np.copysign(np.sqrt(np.maximum(c * c - 4 * b * d, 0)), c)) / 2
+            t1 = q / b
+            t2 = np.where(q != 0, d / q, -1)
+            t = np.where(np.abs(t1 - 0.5) <= np.abs(t2 - 0.5), t1, t2)
+        else:
+            B = b / a
+            C = c / a
+            P = C - B * B / 3
+            Q = 2 * B ** 3 / 27 - B * C / 3 + d / a
+            root = np.sqrt(np.maximum((Q / 2) ** 2 + (P / 3) ** 3, 0))
+            u = np.cbrt(-Q / 2 - np.copysign(root, Q))
+            t = np.where(u != 0, u - P / (3 * u), 0) - B / 3
+        for _ in range(2):
+            slope = (3 * a * t + 2 * b) * t + c
+            t = np.where(slope != 0, t - (polynomial(coefficients, t) - p) / slope, t)
+    t = np.clip(t, 0, 1)
+    solved = (((t - BEZIER_TOLERANCE <= 0) |
+               (polynomial(coefficients, t - BEZIER_TOLERANCE) <= p)) &
+              ((t + BEZIER_TOLERANCE >= 1) |
+               (polynomial(coefficients, t + BEZIER_TOLERANCE) >= p)) &
+              np.isfinite(t))
+    return t, solved
+
+def oscale_array(np, l):
+    """Convert numpy array with oscale, return table and mask of values near a rounding boundary"""
+    o = np.maximum(l, 0) ** (1/2.2) * 1023
+    fragile = np.abs(o - np.floor(o) - 0.5) < FRAGILE_TOLERANCE * 1023
+    return np.minimum(np.rint(o), 1023).astype(int), fragile
+
+# Number of recently generated tables kept in table_cache
+TABLE_CACHE_SIZE = 32
+
+# Tables, clip tables and clip points by generate_table parameters, least recently used first
+table_cache = collections.OrderedDict()
+
+def copy_table(table):
+    """Return copy of single table or of list of red, green and blue tables"""
+    if table and isinstance(table[0], list):
+        return [list(color) for color in table]
+    return list(table)
+
+def eotf_fingerprint(eotf):
+    """Return numeric settings of eotf module, like the black level of eotf_bt1886"""
+    return tuple(sorted((name, value) for name, value in vars(eotf).items()
+                        if isinstance(value, (int, float)) and not name.startswith('_')))
+
+class SoftClip:
+    """Soft clip points, clipped luminance and clip table of each point, see generate_table"""
+    def __init__(self, clip_p, clip_l, clip_gain, hardclip_p, pblackin, lc, cliptable):
+        self.clip_p = clip_p
+        self.clip_l = clip_l
+        self.clip_gain = clip_gain
+        self.hardclip_p = hardclip_p
+        self.pblackin = pblackin
+        self.lc = lc
+        self.cliptable = cliptable
+        self.fragile = None
+
+# GammaCurve attributes set by generate_table
+GENERATED_ATTRIBUTES = ('table', 'cliptable', 'isoftclip', 'ihardclip')
+
+GAMMA_COLOR_COMMANDS = [Command.PMGammaRed, Command.PMGammaGreen, Command.PMGammaBlue]
+
+# Red, green and blue tables known to be in each custom gamma table slot, by
+# projector address and slot
+slot_tables = dict()
+
+def rgb_tables(table):
+    """Return list of red, green and blue tables"""
+    if len(table) != 3:
+        return [table, table, table]
+    return list(table)
+
+def load_slot_tables(jvc, slot):
+    """Return tables last written to or read from slot, or None if not known
+
+    Falls back to the table saved in the written-<slot> backup file.
+    """
+    tables = slot_tables.get((jvc.conn.conn.host_port, slot))
+    if tables is not None:
+        return tables
+    try:
+        with open(basename_to_conf_file_name('written-{}'.format(slot.name)), 'r') as file:
+            return rgb_tables(json.load(file)['table'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+# Settings write_jvc reads to check that the gamma table can be written
+WRITE_CHECK_COMMANDS = [Command.PictureMode, Command.GammaTable, Command.GammaCorrection,
+                        Command.HDMIInputLevel]
+
+# Settings write_jvc can change
+WRITE_CHANGES = {Command.GammaCorrection} | GAMMA_DATA_COMMANDS
+
 def write_gamma_curve(jvc, colorcmd, table, verify, retry=1):
     """Write gamma curve for a single color to projector"""
     while True:
@@ -97,6 +289,7 @@ class GammaCurve():
         self.ihardclip = None
         self.table = None
         self.cliptable = None
+        self.stages = dict()
 
     def raw_gamma_table(self):
         """Return True is gamma table is not generated"""
@@ -152,25 +345,35 @@ class GammaCurve():
             conf = json.load(file)
             self.conf_load(conf)
 
+    def conf_save(self, save_all_params=True, generated=True):
+        """Return configuration dict that conf_load accepts
+
+        If generated is False the table and the other results of
+        generate_table are left out.
+        """
+        raw = self.raw_gamma_table()
+        if raw and not save_all_params:
+            return {'table': self.table}
+        conf = self.__dict__.copy()
+        del conf['stages']
+        if not generated:
+            for key in GENERATED_ATTRIBUTES:
+                del conf[key]
+        if raw:
+            del conf['eotf']
+        else:
+            conf['eotf'] = self.eotf.__name__
+        if conf['highlight'] is not None:
+            conf['highlight'] = str(conf['highlight'])
+        return conf
+
     def file_save(self, basename=None, save_all_params=False):
         """Save configuration to file"""
         if not basename:
             basename = 'active'
             save_all_params = True
         conf_file = basename_to_conf_file_name(basename)
-        raw = self.raw_gamma_table()
-
-        if not raw or save_all_params:
-            conf = self.__dict__.copy()
-            if raw:
-                del conf['eotf']
-            else:
-                conf['eotf'] = self.eotf.__name__
-            if conf['highlight'] is not None:
-                conf['highlight'] = str(conf['highlight'])
-        else:
-            conf = dict()
-            conf['table'] = self.table
+        conf = self.conf_save(save_all_params)
 
         with open(conf_file, 'w') as file:
             json.dump(conf, file, indent=2)
@@ -259,8 +462,26 @@ class GammaCurve():
             return None
         return self.irefblack + p * (self.ipeakwhite - self.irefblack)
 
-    def generate_table(self):
-        """Generate gamma table"""
+    def cached_stage(self, name, key, func):
+        """Return func(), or the value it returned last time stage name ran with the same key"""
+        entry = self.stages.get(name)
+        if entry is None or entry[0] != key:
+            entry = (key, func())
+            self.stages[name] = entry
+        return entry[1]
+
+    def generate_table(self, vectorize=True):
+        """Generate gamma table
+
+        If numpy is installed and vectorize is True, all points are computed at
+        once. Numpy math functions can round differently from the scalar code,
+        so points close to a threshold or a rounding boundary are computed
+        again with the scalar code, and the table is the same either way.
+
+        The EOTF, soft clip, output encoding and highlight stages are only
+        computed again when the parameters they depend on change, and tables of
+        recently used parameters are reused from table_cache.
+        """
         bblack = self.get_effective_bblack()
         bblackout = self.get_effective_bblackout()
         bmax = self.get_effective_bmax()
@@ -280,12 +501,28 @@ class GammaCurve():
         if lsoftclip > lhardclip:
             lsoftclip = math.inf
         end_slope = lsoftclip ** (1 / clip_gamma) + (1 - lsoftclip ** (1 / clip_gamma)) * end_slope
+        quadratic = self.clip == 1
+
+        np = get_numpy() if vectorize and not debug and hasattr(eotf, 'L_array') else None
+        eotf_key = (np is not None, self.irefblack, self.ipeakwhite,
+                    eotf, eotf_fingerprint(eotf), lscale, lblack)
+        clip_key = eotf_key + (lblackin, lsoftclip, lhardclip, end_slope, clip_gamma, quadratic,
+                               debug)
+        table_key = clip_key + (highlight,)
+        cached = table_cache.get(table_key)
+        if cached is not None:
+            table_cache.move_to_end(table_key)
+            table, cliptable, self.isoftclip, self.ihardclip, stages = cached
+            self.stages = dict(stages)
+            self.table = copy_table(table)
+            self.cliptable = list(cliptable)
+            return
 
         def ptol(p):
             """Apply EOTF and add black offset"""
             return eotf.L(p) * lscale + lblack if p > 0 else 0
 
-        if self.clip == 1:
+        if quadratic:
             def B(t, P0, P1, _, P2):
                 """Quadratic Bézier curve func accepting Cubic Bézier curve args (by ignoring P2)"""
                 return (1-t)**2*P0 + 2*(1-t)*t*P1 + t**2*P2
@@ -294,16 +531,9 @@ class GammaCurve():
                 """Cubic Bézier curve func"""
                 return (1-t)**3*P0 + 3*(1-t)**2*t*P1 + 3*(1-t)*t**2*P2+t**3*P3
 
-        def clip(p, l, clip_p, clip_l, clip_gain, ppeak):
-            """Apply soft clip curve to a single point"""
-            if l < lsoftclip or clip_l is None:
-                return l
+        def clip_curve(clip_p, clip_l, clip_gain, ppeak):
+            """Return output start, saturation input and output, and peak output of soft clip"""
             clip_o = clip_l ** (1 / clip_gamma)
-            dp = p - clip_p
-            t = dp / (self.itop(255) - clip_p)
-            Btp = 0
-            tl = 0
-            th = 1
             sat_o = end_slope
             sat_p = clip_p + (sat_o - clip_o) / clip_gain
             peak_o = 1
@@ -311,73 +541,182 @@ class GammaCurve():
                 sat_p = ppeak
                 sat_o = (sat_p - clip_p) * clip_gain + clip_o
                 peak_o = sat_o
+            return clip_o, sat_p, sat_o, peak_o
 
-            while th - tl > 0.00001:
-                Btp = B(t, clip_p, sat_p, sat_p, ppeak)
-                if Btp < p:
-                    tl = t
-                else:
-                    th = t
-                t = tl + (th - tl) / 2
+        def clip(p, l, clip_p, clip_l, clip_gain, ppeak):
+            """Apply soft clip curve to a single point"""
+            if l < lsoftclip or clip_l is None:
+                return l
+            clip_o, sat_p, sat_o, peak_o = clip_curve(clip_p, clip_l, clip_gain, ppeak)
+            t = bezier_solve(bezier_coefficients(clip_p, sat_p, sat_p, ppeak, quadratic), p)
+            if t is None:
+                # Curve is not monotonic, search with bisection
+                dp = p - clip_p
+                t = dp / (self.itop(255) - clip_p)
+                tl = 0
+                th = 1
+                while th - tl > 0.00001:
+                    if B(t, clip_p, sat_p, sat_p, ppeak) < p:
+                        tl = t
+                    else:
+                        th = t
+                    t = tl + (th - tl) / 2
             Btl = B(t, clip_o, sat_o, sat_o, peak_o)
             if debug > 2:
                 print('{:3.0f}: p {:7.4f}, Btp {:7.4f}, t {:7.4f}, '
                       'Bt {:7.4f}, clip_p {:7.4f}, sat_p {:7.4f}, '
                       'clip_l {:7.4f}, clip_gain {:7.4f}'.format(
-                          self.ptoi(p), p, Btp, t, Btl, clip_p, sat_p, clip_l, clip_gain))
+                          self.ptoi(p), p, B(t, clip_p, sat_p, sat_p, ppeak), t, Btl, clip_p,
+                          sat_p, clip_l, clip_gain))
             return Btl ** clip_gamma
 
-        points = list(map(self.itop, range(256)))
-        clip_p = math.inf
-        clip_l = math.inf
-        clip_gain = None
-        hardclip_p = self.itop(256) #??
-        last_p = None
-        pblackin = -math.inf
-        for p in points:
-            l = ptol(p)
-            if l >= lsoftclip and clip_p is math.inf and last_p is not None and l > last_l:
-                clip_p = last_p
-                clip_l = last_l
-                clip_gain = (l ** (1 / clip_gamma) - last_l ** (1 / clip_gamma)) / (p - last_p)
-            if l < lblackin:
-                pblackin = p
-            if l >= lhardclip:
-                hardclip_p = p
-                break
-            last_l = l
-            last_p = p
-
-        lpeak = l = eotf.L(points[-1]) * lscale
-
-        if debug > 0:
-            print('lscale {:7.4f}, lsoftclip {:7.4f}, end_slope {:7.4f}, lpeak {:7.4f}'.format(
-                lscale, lsoftclip, end_slope, lpeak))
-            if clip_p:
-                print('clip_p {:7.4f} {:7.1f}, clip_l {:7.4f}'.format(
-                    clip_p, self.ptoi(clip_p), clip_l))
-
-        go = []
-        cliptable = []
-        for p in points:
+        def eotf_stage():
+            """Return points, and luminance of each point"""
+            if np is None:
+                points = list(map(self.itop, range(256)))
+                return points, list(map(ptol, points))
+            parray = (np.arange(256) - self.irefblack) / (self.ipeakwhite - self.irefblack)
+            larray = np.zeros(len(parray))
+            positive = parray > 0
+            larray[positive] = eotf.L_array(parray[positive]) * lscale + lblack
+            return parray, larray
+
+        def clip_stage():
+            """Return clip points, clipped luminance and clip table, see SoftClip"""
+            clip_p = math.inf
+            clip_l = math.inf
+            clip_gain = None
+            hardclip_p = self.itop(256) #??
+            last_p = None
+            pblackin = -math.inf
+            fragile = None
+            if np is None:
+                for p, l in zip(points, lvalues):
+                    if l >= lsoftclip and clip_p is math.inf and last_p is not None and l > last_l:
+                        clip_p = last_p
+                        clip_l = last_l
+                        clip_gain = (l ** (1 / clip_gamma) - last_l ** (1 / clip_gamma)) / (
+                            p - last_p)
+                    if l < lblackin:
+                        pblackin = p
+                    if l >= lhardclip:
+                        hardclip_p = p
+                        break
+                    last_l = l
+                    last_p = p
+            else:
+                plist = points.tolist()
+                larray = lvalues.copy()
+                fragile = (near(np, larray, lsoftclip, abs(lblack)) |
+                           near(np, larray, lblackin, abs(lblack)) |
+                           near(np, larray, lhardclip, abs(lblack)))
+                fragile[1:] |= near(np, larray[1:], larray[:-1], abs(lblack))
+                for i in np.flatnonzero(fragile):
+                    larray[i] = ptol(plist[i])
+
+                hard = np.flatnonzero(larray >= lhardclip)
+                l = larray[:hard[0] + 1] if hard.size else larray
+                rising = np.flatnonzero((l[1:] >= lsoftclip) & (l[1:] > l[:-1]))
+                if rising.size:
+                    i = rising[0] + 1
+                    clip_p = plist[i - 1]
+                    clip_l = ptol(clip_p)
+                    clip_gain = (ptol(plist[i]) ** (1 / clip_gamma) -
+                                 clip_l ** (1 / clip_gamma)) / (plist[i] - clip_p)
+                black = np.flatnonzero(l < lblackin)
+                if black.size:
+                    pblackin = plist[black[-1]]
+                if hard.size:
+                    hardclip_p = plist[hard[0]]
+
+            if debug > 0:
+                lpeak = eotf.L(points[-1]) * lscale
+                print('lscale {:7.4f}, lsoftclip {:7.4f}, end_slope {:7.4f}, lpeak {:7.4f}'.format(
+                    lscale, lsoftclip, end_slope, lpeak))
+                if clip_p:
+                    print('clip_p {:7.4f} {:7.1f}, clip_l {:7.4f}'.format(
+                        clip_p, self.ptoi(clip_p), clip_l))
+
+            if np is None:
+                lc = [min(clip(p, l, clip_p, clip_l, clip_gain, hardclip_p), lhardclip)
+                      for p, l in zip(points, lvalues)]
+                cliptable = [lci / l if l else 1 if lci <= 0 else 0
+                             for l, lci in zip(lvalues, lc)]
+                return SoftClip(clip_p, clip_l, clip_gain, hardclip_p, pblackin, lc, cliptable)
+
+            lc = np.minimum(larray, lhardclip)
+            soft = larray >= lsoftclip
+            if clip_gain is None:
+                fragile |= soft
+            elif soft.any():
+                # Same as clip, for all points in the soft clip region at once
+                clip_o, sat_p, sat_o, peak_o = clip_curve(clip_p, clip_l, clip_gain, hardclip_p)
+                t, solved = bezier_solve_array(
+                    np, bezier_coefficients(clip_p, sat_p, sat_p, hardclip_p, quadratic),
+                    points[soft])
+                Bt = polynomial(bezier_coefficients(clip_o, sat_o, sat_o, peak_o, quadratic), t)
+                lc[soft] = np.minimum(Bt ** clip_gamma, lhardclip)
+                fragile[soft] |= ~solved
+            fragile |= larray == 0
+            with np.errstate(divide='ignore', invalid='ignore'):
+                cliptable = (lc / larray).tolist()
+            softclip = SoftClip(clip_p, clip_l, clip_gain, hardclip_p, pblackin, lc, cliptable)
+            for i in np.flatnonzero(fragile):
+                exact_clip(softclip, i)
+            softclip.fragile = fragile
+            return softclip
+
+        def exact_clip(softclip, i):
+            """Compute clipped luminance of point i with the scalar code"""
+            p = points[i].item()
             l = ptol(p)
-            lc = min(clip(p, l, clip_p, clip_l, clip_gain, hardclip_p), lhardclip)
-            cliptable.append(lc / l if l else 1 if lc <= 0 else 0)
-            oi = oscale(lc)
-            if debug > 3:
-                print('{:3.0f}: {:4d} {:7.1f} {:7.4f} {:7.4f} {:7.4f} {:7.4f}'.format(
-                    self.ptoi(p), oi, oscale(l), lc * bmax, l * bmax, clip_p, clip_l))
-            go.append(oi)
-
-        self.isoftclip = self.ptoi(clip_p)
-        self.ihardclip = self.ptoi(hardclip_p)
-        self.cliptable = cliptable
-
+            lc = min(clip(p, l, softclip.clip_p, softclip.clip_l, softclip.clip_gain,
+                          softclip.hardclip_p), lhardclip)
+            softclip.cliptable[i] = lc / l if l else 1 if lc <= 0 else 0
+            return lc
+
+        def output_stage():
+            """Return gamma table of clipped luminance"""
+            if np is None:
+                go = []
+                for p, l, lc in zip(points, lvalues, softclip.lc):
+                    oi = oscale(lc)
+                    if debug > 3:
+                        print('{:3.0f}: {:4d} {:7.1f} {:7.4f} {:7.4f} {:7.4f} {:7.4f}'.format(
+                            self.ptoi(p), oi, oscale(l), lc * bmax, l * bmax, softclip.clip_p,
+                            softclip.clip_l))
+                    go.append(oi)
+                return go
+            go, unsure = oscale_array(np, softclip.lc)
+            go = go.tolist()
+            for i in np.flatnonzero(softclip.fragile | unsure):
+                go[i] = oscale(exact_clip(softclip, i))
+            return go
+
+        points, lvalues = self.cached_stage('eotf', eotf_key, eotf_stage)
+        softclip = self.cached_stage('clip', clip_key, clip_stage)
+        go = self.cached_stage('output', clip_key, output_stage)
+
+        self.isoftclip = self.ptoi(softclip.clip_p)
+        self.ihardclip = self.ptoi(softclip.hardclip_p)
+        self.cliptable = list(softclip.cliptable)
         if not highlight:
-            self.table = go
-            return
+            self.table = list(go)
+        elif np is not None:
+            self.table = self.highlight_table(np, go, points, self.ptoi(softclip.pblackin),
+                                              softclip.clip_p, softclip.hardclip_p)
+        else:
+            self.table = self.highlight_table_scalar(go, points, self.ptoi(softclip.pblackin),
+                                                     softclip.clip_p, softclip.hardclip_p)
+
+        table_cache[table_key] = (copy_table(self.table), list(self.cliptable),
+                                  self.isoftclip, self.ihardclip, dict(self.stages))
+        while len(table_cache) > TABLE_CACHE_SIZE:
+            table_cache.popitem(last=False)
 
-        iblackin = self.ptoi(pblackin)
+    def highlight_table_scalar(self, go, points, iblackin, clip_p, hardclip_p):
+        """Return red, green and blue tables of go with highlight colors, see generate_table"""
+        highlight = self.highlight
         gorgb = [[], [], []]
         lastgop = None
         for gi, gop in enumerate(go):
@@ -412,9 +751,48 @@ class GammaCurve():
             for i, goc in enumerate(gorgb):
                 goc.append(rgb[i])
             lastgop = gop
+        return gorgb
 
-        self.table = gorgb
-        return
+    def highlight_table(self, np, go, points, iblackin, clip_p, hardclip_p):
+        """Return red, green and blue tables of go with highlight colors, see generate_table"""
+        highlight = self.highlight
+        gi = np.arange(len(go))
+        gop = np.array(go)
+        flat = np.concatenate(([False], gop[1:] == gop[:-1]))
+        # First matching rule sets the color, same order as the scalar code
+        rules = [
+            (Highlight.B, gi == self.irefblack, (0, 255, 0)),
+            (Highlight.AB, gi == 0, (255, 0, 0)),
+            (Highlight.BTB, gi < self.irefblack, (255, 127, 0)),
+            (Highlight.BTBI, gi < iblackin, (255, 127, 0)),
+            (Highlight.W, gi == round(self.ipeakwhite), (0, 1023, 0)),
+            (Highlight.WTW, gi > self.ipeakwhite, (gop, 0, 0)),
+            (Highlight.HC, points > hardclip_p, (gop, np.rint(gop / 8), 0)),
+            (Highlight.CW, gop == 1023, (gop, np.rint(gop / 4), 0)),
+            (Highlight.SCF, (points > clip_p) & flat, (gop, np.rint(gop / 2), 0)),
+            (Highlight.SC, points > clip_p, (gop, np.rint(gop * 0.75), 0)),
+            (Highlight.F, flat, (255, 127, gop)),
+            (Highlight.NB, gi < self.irefblack + 16, (255 + gop, 255 + gop, gop)),
+            (Highlight.NW, gi > self.ipeakwhite - 16, (gop, gop, 0)),
+            ]
+        gorgb = np.array([gop, gop, gop])
+        for flag, cond, rgb in reversed(rules):
+            if flag not in highlight or not cond.any():
+                continue
+            for goc, value in zip(gorgb, rgb):
+                goc[cond] = value[cond] if isinstance(value, np.ndarray) else value
+        return gorgb.tolist()
+
+    def output_levels(self):
+        """Return generated table before rounding and highlight colors
+
+        The levels are a list, or a numpy array if the table was generated
+        with numpy.
+        """
+        lc = self.stages['clip'][1].lc
+        if isinstance(lc, list):
+            return [min(max(l, 0) ** (1/2.2) * 1023, 1023) for l in lc]
+        return (lc.clip(0) ** (1/2.2) * 1023).clip(None, 1023)
 
     def set_raw_table(self, table):
         """Use raw gamma table instead of generated table"""
@@ -427,27 +805,35 @@ class GammaCurve():
             self.generate_table()
         return self.table
 
-    def write_jvc(self, jvc, verify=False):
-        """Write gamma table to projector"""
-        newgamma = self.get_table()
-        if len(newgamma) != 3:
-            newgamma = [newgamma, newgamma, newgamma]
+    def write_jvc(self, jvc, verify=False, force=False, check=True):
+        """Write gamma table to projector
 
+        Only channels that differ from the tables known to be in the selected
+        slot are sent, unless force is True. If check is True the red table is
+        read back first, and all channels are sent if it does not match.
+        """
+        newgamma = rgb_tables(self.get_table())
+
+        old_gamma_table = None
+        plan = jvc_plan.Plan('write_jvc')
+        values = {cmd: plan.get(cmd) for cmd in WRITE_CHECK_COMMANDS}
         try:
-            print('Picture mode:', jvc.get(Command.PictureMode).name)
-            old_gamma_table = jvc.get(Command.GammaTable)
+            plan.run(jvc)
+            print('Picture mode:', values[Command.PictureMode].result().name)
+            old_gamma_table = values[Command.GammaTable].result()
             print('Gamma Table:', old_gamma_table.name)
             if old_gamma_table not in {GammaTable.Custom1,
                                        GammaTable.Custom2,
                                        GammaTable.Custom3}:
                 raise ValueError('Selected gamma table, {}, is not a custom gamma table'.format(
                     old_gamma_table.name))
-            gamma_correction = jvc.get(Command.GammaCorrection)
+            gamma_correction = values[Command.GammaCorrection].result()
             if gamma_correction is not GammaCorrection.Import:
                 raise ValueError('Correction value for {} is not set to import, {}'.format(
                     old_gamma_table.name, gamma_correction.name))
-            jvc.set(Command.GammaCorrection, GammaCorrection.Import)
-            input_level_match = input_level = jvc.get(Command.HDMIInputLevel)
+            plan.set(Command.GammaCorrection, GammaCorrection.Import)
+            plan.run(jvc)
+            input_level_match = input_level = values[Command.HDMIInputLevel].result()
             if input_level_match is HDMIInputLevel.Auto:
                 input_level_match = HDMIInputLevel.Standard
             if input_level_match != self.get_input_level():
@@ -458,17 +844,35 @@ class GammaCurve():
             print('Failed to validate projector settings:', err)
             if not strtobool(input('Ignore and try to write table anyway (y/n)? ')):
                 raise
-
-        for colorcmd, table in zip([Command.PMGammaRed, Command.PMGammaGreen, Command.PMGammaBlue],
-                                   newgamma):
+            force = True
+
+        oldgamma = None if force else load_slot_tables(jvc, old_gamma_table)
+        if oldgamma is not None and check and any(map(operator.eq, oldgamma, newgamma)):
+            # Read past the state cache, the table may have been changed by another tool
+            red = jvc.get_many([Command.GammaRed], cached=False)[Command.GammaRed]
+            if red != oldgamma[0]:
+                print('Gamma table in projector has changed, writing all colors')
+                oldgamma = None
+        tables = list(oldgamma or [None, None, None])
+        if old_gamma_table is not None:
+            slot_tables[(jvc.conn.conn.host_port, old_gamma_table)] = tables
+
+        for color, (colorcmd, table) in enumerate(zip(GAMMA_COLOR_COMMANDS, newgamma)):
+            if table == tables[color]:
+                print('{} unchanged'.format(colorcmd.name))
+                continue
+            tables[color] = None
             write_gamma_curve(jvc=jvc, colorcmd=colorcmd, table=table, verify=verify)
+            tables[color] = table
 
-        self.file_save(basename='written-{}'.format(old_gamma_table.name), save_all_params=False)
+        if old_gamma_table is not None:
+            self.file_save(basename='written-{}'.format(old_gamma_table.name),
+                           save_all_params=False)
 
-    def write(self, verify=False):
+    def write(self, verify=False, force=False):
         """Connect to projector and write gamma table"""
-        with JVCCommand() as jvc:
-            self.write_jvc(jvc, verify=verify)
+        with JVCCommand(cache=True, policy=SESSION_POLICY) as jvc:
+            self.write_jvc(jvc, verify=verify, force=force)
 
     def read_jvc(self, jvc):
         """Read gamma table from projector"""
@@ -478,13 +882,15 @@ class GammaCurve():
         gamma_red = jvc.get(Command.GammaRed)
         gamma_green = jvc.get(Command.GammaGreen)
         gamma_blue = jvc.get(Command.GammaBlue)
+        slot_tables[(jvc.conn.conn.host_port, jvc.get(Command.GammaTable))] = [
+            list(gamma_red), list(gamma_green), list(gamma_blue)]
         if gamma_red == gamma_green == gamma_blue:
             self.set_raw_table(gamma_red)
         self.set_raw_table((gamma_red, gamma_green, gamma_blue))
 
     def read(self):
         """Connect to projector and read gamma table"""
-        with JVCCommand() as jvc:
+        with JVCCommand(cache=True, policy=SESSION_POLICY) as jvc:
             self.read_jvc(jvc)
 
 def test_match(name, table, expected):
@@ -536,5 +942,10 @@ def main():
                [round(i / 255 * 2047) for i in range(123)] +
                [986, 993, 1000, 1005, 1009, 1013, 1016, 1018, 1021] + [1023 for i in range(124)])
 
+    gamma.highlight = Highlight.ALL
+    table = gamma.get_table()
+    gamma.generate_table(vectorize=False)
+    test_match('Softclip highlight scalar', gamma.table, table)
+
 if __name__ == "__main__":
     main()
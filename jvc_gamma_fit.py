@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+
+"""JVC gamma curve parameter fit
+
+Find GammaCurve parameters that reproduce a raw gamma table, like a table
+read from the projector or imported from a VCGT file.
+
+The soft clip of a generated curve starts at a table entry and the hard clip
+at another, so bsoftclip and bhardclip only change the table when they move
+past the brightness of an entry, and the table is fitted in two parts. The
+entries where the clip starts are searched entry by entry, starting from
+where the table leaves the unclipped curve and where it reaches its top.
+For each pair of entries brefwhite, end_slope, clip_gamma and the hard clip
+level, which the table changes smoothly with, are fitted by least squares to
+the levels before rounding.
+
+Every EOTF and input level is first fitted to the entries below the soft
+clip, and only the best matches are fitted to the whole table. bmax and the
+black levels are kept from the curve the fit starts from, as only the ratio
+of bmax and brefwhite changes the table.
+"""
+
+import argparse
+import math
+import time
+from distutils.util import strtobool
+
+import eotf
+import jvc_gamma
+from jvc_command import HDMIInputLevel
+from jvc_gamma import GammaCurve, HDMI_INPUT_LEVEL_MAP, rgb_tables
+
+# Table entries up to this fraction of the largest entry are used to rank EOTFs
+LOWER_FRACTION = 0.35
+
+# EOTF and input level combinations fitted with all parameters
+FIT_CANDIDATES = 2
+
+# Least squares iterations of each fit, of fits of neighbouring clip entries
+# and of the fit that ranks EOTF and input level combinations
+LM_ITERATIONS = 30
+NEIGHBOUR_ITERATIONS = 10
+SCREEN_ITERATIONS = 5
+
+# Least squares fits stop when an iteration improves the error by less than this fraction
+LM_TOLERANCE = 1e-6
+
+# Search vector difference used to compute the Jacobian
+LM_DIFFERENCE = 1e-5
+
+# Curves generated by the search for the closest rounded table
+POLISH_EVALUATIONS = 200
+
+# Initial simplex size of the search for the closest rounded table
+POLISH_STEPS = [0.001, 0.005, 0.005, 0.1]
+
+INPUT_LEVELS = [HDMIInputLevel.Standard, HDMIInputLevel.Enhanced, HDMIInputLevel.SuperWhite]
+
+BREFWHITE_RANGE = (0.1, 10000.0)
+
+def nelder_mead(func, x0, steps, max_evaluations, tolerance=1e-6):
+    """Return x with the smallest func(x) found by a Nelder-Mead simplex search, and func(x)"""
+    points = [list(x0)]
+    for i, step in enumerate(steps):
+        point = list(x0)
+        point[i] += step
+        points.append(point)
+    values = [func(point) for point in points]
+    evaluations = len(points)
+
+    while evaluations < max_evaluations:
+        order = sorted(range(len(points)), key=values.__getitem__)
+        points = [points[i] for i in order]
+        values = [values[i] for i in order]
+        if values[0] == 0 or max(abs(a - b) for point in points[1:]
+                                 for a, b in zip(point, points[0])) < tolerance:
+            break
+        centroid = [sum(coords) / (len(points) - 1) for coords in zip(*points[:-1])]
+        worst = points[-1]
+
+        def towards(scale):
+            """Return point on the line from centroid through worst"""
+            return [c + scale * (w - c) for c, w in zip(centroid, worst)]
+
+        reflected = towards(-1)
+        value = func(reflected)
+        evaluations += 1
+        if value < values[0]:
+            expanded = towards(-2)
+            expanded_value = func(expanded)
+            evaluations += 1
+            if expanded_value < value:
+                reflected, value = expanded, expanded_value
+            points[-1], values[-1] = reflected, value
+            continue
+        if value < values[-2]:
+            points[-1], values[-1] = reflected, value
+            continue
+        contracted = towards(0.5)
+        contracted_value = func(contracted)
+        evaluations += 1
+        if contracted_value < values[-1]:
+            points[-1], values[-1] = contracted, contracted_value
+            continue
+        for i in range(1, len(points)):
+            points[i] = [b + (p - b) / 2 for b, p in zip(points[0], points[i])]
+            values[i] = func(points[i])
+            evaluations += 1
+    best = min(range(len(points)), key=values.__getitem__)
+    return points[best], values[best]
+
+def solve(matrix, vector):
+    """Return x of matrix x = vector by Gaussian elimination, None if matrix is singular"""
+    size = len(vector)
+    rows = [list(row) + [value] for row, value in zip(matrix, vector)]
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda row: abs(rows[row][col]))
+        if rows[pivot][col] == 0:
+            return None
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for row in range(col + 1, size):
+            factor = rows[row][col] / rows[col][col]
+            for i in range(col, size + 1):
+                rows[row][i] -= factor * rows[col][i]
+    x = [0.0] * size
+    for row in reversed(range(size)):
+        x[row] = (rows[row][size] - sum(rows[row][i] * x[i] for i in range(row + 1, size))) / (
+            rows[row][row])
+    return x
+
+def levenberg_marquardt(residuals, x0, max_iterations=LM_ITERATIONS):
+    """Return x with the smallest sum of squared residuals(x) found, and the sum
+
+    residuals returns a list of residuals, or None if they cannot be computed.
+    The Jacobian is computed from forward differences.
+    """
+    x = list(x0)
+    r = residuals(x)
+    if r is None:
+        return x, math.inf
+    cost = sum(value * value for value in r)
+    damping = 1e-3
+    for _ in range(max_iterations):
+        columns = []
+        for i in range(len(x)):
+            xd = list(x)
+            xd[i] += LM_DIFFERENCE
+            rd = residuals(xd)
+            if rd is None:
+                xd[i] = x[i] - LM_DIFFERENCE
+                rd = residuals(xd)
+                if rd is None:
+                    return x, cost
+            columns.append([(b - a) / (xd[i] - x[i]) for a, b in zip(r, rd)])
+        jtj = [[sum(a * b for a, b in zip(ci, cj)) for cj in columns] for ci in columns]
+        jtr = [sum(a * b for a, b in zip(ci, r)) for ci in columns]
+        while damping < 1e10:
+            # Damping is also added on its own for parameters that do not
+            # change the table where the search is
+            matrix = [[value * (1 + damping) + damping if i == j else value
+                       for j, value in enumerate(row)] for i, row in enumerate(jtj)]
+            step = solve(matrix, [-value for value in jtr])
+            if step is not None:
+                candidate = [a + b for a, b in zip(x, step)]
+                rc = residuals(candidate)
+                if rc is not None:
+                    candidate_cost = sum(value * value for value in rc)
+                    if candidate_cost < cost:
+                        break
+            damping *= 4
+        else:
+            return x, cost
+        damping = max(damping / 3, 1e-9)
+        improvement = cost - candidate_cost
+        x, r, cost = candidate, rc, candidate_cost
+        if improvement <= LM_TOLERANCE * cost or cost == 0:
+            break
+    return x, cost
+
+def limited_exp(x):
+    """Return exp(x) with x limited to a range that does not overflow"""
+    return math.exp(min(max(x, -30), 30))
+
+def sigmoid(x):
+    """Return 0-1 logistic function of x"""
+    return 1 / (1 + limited_exp(-x))
+
+class FitResult:
+    """Fitted gamma curve and how far its table is from the target table"""
+    def __init__(self, gamma, target, evaluations, elapsed):
+        self.gamma = gamma
+        errors = [a - b for a, b in zip(gamma.table, target)]
+        self.rms = math.sqrt(sum(error * error for error in errors) / len(errors))
+        self.max_error = max(abs(error) for error in errors)
+        self.mismatches = sum(1 for error in errors if error)
+        self.evaluations = evaluations
+        self.elapsed = elapsed
+
+    def summary(self):
+        """Return fitted parameters and residual as printable string"""
+        gamma = self.gamma
+        return '\n'.join([
+            'eotf: {}, input level: {}, clip: {}'.format(
+                gamma.eotf.__name__, gamma.get_input_level().name, gamma.clip),
+            'bmax: {:.5g}, brefwhite: {:.5g}, bsoftclip: {}, bhardclip: {}'.format(
+                gamma.bmax, gamma.brefwhite, gamma.bsoftclip, gamma.bhardclip),
+            'end_slope: {:.5g}, clip_gamma: {:.5g}'.format(gamma.end_slope, gamma.clip_gamma),
+            'Residual: rms {:.3f}, max {}, {} of {} entries differ'.format(
+                self.rms, self.max_error, self.mismatches, len(gamma.table)),
+            'Generated {} curves in {:.3f}s'.format(self.evaluations, self.elapsed),
+            ])
+
+class Fitter:
+    """Fit GammaCurve parameters to a gamma table
+
+    Tables with different red, green and blue entries are fitted to the
+    green table. The search vector is log brefwhite, end_slope, log
+    clip_gamma and the position of the hard clip between its entry and the
+    entry before it.
+    """
+    def __init__(self, table, base=None):
+        self.target = list(rgb_tables(table)[1])
+        self.gamma = GammaCurve()
+        if base is not None:
+            self.gamma.bmax = base.bmax
+            self.gamma.bblack = base.bblack
+            self.gamma.bblackin = base.bblackin
+        self.evaluations = 0
+        top = max(self.target)
+        self.lower = [i for i, value in enumerate(self.target)
+                      if 0 < value <= top * LOWER_FRACTION] or list(range(len(self.target)))
+        self.np = jvc_gamma.get_numpy()
+        if self.np is not None:
+            self.target_array = self.np.array(self.target, dtype=float)
+            self.lower_array = self.np.array(self.lower)
+
+    def generate(self):
+        """Generate table and return levels before rounding, or None if it fails"""
+        self.evaluations += 1
+        try:
+            if self.np is None:
+                self.gamma.generate_table()
+            else:
+                with self.np.errstate(invalid='ignore'):
+                    self.gamma.generate_table()
+        except (ArithmeticError, ValueError, TypeError):
+            return None
+        levels = self.gamma.output_levels()
+        if isinstance(levels, list):
+            if not all(math.isfinite(level) for level in levels):
+                return None
+        elif not self.np.isfinite(levels).all():
+            return None
+        return levels
+
+    def residuals(self, lower=False):
+        """Generate table and return list of differences of its levels and the target"""
+        levels = self.generate()
+        if levels is None:
+            return None
+        if isinstance(levels, list):
+            if lower:
+                return [levels[i] - self.target[i] for i in self.lower]
+            return [a - b for a, b in zip(levels, self.target)]
+        if lower:
+            return (levels[self.lower_array] - self.target_array[self.lower_array]).tolist()
+        return (levels - self.target_array).tolist()
+
+    def rounded_error(self):
+        """Generate table and return squared error of its entries"""
+        if self.generate() is None:
+            return math.inf
+        return sum((a - b) ** 2 for a, b in zip(self.gamma.table, self.target))
+
+    def set_candidate(self, eotfentry, input_level, clip=0):
+        """Set EOTF, input level and soft clip curve type"""
+        self.gamma.eotf = eotfentry
+        self.gamma.irefblack, self.gamma.ipeakwhite = HDMI_INPUT_LEVEL_MAP[input_level]
+        self.gamma.clip = clip
+
+    def brightness(self, i):
+        """Return input brightness of table entry i, as compared with bsoftclip and bhardclip"""
+        gamma = self.gamma
+        p = gamma.itop(i)
+        if p <= 0:
+            return 0
+        bblack = gamma.get_effective_bblack()
+        lblack = bblack / gamma.get_effective_bmax()
+        return gamma.eotf.L(p) * gamma.eotf.peak * (1 - lblack) + bblack
+
+    def set_params(self, knee, hard, x):
+        """Set parameters of soft clip starting at entry knee and hard clip at entry hard
+
+        knee or hard is None for no soft or hard clip.
+        """
+        gamma = self.gamma
+        gamma.brefwhite = limited_exp(x[0])
+        gamma.end_slope = min(1.0, max(0.0, x[1]))
+        gamma.clip_gamma = limited_exp(x[2])
+        if hard is None:
+            gamma.bhardclip = None
+        else:
+            low = self.brightness(hard - 1)
+            gamma.bhardclip = low + sigmoid(x[3]) * (self.brightness(hard) - low)
+        if knee is None:
+            gamma.bsoftclip = None
+        else:
+            low = self.brightness(knee - 1)
+            high = self.brightness(knee)
+            gamma.bsoftclip = math.sqrt(low * high) if low > 0 else (low + high) / 2
+
+    def fit_brefwhite(self):
+        """Return squared error of the lower entries and brefwhite of the unclipped curve"""
+        gamma = self.gamma
+        gamma.bsoftclip = None
+        gamma.bhardclip = None
+
+        def lower_residuals(x):
+            gamma.brefwhite = limited_exp(x[0])
+            return self.residuals(lower=True)
+
+        low, high = (math.log(value) for value in BREFWHITE_RANGE)
+        steps = 16
+        grid = [low + (high - low) * i / steps for i in range(steps + 1)]
+        errors = []
+        for x in grid:
+            r = lower_residuals([x])
+            errors.append(math.inf if r is None else sum(value * value for value in r))
+        best = min(range(len(grid)), key=errors.__getitem__)
+        x, error = levenberg_marquardt(lower_residuals, [grid[best]])
+        return error, limited_exp(x[0])
+
+    def clip_entries(self, brefwhite):
+        """Return entries where the table leaves the unclipped curve and reaches its top"""
+        gamma = self.gamma
+        gamma.brefwhite = brefwhite
+        gamma.bsoftclip = None
+        gamma.bhardclip = None
+        if self.generate() is None:
+            return None, None
+        unclipped = gamma.table
+        target = self.target
+        last = len(target) - 1
+        top = last
+        while top > 0 and target[top - 1] == target[top]:
+            top -= 1
+        hard = top if 0 < top < last else None
+        end = last if hard is None else hard
+        knee = next((i for i in range(1, end) if unclipped[i] - target[i] > 1), None)
+        if knee is None and hard is not None and target[hard] < unclipped[hard] - 1:
+            knee = hard
+        return knee, hard
+
+    def fit_entries(self, knee, hard, x0, iterations):
+        """Return search vector and squared error of least squares fit with clip entries"""
+        def residuals(x):
+            self.set_params(knee, hard, x)
+            return self.residuals()
+        return levenberg_marquardt(residuals, x0, iterations)
+
+    def search(self, knee, hard, x0):
+        """Return best knee, hard, search vector and error found moving clip entries"""
+        x, error = self.fit_entries(knee, hard, x0, LM_ITERATIONS)
+        best = (knee, hard, x, error)
+        tried = {(knee, hard)}
+        improved = True
+        while improved and best[3] > 0:
+            improved = False
+            knee, hard, x, _ = best
+            moves = []
+            if knee is not None:
+                moves += [(knee - 1, hard), (knee + 1, hard)]
+            if hard is not None:
+                # A soft clip that reaches the top also ends in a flat top
+                moves += [(knee, hard - 1), (knee, hard + 1), (knee, None)]
+            for move in moves:
+                move_knee, move_hard = move
+                if move in tried or (move_knee is not None and move_knee < 1) or (
+                        move_hard is not None and not 1 <= move_hard < len(self.target)) or (
+                            None not in move and move_knee > move_hard) or move == (None, None):
+                    continue
+                tried.add(move)
+                x, error = self.fit_entries(move_knee, move_hard, best[2], NEIGHBOUR_ITERATIONS)
+                if error < best[3]:
+                    best = (move_knee, move_hard, x, error)
+                    improved = True
+                    break
+        knee, hard, x, _ = best
+        x, error = self.fit_entries(knee, hard, x, LM_ITERATIONS)
+        return knee, hard, x, error
+
+    def polish(self, knee, hard, x0):
+        """Return search vector and squared error of the closest rounded table found near x0"""
+        def rounded_objective(x):
+            self.set_params(knee, hard, x)
+            return self.rounded_error()
+        return nelder_mead(rounded_objective, x0, POLISH_STEPS, POLISH_EVALUATIONS)
+
+    def simplify(self):
+        """Round fitted parameters to as few digits as keep the table as close to the target"""
+        gamma = self.gamma
+        error = self.rounded_error()
+        for param in ('brefwhite', 'bsoftclip', 'bhardclip', 'end_slope', 'clip_gamma'):
+            value = getattr(gamma, param)
+            if not value:
+                continue
+            for digits in range(2, 10):
+                setattr(gamma, param, float('{:.{}g}'.format(value, digits)))
+                if self.rounded_error() <= error:
+                    break
+            else:
+                setattr(gamma, param, value)
+        self.rounded_error()
+
+    def fit(self):
+        """Return FitResult of the parameters that best reproduce the table"""
+        start = time.perf_counter()
+        candidates = []
+        for eotfentry in eotf.eotfs:
+            for input_level in INPUT_LEVELS:
+                self.set_candidate(eotfentry, input_level)
+                error, brefwhite = self.fit_brefwhite()
+                candidates.append((error, eotfentry, input_level, brefwhite))
+        candidates.sort(key=lambda candidate: candidate[0])
+
+        # Some EOTFs and input levels match the lower entries equally well,
+        # so all close matches are fitted briefly before the best are searched
+        limit = candidates[0][0] + len(self.lower)
+        screened = []
+        for index, (error, eotfentry, input_level, brefwhite) in enumerate(candidates):
+            if index >= FIT_CANDIDATES and error > limit:
+                break
+            self.set_candidate(eotfentry, input_level)
+            knee, hard = self.clip_entries(brefwhite)
+            x = [math.log(brefwhite), 0.75, 0.0, 0.0]
+            x, error = self.fit_entries(knee, hard, x, SCREEN_ITERATIONS)
+            screened.append((error, eotfentry, input_level, knee, hard, x))
+        screened.sort(key=lambda candidate: candidate[0])
+
+        best = None
+        for _, eotfentry, input_level, knee0, hard0, x0 in screened[:FIT_CANDIDATES]:
+            for clip in (0, 1):
+                self.set_candidate(eotfentry, input_level, clip)
+                knee, hard, x, _ = self.search(knee0, hard0, x0)
+                x, error = self.polish(knee, hard, x)
+                if best is None or error < best[0]:
+                    best = (error, eotfentry, input_level, clip, knee, hard, x)
+                if error == 0 or knee is None:
+                    # Clip curve type only changes the soft clip
+                    break
+            if best[0] == 0:
+                break
+
+        _, eotfentry, input_level, clip, knee, hard, x = best
+        self.set_candidate(eotfentry, input_level, clip)
+        self.set_params(knee, hard, x)
+        self.simplify()
+        return FitResult(self.gamma, self.target, self.evaluations, time.perf_counter() - start)
+
+def fit_table(table, base=None):
+    """Return FitResult of GammaCurve parameters that reproduce table
+
+    bmax and black levels are taken from base if it is set.
+    """
+    return Fitter(table, base).fit()
+
+def main():
+    """Fit gamma curve parameters to a saved raw table or the table in the projector"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('conf', nargs='?',
+                        help='gamma curve file name with table to fit, like written-Custom1')
+    parser.add_argument('--read', action='store_true', help='read table from projector')
+    parser.add_argument('--base', help='gamma curve file to take bmax and black levels from')
+    parser.add_argument('--save', help='save fitted gamma curve as')
+    args = parser.parse_args()
+
+    gamma = GammaCurve()
+    if args.read:
+        gamma.read()
+    elif args.conf:
+        gamma.file_load(args.conf)
+    else:
+        parser.error('Specify a gamma curve file or --read')
+    base = None
+    if args.base:
+        base = GammaCurve()
+        base.file_load(args.base)
+    result = fit_table(gamma.get_table(), base)
+    print(result.summary())
+    if args.save and (result.mismatches == 0 or strtobool(
+            input('Fitted table differs, save anyway (y/n)? '))):
+        result.gamma.file_save(args.save)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+
+"""JVC gamma curve parameter sweep
+
+A sweep generates the gamma table of every combination of a grid of
+parameter values, optionally combined with random samples of parameter
+ranges, in a pool of worker processes. Results are written to a columnar
+file as they arrive: one fixed size column per parameter, the gamma tables
+and the derived metrics of each curve. Rows are addressed by index, so
+neither the variants nor the results are ever held in memory as a whole.
+"""
+
+import argparse
+import array
+import concurrent.futures
+import json
+import math
+import os
+import random
+import struct
+import sys
+import time
+
+import jvc_gamma
+from jvc_gamma import GammaCurve
+
+FORMAT = 'jvc-gamma-sweep'
+VERSION = 1
+MAGIC = b'JVCSWEEP'
+
+# Curves generated by each worker task
+CHUNK_SIZE = 256
+
+# Parameters that can be swept, bsoftclip.* set keys of the scaled soft clip dict
+SWEEP_PARAMETERS = ('bblack', 'bblackin', 'brefwhite', 'bmax', 'bsoftclip', 'bhardclip',
+                    'end_slope', 'clip', 'clip_gamma', 'bsoftclip.bbase', 'bsoftclip.bmin',
+                    'bsoftclip.scale', 'bsoftclip.hcscale')
+
+# Result columns after the parameter columns, as (name, array typecode, width)
+RESULT_COLUMNS = [
+    ('table', 'H', 256),
+    ('isoftclip', 'd', 1),
+    ('ihardclip', 'd', 1),
+    ('flat_spots', 'H', 1),
+    ('max_step', 'H', 1),
+    ('ok', 'B', 1),
+    ]
+
+NUMPY_TYPES = {'d': 'f8', 'H': 'u2', 'h': 'i2', 'B': 'u1'}
+
+class Design:
+    """Parameter values of a sweep
+
+    grid maps parameter names to lists of values, and every combination is
+    generated. ranges maps parameter names to (low, high), and each grid
+    point is combined with samples random values drawn from the ranges. The
+    random values of a row only depend on seed and the row index.
+    """
+    def __init__(self, grid=None, ranges=None, samples=1, seed=0):
+        self.grid = [(name, list(values)) for name, values in (grid or {}).items()]
+        self.ranges = [(name, tuple(limits)) for name, limits in (ranges or {}).items()]
+        self.samples = samples if self.ranges else 1
+        self.seed = seed
+        for name in self.names():
+            if name not in SWEEP_PARAMETERS:
+                raise ValueError('Cannot sweep {}, use one of {}'.format(
+                    name, ', '.join(SWEEP_PARAMETERS)))
+        if len(set(self.names())) != len(self.names()):
+            raise ValueError('Parameter swept more than once')
+
+    def names(self):
+        """Return swept parameter names"""
+        return [name for name, _ in self.grid] + [name for name, _ in self.ranges]
+
+    def count(self):
+        """Return number of variants"""
+        return math.prod(len(values) for _, values in self.grid) * self.samples
+
+    def variant(self, row):
+        """Return parameter values of variant row, in the order of names"""
+        index, _ = divmod(row, self.samples)
+        values = []
+        for _, gridvalues in reversed(self.grid):
+            index, i = divmod(index, len(gridvalues))
+            values.append(gridvalues[i])
+        values.reverse()
+        if self.ranges:
+            rng = random.Random('{}:{}'.format(self.seed, row))
+            values += [rng.uniform(low, high) for _, (low, high) in self.ranges]
+        return values
+
+    def conf(self):
+        """Return design as dict for the file header"""
+        return {'grid': dict(self.grid), 'ranges': dict(self.ranges),
+                'samples': self.samples, 'seed': self.seed}
+
+def set_parameter(gamma, name, value):
+    """Set swept parameter of gamma curve"""
+    if name.startswith('bsoftclip.'):
+        if not isinstance(gamma.bsoftclip, dict):
+            gamma.bsoftclip = dict()
+        gamma.bsoftclip[name.split('.', 1)[1]] = value
+    else:
+        setattr(gamma, name, value)
+
+def table_metrics(table):
+    """Return flat spot count and max step of gamma table
+
+    Flat spots are adjacent entries with the same value, not counting the
+    entries at the bottom and top values of the table.
+    """
+    flat_spots = sum(1 for a, b in zip(table, table[1:]) if a == b and table[0] < a < table[-1])
+    max_step = max(b - a for a, b in zip(table, table[1:]))
+    return flat_spots, max_step
+
+def sweep_columns(design):
+    """Return list of (name, typecode, width) of the columns of a sweep file"""
+    return [(name, 'd', 1) for name in design.names()] + RESULT_COLUMNS
+
+# Gamma curve and design of a worker process
+worker_state = None
+
+def worker_init(conf, design):
+    """Create the gamma curve used by sweep_rows"""
+    global worker_state
+    gamma = GammaCurve()
+    gamma.conf_load(conf)
+    worker_state = (gamma, design)
+
+def sweep_rows(start, stop):
+    """Generate variants start to stop, return start and dict of column data"""
+    gamma, design = worker_state
+    names = design.names()
+    columns = {name: array.array(typecode) for name, typecode, _ in sweep_columns(design)}
+    for row in range(start, stop):
+        values = design.variant(row)
+        for name, value in zip(names, values):
+            set_parameter(gamma, name, value)
+            columns[name].append(value)
+        try:
+            gamma.generate_table()
+        except (ArithmeticError, ValueError):
+            columns['table'].extend([0] * 256)
+            columns['isoftclip'].append(math.nan)
+            columns['ihardclip'].append(math.nan)
+            columns['flat_spots'].append(0)
+            columns['max_step'].append(0)
+            columns['ok'].append(0)
+            continue
+        flat_spots, max_step = table_metrics(gamma.table)
+        columns['table'].extend(gamma.table)
+        columns['isoftclip'].append(math.nan if gamma.isoftclip is None else gamma.isoftclip)
+        columns['ihardclip'].append(math.nan if gamma.ihardclip is None else gamma.ihardclip)
+        columns['flat_spots'].append(flat_spots)
+        columns['max_step'].append(max_step)
+        columns['ok'].append(1)
+    return start, {name: column.tobytes() for name, column in columns.items()}
+
+def sweep_conf(gamma):
+    """Return configuration of gamma used as base of every variant"""
+    if gamma.raw_gamma_table():
+        raise ValueError('Cannot sweep a raw gamma table')
+    conf = gamma.conf_save(generated=False)
+    # Highlight colors are for tuning, the sweep stores the plain table
+    conf['highlight'] = None
+    conf['debug'] = 0
+    return conf
+
+def sweep(filename, design, gamma=None, workers=None, chunk=CHUNK_SIZE):
+    """Generate all variants of design based on gamma and write them to filename
+
+    workers is the number of worker processes, default one per cpu. With
+    workers 0 the curves are generated in this process. Return the number of
+    variants that failed to generate.
+    """
+    conf = sweep_conf(gamma or GammaCurve())
+    count = design.count()
+    layout = []
+    offset = 0
+    for name, typecode, width in sweep_columns(design):
+        itemsize = array.array(typecode).itemsize
+        layout.append({'name': name, 'type': typecode, 'width': width, 'offset': offset})
+        offset += -(-count * width * itemsize // 8) * 8
+    header = json.dumps({'format': FORMAT, 'version': VERSION, 'count': count,
+                         'byteorder': sys.byteorder, 'conf': conf, 'design': design.conf(),
+                         'columns': layout}).encode()
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % 8)
+    data_start = len(MAGIC) + 4 + len(header)
+    rowbytes = {col['name']: col['width'] * array.array(col['type']).itemsize for col in layout}
+    starts = {col['name']: data_start + col['offset'] for col in layout}
+
+    failed = 0
+    with open(filename, 'wb') as file:
+        file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        file.truncate(data_start + offset)
+
+        def write(result):
+            nonlocal failed
+            start, columns = result
+            for name, data in columns.items():
+                file.seek(starts[name] + start * rowbytes[name])
+                file.write(data)
+            failed += columns['ok'].count(0)
+
+        ranges = ((start, min(count, start + chunk)) for start in range(0, count, chunk))
+        if workers == 0:
+            worker_init(conf, design)
+            for start, stop in ranges:
+                write(sweep_rows(start, stop))
+            return failed
+        workers = workers or os.cpu_count()
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=worker_init, initargs=(conf, design)) as executor:
+            # Only keep a few tasks per worker queued, results are written as they arrive
+            pending = set()
+            for start, stop in ranges:
+                pending.add(executor.submit(sweep_rows, start, stop))
+                if len(pending) >= workers * 2:
+                    done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        write(future.result())
+            for future in concurrent.futures.as_completed(pending):
+                write(future.result())
+    return failed
+
+class SweepFile:
+    """Columns of a file written by sweep
+
+    Columns are numpy memory maps if numpy is installed, otherwise arrays.
+    Columns with more than one value per row, like table, have a row per
+    variant with numpy and are flat arrays without.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a gamma sweep file'.format(filename))
+            size, = struct.unpack('<I', file.read(4))
+            header = json.loads(file.read(size))
+        if header.get('version', 0) > VERSION:
+            raise ValueError('{} has unsupported version {}'.format(filename, header['version']))
+        self.data_start = len(MAGIC) + 4 + size
+        self.count = header['count']
+        self.byteorder = header['byteorder']
+        self.conf = header['conf']
+        self.design = header['design']
+        self.layout = {col['name']: col for col in header['columns']}
+        self.columns = dict()
+
+    def names(self):
+        """Return column names"""
+        return list(self.layout)
+
+    def parameters(self):
+        """Return swept parameter names"""
+        return list(self.design['grid']) + list(self.design['ranges'])
+
+    def column(self, name):
+        """Return column data"""
+        if name in self.columns:
+            return self.columns[name]
+        col = self.layout[name]
+        offset = self.data_start + col['offset']
+        np = jvc_gamma.get_numpy()
+        if np is not None:
+            dtype = np.dtype(NUMPY_TYPES[col['type']]).newbyteorder(
+                '<' if self.byteorder == 'little' else '>')
+            shape = (self.count, col['width']) if col['width'] > 1 else (self.count,)
+            data = np.memmap(self.filename, dtype, 'r', offset, shape) if self.count else (
+                np.zeros(shape, dtype))
+        else:
+            data = array.array(col['type'])
+            with open(self.filename, 'rb') as file:
+                file.seek(offset)
+                data.frombytes(file.read(self.count * col['width'] * data.itemsize))
+            if self.byteorder != sys.byteorder:
+                data.byteswap()
+        self.columns[name] = data
+        return data
+
+    def row(self, row):
+        """Return dict of the values of variant row, table as list"""
+        values = dict()
+        for name, col in self.layout.items():
+            data = self.column(name)
+            if col['width'] > 1:
+                value = data[row * col['width']:(row + 1) * col['width']] if isinstance(
+                    data, array.array) else data[row]
+                values[name] = [int(v) for v in value]
+            else:
+                values[name] = data[row].item() if hasattr(data[row], 'item') else data[row]
+        return values
+
+    def gamma_curve(self, row):
+        """Return GammaCurve with the parameters of variant row"""
+        gamma = GammaCurve()
+        gamma.conf_load(self.conf)
+        values = self.row(row)
+        for name in self.parameters():
+            set_parameter(gamma, name, values[name])
+        gamma.generate_table()
+        return gamma
+
+def parse_values(spec):
+    """Parse name=v1,v2,... or name=start:stop:count grid values"""
+    name, _, values = spec.partition('=')
+    if values.count(':') == 2:
+        start, stop, num = values.split(':')
+        start, stop, num = float(start), float(stop), int(num)
+        if num < 2:
+            return name, [start]
+        return name, [start + (stop - start) * i / (num - 1) for i in range(num)]
+    return name, [float(value) for value in values.split(',')]
+
+def parse_range(spec):
+    """Parse name=low:high random range"""
+    name, _, limits = spec.partition('=')
+    low, high = limits.split(':')
+    return name, (float(low), float(high))
+
+def print_rows(sweepfile, sort=None, reverse=False, limit=10):
+    """Print parameters and metrics of the variants, sorted by column sort"""
+    rows = range(sweepfile.count)
+    if sort:
+        key = sweepfile.column(sort)
+        rows = sorted(rows, key=lambda row: key[row], reverse=reverse)
+    names = [name for name in sweepfile.names() if name != 'table']
+    print(' '.join('{:>12}'.format(name.split('.')[-1][:12]) for name in ['row'] + names))
+    for row in list(rows)[:limit]:
+        values = sweepfile.row(row)
+        print(' '.join('{:12.5g}'.format(value) for value in [row] + [
+            values[name] for name in names]))
+
+def main():
+    """Generate or show gamma curve parameter sweeps"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    parser_run = subparsers.add_parser('run', help='generate sweep and write it to file')
+    parser_run.add_argument('file')
+    parser_run.add_argument('--conf', help='gamma curve to sweep from, saved with the menu')
+    parser_run.add_argument('--grid', action='append', default=[], metavar='NAME=VALUES',
+                            help='values v1,v2,... or start:stop:count of parameter NAME')
+    parser_run.add_argument('--random', action='append', default=[], metavar='NAME=LOW:HIGH',
+                            help='range of random values of parameter NAME')
+    parser_run.add_argument('--samples', type=int, default=1000,
+                            help='random samples per grid point')
+    parser_run.add_argument('--seed', type=int, default=0, help='random seed')
+    parser_run.add_argument('--workers', type=int, help='worker processes (default cpu count)')
+    parser_run.add_argument('--chunk', type=int, default=CHUNK_SIZE,
+                            help='curves generated per worker task')
+    parser_show = subparsers.add_parser('show', help='show variants of sweep file')
+    parser_show.add_argument('file')
+    parser_show.add_argument('--sort', help='column to sort by')
+    parser_show.add_argument('--reverse', action='store_true', help='sort largest first')
+    parser_show.add_argument('--limit', type=int, default=10, help='variants to show')
+    args = parser.parse_args()
+
+    if args.action == 'show':
+        sweepfile = SweepFile(args.file)
+        print('{} variants of {}'.format(sweepfile.count,
+                                          ', '.join(sweepfile.parameters()) or 'base curve'))
+        print_rows(sweepfile, args.sort, args.reverse, args.limit)
+        return
+
+    gamma = GammaCurve()
+    if args.conf:
+        gamma.file_load(args.conf)
+    design = Design(dict(parse_values(spec) for spec in args.grid),
+                    dict(parse_range(spec) for spec in args.random),
+                    samples=args.samples, seed=args.seed)
+    start = time.perf_counter()
+    failed = sweep(args.file, design, gamma, workers=args.workers, chunk=args.chunk)
+    elapsed = time.perf_counter() - start
+    print('Generated {} curves, {} failed, in {:.3f}s ({:.0f} curves/s)'.format(
+        design.count(), failed, elapsed, design.count() / elapsed if elapsed else 0))
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,24 @@
 
 """JVC projector network connection module"""
 
+import asyncio
 import json
 import select
 import socket
+import time
 import dumpdata
+import jvc_stats
 
 conf_file = 'jvc_network.conf'
 
+DEFAULT_PORT = 20554
+
+PJ_OK = b'PJ_OK'
+PJREQ = b'PJREQ'
+PJACK = b'PJACK'
+
+RECV_BUFFER_SIZE = 4096
+
 class Error(Exception):
     """Error"""
     pass
@@ -21,38 +32,111 @@ class Timeout(Exception):
     """Command Timout"""
     pass
 
+def load_conf():
+    """Load saved network configuration, return empty dict if not available"""
+    try:
+        with open(conf_file, 'r') as f:
+            return json.load(f)
+    except:
+        return dict()
+
+def discover_host(use_cache=True):
+    """Search local network for projectors and return selected (host, port) or None"""
+    import jvc_discover
+    print('Searching for projectors on the local network...')
+    try:
+        projectors = jvc_discover.discover(use_cache=use_cache)
+    except Exception as err:
+        print('Search failed', err)
+        return None
+    if not projectors:
+        print('No projectors found')
+        return None
+    if len(projectors) == 1:
+        print('Found', projectors[0])
+        return projectors[0].host_port
+    for i, projector in enumerate(projectors, 1):
+        print('{:<10}'.format(i), projector)
+    try:
+        return projectors[int(input('Select projector (or press enter to skip): ')) - 1].host_port
+    except (ValueError, IndexError):
+        return None
+
 class JVCNetwork:
     """JVC projector network connection"""
-    def __init__(self, print_all=False, print_recv=False, print_send=False):
+    def __init__(self, print_all=False, print_recv=False, print_send=False, host_port=None,
+                 stats=None, capture=None):
         self.print_recv = print_recv or print_all
         self.print_send = print_send or print_all
         self.socket = None
-        self.host_port = None
+        self.host_port = host_port
+        self.stats = stats if stats is not None else jvc_stats.global_stats
+        if isinstance(capture, str):
+            import jvc_capture
+            capture = jvc_capture.CaptureWriter(capture)
+        self.capture = capture
+        self.buffer = bytearray(RECV_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
 
-    def connect(self):
-        """Open network connection to projector and perform handshake"""
+    def _open(self):
+        """Open network connection to projector"""
+        stats = self.stats
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Commands are small, send them without waiting for acks of previous data
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         try:
             if self.print_send:
                 print('    - connecting...')
-            self.socket.connect(self.host_port)
+            if stats is not None:
+                start = time.perf_counter()
+            address = socket.getaddrinfo(*self.host_port, socket.AF_INET, socket.SOCK_STREAM)[0][4]
+            if stats is not None:
+                resolved = time.perf_counter()
+                stats.record('dns', None, resolved - start)
+            self.socket.connect(address)
+            if stats is not None:
+                stats.record('connect', None, time.perf_counter() - resolved)
             if self.print_send:
                 print('    - connected')
         except Exception as err:
+            if stats is not None:
+                stats.count('connect_error')
             raise Error('Connection failed', err)
-        self.expect(b'PJ_OK')
-        self.send(b'PJREQ')
-        self.expect(b'PJACK')
+
+    def connect(self):
+        """Open network connection to projector and perform handshake"""
+        self.start = self.end = 0
+        self._open()
+        if self.capture is not None:
+            self.capture.record_connect(self.host_port)
+        if self.stats is not None:
+            start = time.perf_counter()
+        self.expect(PJ_OK)
+        self.send(PJREQ)
+        self.expect(PJACK)
+        if self.stats is not None:
+            self.stats.record('handshake', None, time.perf_counter() - start)
 
     def __enter__(self):
-        try:
-            with open(conf_file, 'r') as f:
-                conf = json.load(f)
-        except:
-            conf = dict()
+        if self.host_port is not None:
+            self.connect()
+            return self
+
+        conf = load_conf()
         save_conf = False
+        search = True
+        search_use_cache = True
 
         while True:
+            if not conf.get('host', None) and search:
+                search = False
+                found = discover_host(use_cache=search_use_cache)
+                if found:
+                    conf['host'], conf['port'] = found
+                    save_conf = True
+
             if not conf.get('host', None):
                 print('\nIf you have configured a hostname for your projector (usually in your\n'
                       'internet gateway) enter that hostname here.\n'
@@ -64,7 +148,7 @@ class JVCNetwork:
                 save_conf = True
 
             if not conf.get('port', None):
-                conf['port'] = 20554
+                conf['port'] = DEFAULT_PORT
                 save_conf = True
 
             try:
@@ -79,11 +163,14 @@ class JVCNetwork:
 
                 print('\nCheck that nothing else is connected, as the projector only supports a\n'
                       'single connection at a time. Then enter "r" to retry with the same network\n'
-                      'network address, enter "n" to try a new network address, or enter "a" to')
-                ret = input('abort. [r/n/a]: ')
-                if ret == 'n':
+                      'network address, enter "n" to try a new network address, enter "d" to\n'
+                      'search the local network for projectors, or enter "a" to')
+                ret = input('abort. [r/n/d/a]: ')
+                if ret in ('n', 'd'):
                     conf['host'] = None
                     conf['port'] = None
+                    search = ret == 'd'
+                    search_use_cache = False
                     continue
                 if ret == 'r':
                     continue
@@ -100,13 +187,19 @@ class JVCNetwork:
         """Close socket"""
         if self.print_send:
             print('    - close socket')
+        if self.capture is not None:
+            self.capture.record_close()
         self.socket.close()
 
     def __exit__(self, exception, value, traceback):
         self.close()
+        if self.capture is not None:
+            self.capture.close()
 
     def reconnect(self):
         """Re-open network connection"""
+        if self.stats is not None:
+            self.stats.count('reconnect')
         self.close()
         self.connect()
 
@@ -114,27 +207,220 @@ class JVCNetwork:
         """Send data with optional data dump"""
         if self.print_send:
             dumpdata.dumpdata('    > Send:    ', '{:02x}', data)
+        if self.capture is not None:
+            self.capture.record_send(data)
         try:
-            self.socket.send(data)
+            self.socket.sendall(data)
         except ConnectionAbortedError as err:
             raise Closed(err)
 
-    def recv(self, limit=1024, timeout=0):
-        """Receive data with optional timeout and data dump"""
-        if timeout:
-            ready = select.select([self.socket], [], [], timeout)
+    def _make_room(self, size):
+        """Make room for at least size more bytes at the end of the receive buffer"""
+        if len(self.buffer) - self.end >= size:
+            return
+        buffered = self.end - self.start
+        if buffered + size > len(self.buffer):
+            newbuffer = bytearray(max(2 * len(self.buffer), buffered + size))
+            newbuffer[:buffered] = self.view[self.start:self.end]
+            self.view.release()
+            self.buffer = newbuffer
+            self.view = memoryview(self.buffer)
+        else:
+            self.view[:buffered] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = buffered
+
+    def _fill(self, timeout=None):
+        """Wait for data and append it to the receive buffer"""
+        if timeout is not None:
+            ready = select.select([self.socket], [], [], timeout or None)
             if not ready[0]:
-                raise Timeout('{} second timeout expired'.format(timeout))
-        data = self.socket.recv(limit)
+                raise Timeout
+        self._make_room(1)
+        count = self.socket.recv_into(self.view[self.end:])
+        if not count:
+            raise Closed('Connection closed by projector')
+        self._received(count)
+
+    def _received(self, count):
+        """Add count bytes received at the end of the receive buffer"""
+        if self.capture is not None:
+            self.capture.record_recv(self.view[self.end:self.end + count])
+        if self.print_recv:
+            dumpdata.dumpdata('    < Received:', '{:02x}', self.view[self.end:self.end + count])
+        self.end += count
+
+    def _fill_until(self, deadline, timeout):
+        """Fill receive buffer, raise Timeout if deadline has passed"""
+        if deadline is None:
+            self._fill()
+            return
+        remaining = deadline - time.monotonic()
+        try:
+            if remaining <= 0:
+                raise Timeout
+            self._fill(remaining)
+        except Timeout:
+            raise Timeout('{} second timeout expired'.format(timeout))
+
+    def _consume(self, size):
+        """Remove size bytes from the start of the receive buffer and return them"""
+        data = bytes(self.view[self.start:self.start + size])
+        self.start += size
+        if self.start == self.end:
+            self.start = self.end = 0
+        return data
+
+    def recv(self, limit=1024, timeout=0):
+        """Receive buffered or new data with optional timeout and data dump"""
+        if self.start == self.end:
+            self._fill_until(time.monotonic() + timeout if timeout else None, timeout)
+        return self._consume(min(limit, self.end - self.start))
+
+    def read_exactly(self, size, timeout=0):
+        """Receive exactly size bytes with optional timeout"""
+        deadline = time.monotonic() + timeout if timeout else None
+        if size > len(self.buffer) - self.start:
+            self._make_room(size - (self.end - self.start))
+        while self.end - self.start < size:
+            self._fill_until(deadline, timeout)
+        return self._consume(size)
+
+    def read_until(self, separator, timeout=0):
+        """Receive data up to and including separator with optional timeout"""
+        deadline = time.monotonic() + timeout if timeout else None
+        scanned = 0
+        while True:
+            pos = self.buffer.find(separator, self.start + scanned, self.end)
+            if pos >= 0:
+                return self._consume(pos + len(separator) - self.start)
+            scanned = max(0, self.end - self.start - len(separator) + 1)
+            self._fill_until(deadline, timeout)
+
+    def expect(self, res, timeout=1):
+        """Receive data and compare it against expected data"""
+        data = self.read_exactly(len(res), timeout)
+        if data != res:
+            raise Error('Expected', res)
+
+class AsyncJVCNetwork:
+    """JVC projector network connection using asyncio streams"""
+    def __init__(self, print_all=False, print_recv=False, print_send=False, host_port=None,
+                 stats=None, capture=None):
+        self.print_recv = print_recv or print_all
+        self.print_send = print_send or print_all
+        self.reader = None
+        self.writer = None
+        self.host_port = host_port
+        self.stats = stats if stats is not None else jvc_stats.global_stats
+        if isinstance(capture, str):
+            import jvc_capture
+            capture = jvc_capture.CaptureWriter(capture)
+        self.capture = capture
+
+    async def connect(self):
+        """Open network connection to projector and perform handshake"""
+        stats = self.stats
+        try:
+            if self.print_send:
+                print('    - connecting...')
+            if stats is not None:
+                start = time.perf_counter()
+            self.reader, self.writer = await asyncio.open_connection(*self.host_port)
+            if stats is not None:
+                stats.record('connect', None, time.perf_counter() - start)
+            if self.print_send:
+                print('    - connected')
+        except Exception as err:
+            if stats is not None:
+                stats.count('connect_error')
+            raise Error('Connection failed', err)
+        if self.capture is not None:
+            self.capture.record_connect(self.host_port)
+        if stats is not None:
+            start = time.perf_counter()
+        await self.expect(PJ_OK)
+        await self.send(PJREQ)
+        await self.expect(PJACK)
+        if stats is not None:
+            stats.record('handshake', None, time.perf_counter() - start)
+
+    async def __aenter__(self):
+        if self.host_port is None:
+            conf = load_conf()
+            if not conf.get('host', None):
+                raise Error('Connection failed', 'No projector address configured')
+            self.host_port = (conf['host'], conf.get('port', None) or DEFAULT_PORT)
+        await self.connect()
+        return self
+
+    async def close(self):
+        """Close stream"""
+        if self.print_send:
+            print('    - close socket')
+        if self.capture is not None:
+            self.capture.record_close()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    async def __aexit__(self, exception, value, traceback):
+        await self.close()
+        if self.capture is not None:
+            self.capture.close()
+
+    async def reconnect(self):
+        """Re-open network connection"""
+        if self.stats is not None:
+            self.stats.count('reconnect')
+        await self.close()
+        await self.connect()
+
+    async def send(self, data):
+        """Send data with optional data dump"""
+        if self.print_send:
+            dumpdata.dumpdata('    > Send:    ', '{:02x}', data)
+        if self.capture is not None:
+            self.capture.record_send(data)
+        try:
+            self.writer.write(data)
+            await self.writer.drain()
+        except ConnectionError as err:
+            raise Closed(err)
+
+    async def _read(self, coro, timeout):
+        """Wait for read operation with optional timeout and data dump"""
+        try:
+            data = await asyncio.wait_for(coro, timeout or None)
+        except asyncio.TimeoutError:
+            raise Timeout('{} second timeout expired'.format(timeout))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            raise Closed('Connection closed by projector')
         if not len(data):
             raise Closed('Connection closed by projector')
+        if self.capture is not None:
+            self.capture.record_recv(data)
         if self.print_recv:
             dumpdata.dumpdata('    < Received:', '{:02x}', data)
         return data
 
-    def expect(self, res, timeout=1):
+    async def recv(self, limit=1024, timeout=0):
+        """Receive data with optional timeout and data dump"""
+        return await self._read(self.reader.read(limit), timeout)
+
+    async def read_exactly(self, size, timeout=0):
+        """Receive exactly size bytes with optional timeout"""
+        return await self._read(self.reader.readexactly(size), timeout)
+
+    async def read_until(self, separator, timeout=0):
+        """Receive data up to and including separator with optional timeout"""
+        return await self._read(self.reader.readuntil(separator), timeout)
+
+    async def expect(self, res, timeout=1):
         """Receive data and compare it against expected data"""
-        data = self.recv(len(res), timeout)
+        data = await self.read_exactly(len(res), timeout)
         if data != res:
             raise Error('Expected', res)
 
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+"""JVC projector command planner
+
+A Plan describes the gets, sets and verifies of a flow as a batch. Running it
+reads values in pipelined batches, skips reads of values that are already
+known, skips sets of values the projector already has, reads verified values
+back together, and sets settings that change other settings first. Each plan
+counts the round trips the same steps would take one command at a time and the
+round trips actually used.
+"""
+
+import math
+
+import jvc_protocol
+from jvc_command import (
+    BinaryData, CODECS, NoVerify, changed_by, check_verify, get_request)
+
+# Print round trips of each plan after it runs
+PRINT_SUMMARY = False
+
+# Steps, naive and actual round trips of all plans run, by plan name
+totals = dict()
+
+class PlanValue:
+    """Value read by a Plan, available after the plan has run"""
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.value = None
+        self.error = None
+
+    def result(self):
+        """Return value, or raise the error that prevented reading it"""
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+class Step:
+    """Planned get, set, verify or call"""
+    def __init__(self, kind, cmd=None, val=None, verify=False, target=None, changes=None):
+        self.kind = kind
+        self.cmd = cmd
+        self.val = val
+        self.verify = verify
+        self.target = target
+        self.changes = changes
+
+    def naive_round_trips(self):
+        """Return round trips used to run step on its own"""
+        if self.kind == 'call':
+            return 0
+        if self.kind == 'set':
+            return 2 if self.verify and not issubclass(self.cmd.value[1], NoVerify) else 1
+        return 1
+
+def changes_overlap(changes, cmds):
+    """Return True if a step that changes changes (None for all) can change any of cmds"""
+    return bool(cmds) and (changes is None or not changes.isdisjoint(cmds))
+
+def is_setting(step):
+    """Return True if step sets a setting, not an action like a remote key press
+
+    Sets of the same setting can be reordered and collapsed, actions can not.
+    """
+    return (step.kind == 'set' and not issubclass(step.cmd.value[1], NoVerify) and
+            changed_by(step.cmd, step.val) is not None)
+
+def order_sets(steps):
+    """Return setting steps with settings that change other settings first
+
+    Only the last set of a command is kept, as it overwrites the earlier ones.
+    """
+    last = {step.cmd: step for step in steps}
+    remaining = [step for step in steps if last[step.cmd] is step]
+    for step in steps:
+        if step.verify:
+            last[step.cmd].verify = True
+    ordered = []
+    while remaining:
+        for step in remaining:
+            if not any(step.cmd in changed_by(other.cmd, other.val)
+                       for other in remaining if other is not step):
+                break
+        else:
+            # Commands that change each other keep their order
+            step = remaining[0]
+        remaining.remove(step)
+        ordered.append(step)
+    return ordered
+
+class Plan:
+    """Batch of projector gets, sets and verifies run with as few round trips as possible
+
+    Steps can be added after the plan has run, and run with the values the
+    plan already knows.
+    """
+    def __init__(self, name='plan'):
+        self.name = name
+        self.steps = []
+        self.known = dict()
+        self.naive_round_trips = 0
+        self.round_trips = 0
+
+    def get(self, cmd):
+        """Read cmd, return PlanValue holding the value after the plan has run"""
+        get_request(cmd)
+        value = PlanValue(cmd)
+        self.steps.append(Step('get', cmd, target=value))
+        return value
+
+    def set(self, cmd, val, verify=False):
+        """Set cmd to val, and read it back if verify is True"""
+        self.steps.append(Step('set', cmd, CODECS[cmd].convert(val), verify))
+
+    def verify(self, cmd, val):
+        """Read cmd and raise CommandNack if it is not val"""
+        self.steps.append(Step('verify', cmd, CODECS[cmd].convert(val)))
+
+    def call(self, func, changes=None):
+        """Call func(jvc), changes is the set of commands it can set (None for any)"""
+        self.steps.append(Step('call', val=func, changes=changes))
+
+    def optimize(self):
+        """Return steps in the order they run, with sets reordered and deduplicated
+
+        Sets are only reordered within a run of sets that does not include
+        sets that can change any setting, like Power, or actions, like remote
+        key presses.
+        """
+        optimized = []
+        run = []
+        for step in self.steps:
+            if is_setting(step):
+                run.append(step)
+                continue
+            optimized.extend(order_sets(run))
+            run = []
+            optimized.append(step)
+        optimized.extend(order_sets(run))
+        return optimized
+
+    def lookup(self, jvc, cmd):
+        """Return True if the value of cmd is known from this plan or the cache"""
+        if cmd in self.known:
+            return True
+        if jvc.cache is not None:
+            value = jvc.cache.get(cmd)
+            if value is not None:
+                self.known[cmd] = value
+                return True
+        return False
+
+    def batch_round_trips(self, jvc, cmds):
+        """Return round trips used to read cmds with get_many"""
+        binary = sum(1 for cmd in cmds if issubclass(cmd.value[1], BinaryData))
+        text = len(cmds) - binary
+        if text > 1 and jvc.conn.pipelining_expected():
+            text = math.ceil(text / jvc_protocol.PIPELINE_WINDOW)
+        return text + binary
+
+    def read(self, jvc, cmds, cached=True):
+        """Read values of cmds in one batch and return dict of values or exceptions"""
+        cmds = list(dict.fromkeys(cmds))
+        missing = [cmd for cmd in cmds if not (cached and self.lookup(jvc, cmd))]
+        values = dict()
+        if missing:
+            self.round_trips += self.batch_round_trips(jvc, missing)
+            values = jvc.get_many(missing, cached=False)
+            for cmd, value in values.items():
+                if isinstance(value, Exception):
+                    self.known.pop(cmd, None)
+                else:
+                    self.known[cmd] = value
+        return {cmd: values[cmd] if cmd in values else self.known[cmd] for cmd in cmds}
+
+    def flush_reads(self, jvc, reads):
+        """Read pending get steps"""
+        if not reads:
+            return
+        values = self.read(jvc, [step.cmd for step in reads])
+        for step in reads:
+            value = values[step.cmd]
+            if isinstance(value, Exception):
+                step.target.error = value
+            else:
+                step.target.value = value
+        reads.clear()
+
+    def flush_verifies(self, jvc, verifies):
+        """Read back pending verified values in one batch"""
+        if not verifies:
+            return
+        values = self.read(jvc, list(verifies), cached=False)
+        pending = list(verifies.items())
+        verifies.clear()
+        for cmd, val in pending:
+            if isinstance(values[cmd], Exception):
+                raise values[cmd]
+            check_verify(cmd, val, values[cmd])
+
+    def forget(self, changes):
+        """Forget known values of changes (None for all)"""
+        if changes is None:
+            self.known.clear()
+            return
+        for cmd in changes:
+            self.known.pop(cmd, None)
+
+    def run(self, jvc):
+        """Run steps added since the last run"""
+        steps = self.optimize()
+        self.steps = []
+        naive = sum(step.naive_round_trips() for step in steps)
+        start = self.round_trips
+        reads = []
+        verifies = dict()
+        for step in steps:
+            if step.kind == 'get':
+                if step.cmd in verifies:
+                    self.flush_reads(jvc, reads)
+                    self.flush_verifies(jvc, verifies)
+                reads.append(step)
+                continue
+            self.flush_reads(jvc, reads)
+            if step.kind == 'verify':
+                verifies[step.cmd] = step.val
+                continue
+            if step.kind == 'call':
+                self.flush_verifies(jvc, verifies)
+                step.val(jvc)
+                self.forget(step.changes)
+                continue
+            changes = changed_by(step.cmd, step.val)
+            # Actions, like remote key presses, run after the verifies before them
+            if (changes_overlap(changes, verifies) or step.cmd in verifies or
+                    not is_setting(step)):
+                self.flush_verifies(jvc, verifies)
+            noverify = issubclass(step.cmd.value[1], NoVerify)
+            if not noverify and self.lookup(jvc, step.cmd) and self.known[step.cmd] == step.val:
+                continue
+            jvc.set(step.cmd, step.val, verify=False)
+            self.round_trips += 1
+            self.forget(changes)
+            if noverify:
+                self.known.pop(step.cmd, None)
+                continue
+            self.known[step.cmd] = step.val
+            if step.verify:
+                verifies[step.cmd] = step.val
+        self.flush_reads(jvc, reads)
+        self.flush_verifies(jvc, verifies)
+
+        actual = self.round_trips - start
+        self.naive_round_trips += naive
+        total = totals.setdefault(self.name, [0, 0, 0])
+        total[0] += len(steps)
+        total[1] += naive
+        total[2] += actual
+        if PRINT_SUMMARY:
+            print('{}: {} round trips planned as {}'.format(self.name, naive, actual))
+
+def print_totals():
+    """Print round trips of all plans run"""
+    for name, (steps, naive, actual) in totals.items():
+        print('{}: {} steps, {} round trips one at a time, {} planned'.format(
+            name, steps, naive, actual))
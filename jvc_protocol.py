@@ -2,10 +2,21 @@
 
 """JVC projector low level command module"""
 
+import asyncio
 import enum
+import json
+import random
+import threading
+import time
 
 import dumpdata
 import jvc_network
+import jvc_timeouts
+
+pipeline_conf_file = 'jvc_pipeline.conf'
+
+# Number of reference commands sent ahead of the responses in pipelined mode
+PIPELINE_WINDOW = 8
 
 class Error(Exception):
     """JVC protocol error"""
@@ -25,89 +36,596 @@ class Header(enum.Enum):
 UNIT_ID = b'\x89\x01'
 END = b'\x0a'
 
-class JVCConnection:
-    """JVC projector low level command processing class"""
-    def __init__(self, print_cmd_send=False, print_cmd_res=False, print_all=False, **args):
+FOUR_CHAR_CODE_PREFIXES = {b'PM', b'IS', b'IN', b'DS', b'FU', b'IF', b'SU'}
+
+def command_code(cmd):
+    """Return command code part of command (without operation argument)"""
+    return cmd[:4] if cmd[:2] in FOUR_CHAR_CODE_PREFIXES else cmd[:2]
+
+def cmd_packet(cmdtype, cmd):
+    """Build command packet"""
+    assert cmdtype == Header.operation or cmdtype == Header.reference
+    return cmdtype.value + UNIT_ID + cmd + END
+
+def ack_packet(cmd):
+    """Build expected ack packet for command"""
+    return Header.ack.value + UNIT_ID + cmd[:2] + END
+
+def parse_response(cmd, data):
+    """Check response packet for command and return response data"""
+    header = Header.response.value + UNIT_ID + cmd[:2]
+    if not data.startswith(header):
+        raise Error('Expected response header', header, data)
+    if not data.endswith(END):
+        raise Error('Expected END', END, data)
+    return data[len(header):-1]
+
+def load_pipeline_support(model):
+    """Return saved pipelining support for model code, or None if not known"""
+    try:
+        with open(pipeline_conf_file, 'r') as f:
+            return json.load(f).get(model.decode('latin-1'))
+    except Exception:
+        return None
+
+def save_pipeline_support(model, supported):
+    """Save pipelining support for model code"""
+    try:
+        with open(pipeline_conf_file, 'r') as f:
+            conf = json.load(f)
+    except Exception:
+        conf = dict()
+    conf[model.decode('latin-1')] = supported
+    with open(pipeline_conf_file, 'w') as f:
+        json.dump(conf, f, indent=2)
+
+class CircuitOpen(CommandNack):
+    """Command not sent because the projector recently failed to respond"""
+    pass
+
+NULL_CMD = b'\0\0'
+MODEL_CMD = b'MD'
+
+# Operation commands that are not acked until the projector has switched picture mode, input,
+# power state, gamma, color profile or installation mode. Timed separately from other sets.
+SLOW_ACK_CODES = {b'PW', b'IP', b'PMPM', b'PMGT', b'PMPR', b'INIS', b'INVS'}
+
+class ConnectionPolicy:
+    """Keep-alive, reconnect and circuit breaker settings for JVCConnection
+
+    keepalive: Send Null command after this many idle seconds (None to disable)
+    retries: Number of times to resend a command if the connection was closed
+    resync: Resynchronize with a Null command instead of reconnecting after a timeout
+    reconnect_attempts: Number of extra connection attempts before giving up
+    backoff, backoff_max, jitter: Exponential delay between connection attempts
+    breaker_threshold: Consecutive failures before failing fast (None to disable)
+    breaker_timeout: Seconds to fail fast before trying the projector again
+    breaker_exempt: Command codes still sent while failing fast
+    """
+    def __init__(self, keepalive=None, retries=1, resync=True, reconnect_attempts=0,
+                 backoff=0.5, backoff_max=8.0, jitter=0.25,
+                 breaker_threshold=None, breaker_timeout=10.0,
+                 breaker_exempt=(NULL_CMD, b'PW', MODEL_CMD)):
+        self.keepalive = keepalive
+        self.retries = retries
+        self.resync = resync
+        self.reconnect_attempts = reconnect_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.breaker_threshold = breaker_threshold
+        self.breaker_timeout = breaker_timeout
+        self.breaker_exempt = set(breaker_exempt)
+
+    def backoff_delay(self, attempt):
+        """Return delay before connection attempt number attempt (starting at 0)"""
+        delay = min(self.backoff_max, self.backoff * 2 ** attempt)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+# Policy with keep-alive and circuit breaker for long running sessions
+SESSION_POLICY = ConnectionPolicy(keepalive=20.0, reconnect_attempts=3, breaker_threshold=3)
+
+# Sleep operation yielded by the protocol core, the other operations are the name
+# and arguments of a JVCNetwork or AsyncJVCNetwork method
+SLEEP = 'sleep'
+
+class ProtocolCore:
+    """Command, ack and response processing shared by the connection classes
+
+    The *_steps methods do no I/O. They are generators that yield network
+    operations as tuples of a network method name and its arguments, and get
+    the result or exception of each operation back where they yield.
+    JVCConnection performs the operations on a socket and AsyncJVCConnection
+    on asyncio streams, so both clients share the retry, resync, circuit
+    breaker, timeout, statistics and pipelining logic.
+    """
+    def __init__(self, network, print_cmd_send=False, print_cmd_res=False, print_all=False,
+                 policy=None, timeouts=True, pipeline=None):
         self.print_cmd_send = print_cmd_send or print_all
         self.print_cmd_res = print_cmd_res or print_all
         self.print_cmd_bin_res = print_all
-        self.conn = jvc_network.JVCNetwork(print_all=print_all, **args)
+        self.conn = network
+        self.stats = self.conn.stats
+        self.policy = policy or ConnectionPolicy()
+        if timeouts is True:
+            timeouts = jvc_timeouts.AdaptiveTimeouts()
+        self.timeouts = timeouts or None
+        self.pipeline = pipeline
+        self.pipeline_supported = None
+        self.model = None
         self.reconnect = False
+        self.resync = False
+        self.last_activity = time.monotonic()
+        self.failures = 0
+        self.breaker_until = None
 
-    def __enter__(self):
-        self.conn.__enter__()
-        return self
+    def timeout(self, cmdclass):
+        """Return adaptive or fixed timeout for command class"""
+        if self.timeouts is None:
+            return jvc_timeouts.default_timeout(cmdclass)
+        return self.timeouts.timeout(cmdclass)
 
-    def __exit__(self, exception, value, traceback):
-        self.conn.__exit__(exception, value, traceback)
+    def sample(self, cmdclass, code, seconds):
+        """Record measured time for command class"""
+        if self.timeouts is not None:
+            self.timeouts.sample(cmdclass, seconds)
+        if self.stats is not None:
+            self.stats.record(cmdclass, code, seconds)
 
-    def _cmd(self, cmdtype, cmd, sendrawdata=None, acktimeout=1):
+    def expired(self, cmdclass, code):
+        """Record expired timeout for command class"""
+        if self.timeouts is not None:
+            self.timeouts.expired(cmdclass)
+        if self.stats is not None:
+            self.stats.count(cmdclass + '_timeout', code)
+
+    def keepalive_due(self):
+        """Return seconds until the next keep-alive Null command, 0 or less if due now"""
+        return self.policy.keepalive - (time.monotonic() - self.last_activity)
+
+    def _reconnect_steps(self):
+        """Re-open connection with backoff between failed attempts"""
+        policy = self.policy
+        attempt = 0
+        while True:
+            try:
+                yield ('reconnect',)
+                return
+            except jvc_network.Error:
+                self.failure()
+                if attempt >= policy.reconnect_attempts:
+                    raise
+                yield (SLEEP, policy.backoff_delay(attempt))
+                attempt += 1
+
+    def _resync_steps(self):
+        """Discard late responses by waiting for the ack of a Null command"""
+        if self.stats is not None:
+            self.stats.count('resync')
+        try:
+            yield ('send', cmd_packet(Header.operation, NULL_CMD))
+            yield ('read_until', ack_packet(NULL_CMD), 1)
+        except (jvc_network.Timeout, jvc_network.Closed, jvc_network.Error):
+            self.reconnect = True
+
+    def _recover_steps(self):
+        """Resync or reconnect if the previous command failed"""
+        if self.resync:
+            self.resync = False
+            yield from self._resync_steps()
+        if self.reconnect:
+            self.reconnect = False
+            yield from self._reconnect_steps()
+
+    def failure(self):
+        """Count failure and open circuit breaker if threshold is reached"""
+        self.failures += 1
+        threshold = self.policy.breaker_threshold
+        if threshold is not None and self.failures >= threshold:
+            if self.stats is not None and self.breaker_until is None:
+                self.stats.count('breaker_open')
+            self.breaker_until = time.monotonic() + self.policy.breaker_timeout
+
+    def check_breaker(self, cmdtype, cmd):
+        """Raise CircuitOpen if the circuit breaker is open"""
+        if self.breaker_until is None or command_code(cmd) in self.policy.breaker_exempt:
+            return
+        if time.monotonic() < self.breaker_until:
+            raise CircuitOpen('Projector not responding, retry in {:.1f} seconds'.format(
+                self.breaker_until - time.monotonic()), cmdtype, cmd)
+        # Let the next command through, a single failure re-opens the breaker
+        self.failures = self.policy.breaker_threshold - 1
+        self.breaker_until = None
+
+    def _cmd_steps(self, cmdtype, cmd, sendrawdata=None, acktimeout=None):
         """Send command and optional raw data and wait for acks"""
         if self.print_cmd_send:
             print('  > Cmd:', cmdtype, cmdtype.value+cmd)
-        assert cmdtype == Header.operation or cmdtype == Header.reference
+        self.check_breaker(cmdtype, cmd)
+        packet = cmd_packet(cmdtype, cmd)
+        ack = ack_packet(cmd)
+        code = command_code(cmd)
+        if cmdtype == Header.reference:
+            ackclass = 'ack'
+        elif cmd == NULL_CMD:
+            ackclass = 'null_ack'
+        elif code in SLOW_ACK_CODES:
+            ackclass = 'slow_ack'
+        else:
+            ackclass = 'set_ack'
 
-        retry_count = 1
+        retry_count = self.policy.retries
         while True:
-            if self.reconnect:
-                self.reconnect = False
-                self.conn.reconnect()
+            yield from self._recover_steps()
 
             try:
-                self.conn.send(cmdtype.value + UNIT_ID + cmd + END)
+                start = self.last_activity = time.monotonic()
+                yield ('send', packet)
                 expect_ack = 1
-                self.conn.expect(Header.ack.value + UNIT_ID + cmd[:2] + END, timeout=acktimeout)
-
-                if sendrawdata is None:
-                    return
+                yield ('expect', ack, acktimeout or self.timeout(ackclass))
+                acked = time.monotonic()
+                self.sample(ackclass, code, acked - start)
 
-                self.conn.send(sendrawdata)
-                expect_ack = 2
-                self.conn.expect(Header.ack.value + UNIT_ID + cmd[:2] + END, timeout=20)
+                if sendrawdata is not None:
+                    yield ('send', sendrawdata)
+                    expect_ack = 2
+                    yield ('expect', ack, self.timeout('data_ack'))
+                    self.sample('data_ack', code, time.monotonic() - acked)
+                self.failures = 0
+                self.last_activity = time.monotonic()
+                return
 
             except jvc_network.Closed:
                 self.reconnect = True
                 if retry_count:
+                    if self.stats is not None:
+                        self.stats.count('retry', code)
                     print('Connection closed, retry', retry_count)
                     retry_count -= 1
                     continue
+                self.failure()
                 raise
             except jvc_network.Timeout:
-                self.reconnect = True
+                if self.policy.resync and expect_ack == 1:
+                    self.resync = True
+                else:
+                    self.reconnect = True
+                self.expired('data_ack' if expect_ack == 2 else ackclass, code)
+                self.failure()
                 raise CommandNack('Data not acknowledged' if expect_ack == 2 else
                                   'Command not acknowledged', cmdtype, cmd)
-            break
 
-    def cmd_op(self, cmd, **kwargs):
-        """Send operation command"""
-        self._cmd(Header.operation, cmd, **kwargs)
-
-    def cmd_ref(self, cmd, **kwargs):
+    def _ref_steps(self, cmd, **kwargs):
         """Send reference command and retrieve response"""
-        self._cmd(Header.reference, cmd, **kwargs)
-        data = self.conn.recv()
-        header = Header.response.value + UNIT_ID + cmd[:2]
-        if not data.startswith(header):
-            raise Error('Expected response header', header, data)
-        if not data.endswith(END):
-            raise Error('Expected END', END, data)
-        res = data[len(header):-1]
+        yield from self._cmd_steps(Header.reference, cmd, **kwargs)
+        start = time.monotonic()
+        try:
+            data = yield ('read_until', END, self.timeout('response'))
+        except jvc_network.Timeout as err:
+            self.resync = True
+            self.expired('response', command_code(cmd))
+            raise jvc_network.Timeout('Timeout waiting for response', err)
+        self.sample('response', command_code(cmd), time.monotonic() - start)
+        res = parse_response(cmd, data)
         if self.print_cmd_res:
             print('  < Response:', res)
         return res
 
-    def cmd_ref_bin(self, cmd, **kwargs):
-        """Send command and retrieve binary response"""
-        self._cmd(Header.reference, cmd, **kwargs)
+    def _ref_bin_steps(self, cmd, size=None, **kwargs):
+        """Send command and retrieve binary response of size bytes (or any size if None)"""
+        yield from self._cmd_steps(Header.reference, cmd, **kwargs)
+        start = time.monotonic()
+        timeout = self.timeout('bin_response')
         try:
-            res = self.conn.recv(timeout=10)
+            if size is None:
+                res = yield ('recv', 1024, timeout)
+            else:
+                res = yield ('read_exactly', size, timeout)
         except jvc_network.Timeout as err:
             self.reconnect = True
+            self.expired('bin_response', command_code(cmd))
             raise jvc_network.Timeout('Timeout waiting for bindata', err)
+        if size is not None:
+            self.sample('bin_response', command_code(cmd), time.monotonic() - start)
         if self.print_cmd_bin_res:
             dumpdata.dumpdata('  < Response:', '{:02x}', res)
         return res
 
+    def _pipelining_steps(self):
+        """Return True if reference commands should be pipelined"""
+        if self.pipeline is not None:
+            return self.pipeline
+        if self.pipeline_supported is None:
+            self.model = yield from self._ref_steps(MODEL_CMD)
+            self.pipeline_supported = load_pipeline_support(self.model) is not False
+        return self.pipeline_supported
+
+    def pipelining_expected(self):
+        """Return True if reference commands are expected to be pipelined, without probing
+
+        Assumes pipelining while the model has not been read yet.
+        """
+        if self.pipeline is not None:
+            return self.pipeline
+        if self.pipeline_supported is not None:
+            return self.pipeline_supported
+        return self.model is None or load_pipeline_support(self.model) is not False
+
+    def pipeline_failed(self, err):
+        """Stop pipelining and remember that the projector model does not support it"""
+        print('Pipelined commands failed, sending one command at a time', err)
+        if self.stats is not None:
+            self.stats.count('pipeline_fallback')
+        self.pipeline_supported = False
+        if self.model is not None:
+            save_pipeline_support(self.model, False)
+
+    def _pipeline_steps(self, cmds, results, window):
+        """Send reference commands ahead of their responses and return indexes not completed
+
+        Commands are sent in chunks of window commands followed by a Null
+        command, and the next chunk is sent before reading the responses of
+        the current one. The Null ack delimits the responses of each chunk. If
+        a command in a chunk was not acknowledged the responses cannot be
+        matched reliably, as many commands share the same two character ack,
+        so the commands of that chunk are returned to be sent one at a time.
+        """
+        if self.breaker_until is not None:
+            return list(range(len(cmds)))
+        yield from self._recover_steps()
+        null_packet = cmd_packet(Header.operation, NULL_CMD)
+        null_ack = ack_packet(NULL_CMD)
+        timeout = self.timeout('ack') + self.timeout('response')
+        chunks = [range(i, min(i + window, len(cmds))) for i in range(0, len(cmds), window)]
+        packets = [b''.join(cmd_packet(Header.reference, cmds[i]) for i in chunk) + null_packet
+                   for chunk in chunks]
+        incomplete = []
+        n = 0
+        try:
+            self.last_activity = time.monotonic()
+            for n, chunk in enumerate(chunks):
+                for i in ([0, 1] if n == 0 else [n + 1]):
+                    if i < len(chunks):
+                        if self.print_cmd_send:
+                            print('  > Cmd (pipelined):', Header.reference,
+                                  [cmds[j] for j in chunks[i]])
+                        yield ('send', packets[i])
+                received = []
+                while True:
+                    packet = yield ('read_until', END, timeout)
+                    if packet == null_ack:
+                        break
+                    received.append(packet)
+                if len(received) != 2 * len(chunk):
+                    incomplete.extend(chunk)
+                    continue
+                for j, i in enumerate(chunk):
+                    if received[2 * j] != ack_packet(cmds[i]):
+                        raise Error('Unexpected pipelined response', cmds[i], received)
+                    results[i] = parse_response(cmds[i], received[2 * j + 1])
+                    if self.print_cmd_res:
+                        print('  < Response:', results[i])
+        except jvc_network.Closed:
+            self.reconnect = True
+            return incomplete + [i for chunk in chunks[n:] for i in chunk]
+        except (jvc_network.Timeout, Error) as err:
+            self.reconnect = True
+            self.pipeline_failed(err)
+            return incomplete + [i for chunk in chunks[n:] for i in chunk]
+        self.failures = 0
+        self.last_activity = time.monotonic()
+        return incomplete
+
+    def _ref_many_steps(self, cmds, window=PIPELINE_WINDOW):
+        """Send reference commands and return list of responses, see cmd_ref_many"""
+        results = [None] * len(cmds)
+        # A single command gains nothing from pipelining, and the Null command
+        # that ends a pipelined chunk would double its cost
+        if len(cmds) > 1 and (yield from self._pipelining_steps()):
+            remaining = yield from self._pipeline_steps(cmds, results, window)
+        else:
+            remaining = range(len(cmds))
+        for i in remaining:
+            try:
+                results[i] = yield from self._ref_steps(cmds[i])
+            except (CommandNack, Error, jvc_network.Timeout) as err:
+                results[i] = err
+        return results
+
+class JVCConnection(ProtocolCore):
+    """JVC projector low level command processing class"""
+    def __init__(self, print_cmd_send=False, print_cmd_res=False, print_all=False,
+                 policy=None, timeouts=True, network=None, pipeline=None, **args):
+        if network is None:
+            network = jvc_network.JVCNetwork(print_all=print_all, **args)
+        super().__init__(network, print_cmd_send, print_cmd_res, print_all, policy, timeouts,
+                         pipeline)
+        self.lock = threading.RLock()
+        self.keepalive_stop = None
+        self.keepalive_thread = None
+
+    def __enter__(self):
+        self.conn.__enter__()
+        if self.timeouts is not None:
+            self.timeouts.load(self.conn.host_port)
+        if self.policy.keepalive:
+            self.keepalive_stop = threading.Event()
+            self.keepalive_thread = threading.Thread(target=self._keepalive, daemon=True)
+            self.keepalive_thread.start()
+        return self
+
+    def __exit__(self, exception, value, traceback):
+        if self.keepalive_thread is not None:
+            self.keepalive_stop.set()
+            self.keepalive_thread.join()
+            self.keepalive_thread = None
+        with self.lock:
+            self.conn.__exit__(exception, value, traceback)
+        if self.timeouts is not None:
+            self.timeouts.save()
+
+    def _run(self, steps):
+        """Perform the network operations of protocol core steps and return their result"""
+        result = error = None
+        while True:
+            try:
+                op = steps.send(result) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result = error = None
+            try:
+                if op[0] == SLEEP:
+                    time.sleep(op[1])
+                else:
+                    result = getattr(self.conn, op[0])(*op[1:])
+            except Exception as err:
+                error = err
+
+    def _keepalive(self):
+        """Send Null commands while the connection is idle"""
+        timeout = self.policy.keepalive
+        while not self.keepalive_stop.wait(timeout):
+            timeout = self.keepalive_due()
+            if timeout > 0 or not self.lock.acquire(blocking=False):
+                timeout = max(timeout, 0.1)
+                continue
+            try:
+                if self.stats is not None:
+                    self.stats.count('keepalive')
+                self._cmd(Header.operation, NULL_CMD)
+            except Exception:
+                pass
+            finally:
+                self.lock.release()
+            timeout = self.policy.keepalive
+
+    def _cmd(self, cmdtype, cmd, **kwargs):
+        """Send command and optional raw data and wait for acks"""
+        self._run(self._cmd_steps(cmdtype, cmd, **kwargs))
+
+    def cmd_op(self, cmd, **kwargs):
+        """Send operation command"""
+        with self.lock:
+            self._cmd(Header.operation, cmd, **kwargs)
+
+    def cmd_ref(self, cmd, **kwargs):
+        """Send reference command and retrieve response"""
+        with self.lock:
+            return self._run(self._ref_steps(cmd, **kwargs))
+
+    def cmd_ref_bin(self, cmd, size=None, **kwargs):
+        """Send command and retrieve binary response of size bytes (or any size if None)"""
+        with self.lock:
+            return self._run(self._ref_bin_steps(cmd, size, **kwargs))
+
+    def pipelining(self):
+        """Return True if reference commands should be pipelined"""
+        with self.lock:
+            return self._run(self._pipelining_steps())
+
+    def cmd_ref_many(self, cmds, window=PIPELINE_WINDOW):
+        """Send reference commands and return list of responses
+
+        Commands are pipelined unless the projector model is known not to
+        support it. Commands that fail have the exception in place of the
+        response.
+        """
+        with self.lock:
+            return self._run(self._ref_many_steps(cmds, window))
+
+class AsyncJVCConnection(ProtocolCore):
+    """JVC projector low level command processing class for asyncio"""
+    def __init__(self, print_cmd_send=False, print_cmd_res=False, print_all=False,
+                 policy=None, timeouts=True, network=None, pipeline=None, **args):
+        if network is None:
+            network = jvc_network.AsyncJVCNetwork(print_all=print_all, **args)
+        super().__init__(network, print_cmd_send, print_cmd_res, print_all, policy, timeouts,
+                         pipeline)
+        self.lock = asyncio.Lock()
+        self.keepalive_task = None
+
+    async def __aenter__(self):
+        await self.conn.__aenter__()
+        if self.timeouts is not None:
+            self.timeouts.load(self.conn.host_port)
+        if self.policy.keepalive:
+            self.keepalive_task = asyncio.ensure_future(self._keepalive())
+        return self
+
+    async def __aexit__(self, exception, value, traceback):
+        if self.keepalive_task is not None:
+            self.keepalive_task.cancel()
+            await asyncio.gather(self.keepalive_task, return_exceptions=True)
+            self.keepalive_task = None
+        async with self.lock:
+            await self.conn.__aexit__(exception, value, traceback)
+        if self.timeouts is not None:
+            self.timeouts.save()
+
+    async def _run(self, steps):
+        """Perform the network operations of protocol core steps and return their result"""
+        result = error = None
+        while True:
+            try:
+                op = steps.send(result) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result = error = None
+            try:
+                if op[0] == SLEEP:
+                    await asyncio.sleep(op[1])
+                else:
+                    result = await getattr(self.conn, op[0])(*op[1:])
+            except Exception as err:
+                error = err
+
+    async def _keepalive(self):
+        """Send Null commands while the connection is idle"""
+        timeout = self.policy.keepalive
+        while True:
+            await asyncio.sleep(timeout)
+            timeout = self.keepalive_due()
+            if timeout > 0 or self.lock.locked():
+                timeout = max(timeout, 0.1)
+                continue
+            async with self.lock:
+                try:
+                    if self.stats is not None:
+                        self.stats.count('keepalive')
+                    await self._cmd(Header.operation, NULL_CMD)
+                except Exception:
+                    pass
+            timeout = self.policy.keepalive
+
+    async def _cmd(self, cmdtype, cmd, **kwargs):
+        """Send command and optional raw data and wait for acks"""
+        await self._run(self._cmd_steps(cmdtype, cmd, **kwargs))
+
+    async def cmd_op(self, cmd, **kwargs):
+        """Send operation command"""
+        async with self.lock:
+            await self._cmd(Header.operation, cmd, **kwargs)
+
+    async def cmd_ref(self, cmd, **kwargs):
+        """Send reference command and retrieve response"""
+        async with self.lock:
+            return await self._run(self._ref_steps(cmd, **kwargs))
+
+    async def cmd_ref_bin(self, cmd, size=None, **kwargs):
+        """Send command and retrieve binary response of size bytes (or any size if None)"""
+        async with self.lock:
+            return await self._run(self._ref_bin_steps(cmd, size, **kwargs))
+
+    async def pipelining(self):
+        """Return True if reference commands should be pipelined"""
+        async with self.lock:
+            return await self._run(self._pipelining_steps())
+
+    async def cmd_ref_many(self, cmds, window=PIPELINE_WINDOW):
+        """Send reference commands and return list of responses, see JVCConnection"""
+        async with self.lock:
+            return await self._run(self._ref_many_steps(cmds, window))
+
 if __name__ == "__main__":
     print('test jvc command protocol class')
     try:
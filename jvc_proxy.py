@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+"""JVC projector connection sharing proxy
+
+The projector only accepts a single network connection. This proxy keeps one
+authenticated connection open to the projector and accepts any number of local
+clients speaking the same protocol (including the PJ_OK/PJREQ/PJACK handshake).
+Commands from all clients are forwarded one at a time in arrival order, and each
+ack and response is sent back to the client that sent the command.
+"""
+
+import argparse
+import asyncio
+
+import jvc_network
+import jvc_protocol
+from jvc_command import BinaryData, Command
+from jvc_protocol import CommandNack, Header, UNIT_ID, END
+
+def binary_sizes():
+    """Return dict of binary response/data size for each binary command code"""
+    sizes = dict()
+    for cmd in Command:
+        if isinstance(cmd.value, bytes):
+            continue
+        cmdcode, valtype = cmd.value
+        if issubclass(valtype, BinaryData):
+            sizes[cmdcode] = valtype.size
+    return sizes
+
+BINARY_SIZES = binary_sizes()
+
+class JVCProxy:
+    """Share a single projector connection between multiple local clients"""
+    def __init__(self, host_port=None, listen=('127.0.0.1', jvc_network.DEFAULT_PORT),
+                 print_all=False):
+        self.listen = listen
+        self.print_all = print_all
+        # Keep the connection open while idle, and resync after a nack instead of reconnecting
+        self.upstream = jvc_protocol.AsyncJVCConnection(
+            print_all=print_all, host_port=host_port, policy=jvc_protocol.SESSION_POLICY)
+        self.server = None
+        self.client_count = 0
+
+    async def __aenter__(self):
+        await self.upstream.__aenter__()
+        self.server = await asyncio.start_server(self.handle_client, *self.listen)
+        return self
+
+    async def __aexit__(self, exception, value, traceback):
+        self.server.close()
+        await self.server.wait_closed()
+        await self.upstream.__aexit__(exception, value, traceback)
+
+    async def serve_forever(self):
+        """Accept clients until cancelled"""
+        await self.server.serve_forever()
+
+    async def handle_client(self, reader, writer):
+        """Perform handshake with a local client and forward its commands"""
+        self.client_count += 1
+        client = self.client_count
+        if self.print_all:
+            print('client {}: connected'.format(client))
+        try:
+            writer.write(jvc_network.PJ_OK)
+            req = await asyncio.wait_for(reader.readexactly(len(jvc_network.PJREQ)), 5)
+            if req != jvc_network.PJREQ:
+                return
+            writer.write(jvc_network.PJACK)
+            await writer.drain()
+
+            while True:
+                packet = await reader.readuntil(END)
+                header = packet[:1]
+                if (header not in (Header.operation.value, Header.reference.value) or
+                        packet[1:3] != UNIT_ID):
+                    print('client {}: bad packet {}'.format(client, packet))
+                    continue
+                # Holding the upstream lock also keeps keep-alives out of binary uploads
+                async with self.upstream.lock:
+                    await self.forward(Header(header), packet[3:-1], reader, writer)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            if self.print_all:
+                print('client {}: disconnected'.format(client))
+            writer.close()
+
+    async def forward(self, cmdtype, cmd, reader, writer):
+        """Forward a single command to the projector and return acks and response to client
+
+        Must be called with the upstream lock held.
+        """
+        upstream = self.upstream
+        size = BINARY_SIZES.get(cmd)
+        ack = jvc_protocol.ack_packet(cmd)
+        try:
+            if cmdtype == Header.reference:
+                if size is None:
+                    response = await upstream._run(upstream._ref_steps(cmd))
+                    response = Header.response.value + UNIT_ID + cmd[:2] + response + END
+                else:
+                    response = await upstream._run(upstream._ref_bin_steps(cmd, size))
+                writer.write(ack + response)
+                await writer.drain()
+                return
+
+            await upstream._cmd(cmdtype, cmd)
+            writer.write(ack)
+            await writer.drain()
+            if size is None:
+                return
+
+            try:
+                data = await asyncio.wait_for(reader.readexactly(size),
+                                              upstream.timeout('data_ack'))
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                # The projector is still waiting for the data and would take the
+                # next command as part of it
+                upstream.reconnect = True
+                raise
+            try:
+                await upstream.conn.send(data)
+                await upstream.conn.expect(ack, timeout=upstream.timeout('data_ack'))
+            except (jvc_network.Timeout, jvc_network.Closed, jvc_network.Error):
+                upstream.reconnect = True
+                raise
+            writer.write(ack)
+            await writer.drain()
+        except CommandNack as err:
+            # Not acked by the projector, let the client time out as it would without the proxy
+            print('Nack', err)
+        except jvc_protocol.Error as err:
+            upstream.resync = True
+            print('Projector error', err)
+        except (jvc_network.Timeout, jvc_network.Closed, jvc_network.Error) as err:
+            # The upstream connection has already been marked for resync or reconnect
+            print('Projector error', err)
+
+async def run(host_port, listen, print_all):
+    """Run proxy until interrupted"""
+    async with JVCProxy(host_port=host_port, listen=listen, print_all=print_all) as proxy:
+        print('Proxy for {}:{} listening on {}:{}'.format(
+            *proxy.upstream.conn.host_port, *listen))
+        await proxy.serve_forever()
+
+def main():
+    """JVC projector connection sharing proxy"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('host', nargs='?',
+                        help='projector hostname or ip address (default from {})'.format(
+                            jvc_network.conf_file))
+    parser.add_argument('--port', type=int, default=jvc_network.DEFAULT_PORT,
+                        help='projector port')
+    parser.add_argument('--listen', default='127.0.0.1', help='local address to listen on')
+    parser.add_argument('--listen-port', type=int, default=jvc_network.DEFAULT_PORT,
+                        help='local port to listen on')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print all traffic')
+    args = parser.parse_args()
+
+    host_port = (args.host, args.port) if args.host else None
+    try:
+        asyncio.run(run(host_port, (args.listen, args.listen_port), args.verbose))
+    except KeyboardInterrupt:
+        pass
+    except jvc_network.Error as err:
+        print('Error', err)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+"""JVC projector command scheduler
+
+A Scheduler owns a JVCCommand and runs requests from any number of threads on
+a single worker thread, highest priority first. Each request is a complete
+JVCCommand call, so a binary upload is never interleaved with other commands.
+Requests return futures, and a request whose deadline passes while it is
+queued is dropped instead of delaying the requests behind it.
+"""
+
+import argparse
+import concurrent.futures
+import itertools
+import queue
+import threading
+import time
+
+import jvc_network
+from jvc_command import (
+    JVCCommand, Command, CommandNack, CommandUnsupported, WaitSchedule, wait_predicate,
+    get_request)
+from jvc_protocol import SESSION_POLICY
+
+# Request priorities, lower runs first
+INTERACTIVE = 0
+NORMAL = 1
+BACKGROUND = 2
+
+# Priority names used as statistics codes
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', NORMAL: 'normal', BACKGROUND: 'background'}
+
+class Expired(CommandNack):
+    """Request not sent as its deadline passed while it was queued"""
+    pass
+
+class Request:
+    """Queued call and its future"""
+    def __init__(self, func, args, kwargs, priority, deadline):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.queued = time.monotonic()
+        self.deadline = None if deadline is None else self.queued + deadline
+        self.future = concurrent.futures.Future()
+
+class Scheduler:
+    """Run JVCCommand calls from multiple threads in priority order on one connection"""
+    def __init__(self, jvc):
+        self.jvc = jvc
+        self.stats = jvc.conn.stats
+        self.queue = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exception, value, traceback):
+        self.stop()
+
+    def start(self):
+        """Start worker thread"""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Run requests already queued and stop worker thread"""
+        if self.thread is None:
+            return
+        self.queue.put((BACKGROUND + 1, next(self.sequence), None))
+        self.thread.join()
+        self.thread = None
+
+    def submit(self, func, args=(), kwargs=None, priority=NORMAL, deadline=None):
+        """Queue call and return a Future with its result
+
+        func is the name of a JVCCommand method, or a function called with
+        the JVCCommand as first argument to run several commands without
+        other requests in between. Requests with the same priority run in the
+        order they were submitted. If deadline seconds pass before the request
+        starts, the Future raises Expired.
+        """
+        if isinstance(func, str):
+            func = getattr(JVCCommand, func)
+        request = Request(func, args, kwargs or {}, priority, deadline)
+        if self.stats is not None:
+            self.stats.count('requests', PRIORITY_NAMES.get(priority))
+        self.queue.put((priority, next(self.sequence), request))
+        return request.future
+
+    def run(self):
+        """Run queued requests until stopped"""
+        while True:
+            _, _, request = self.queue.get()
+            if request is None:
+                return
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            start = time.monotonic()
+            if self.stats is not None:
+                self.stats.record('queue_wait', PRIORITY_NAMES.get(request.priority),
+                                  start - request.queued)
+            if request.deadline is not None and start > request.deadline:
+                if self.stats is not None:
+                    self.stats.count('expired', PRIORITY_NAMES.get(request.priority))
+                request.future.set_exception(Expired(
+                    'Request expired after {:.3f} seconds in queue'.format(
+                        start - request.queued)))
+                continue
+            try:
+                result = request.func(self.jvc, *request.args, **request.kwargs)
+            except BaseException as err:
+                request.future.set_exception(err)
+            else:
+                request.future.set_result(result)
+
+    def client(self, priority=NORMAL, deadline=None):
+        """Return JVCCommand like object that sends requests with priority and deadline"""
+        return SchedulerClient(self, priority, deadline)
+
+class SchedulerClient:
+    """JVCCommand interface that runs each call through a Scheduler and waits for it"""
+    def __init__(self, scheduler, priority=NORMAL, deadline=None):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.deadline = deadline
+        # For projector address and statistics, commands must go through the scheduler
+        self.conn = scheduler.jvc.conn
+
+    def call(self, func, *args, **kwargs):
+        """Run JVCCommand method or function through the scheduler and return result"""
+        return self.scheduler.submit(func, args, kwargs, self.priority, self.deadline).result()
+
+    def cache_clear(self):
+        """Forget cached values, call after the user may have changed settings"""
+        return self.call('cache_clear')
+
+    def get(self, cmd):
+        """Send reference command and convert response, or return cached value"""
+        return self.call('get', cmd)
+
+    def get_many(self, cmds, cached=True):
+        """Send reference commands and return dict of converted responses, see JVCCommand"""
+        return self.call('get_many', cmds, cached=cached)
+
+    def set(self, cmd, val, verify=True):
+        """Send operation command"""
+        return self.call('set', cmd, val, verify=verify)
+
+    def wait_for(self, cmd, predicate, deadline=None, then=()):
+        """Poll cmd until its value matches predicate, see JVCCommand
+
+        Each poll is a separate request, so other requests run while waiting.
+        """
+        get_request(cmd)
+        test = wait_predicate(predicate)
+        schedule = WaitSchedule(cmd, deadline)
+        while True:
+            try:
+                value = self.get_many([cmd], cached=False)[cmd]
+            except Expired as err:
+                value = err
+            if isinstance(value, CommandUnsupported) or (
+                    isinstance(value, Exception) and
+                    not isinstance(value, (CommandNack, jvc_network.Timeout))):
+                raise value
+            if not isinstance(value, Exception) and test(value):
+                break
+            time.sleep(schedule.next_delay(value))
+        for setcmd, val in then:
+            self.set(setcmd, val)
+        return value
+
+    # Only uses wait_for and set
+    power_on = JVCCommand.power_on
+
+def main():
+    """Read all settings at interactive priority while polling in the background"""
+    import jvc_watch
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--host', help='projector hostname or ip address (default from {})'.format(
+        jvc_network.conf_file))
+    parser.add_argument('--port', type=int, default=jvc_network.DEFAULT_PORT, help='projector port')
+    args = parser.parse_args()
+
+    host_port = (args.host, args.port) if args.host else None
+    try:
+        with JVCCommand(host_port=host_port, policy=SESSION_POLICY) as jvc, \
+                Scheduler(jvc) as scheduler:
+            background = scheduler.client(BACKGROUND, deadline=0.5)
+            interactive = scheduler.client(INTERACTIVE)
+            with jvc_watch.Watcher(background, min_interval=0.1) as watcher:
+                watcher.subscribe(jvc_watch.DEFAULT_COMMANDS, jvc_watch.print_change)
+                for cmd in Command:
+                    try:
+                        get_request(cmd)
+                    except (TypeError, NotImplementedError):
+                        continue
+                    start = time.perf_counter()
+                    try:
+                        value = interactive.get(cmd)
+                    except CommandNack as err:
+                        value = err.args[0]
+                    print('{:7.3f}s {}: {!s}'.format(time.perf_counter() - start, cmd.name,
+                                                    value)[:100])
+    except CommandNack as err:
+        print('Nack', err)
+    except jvc_network.Error as err:
+        print('Error', err)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+"""JVC projector settings snapshot, diff and restore
+
+A snapshot holds the raw response data of every setting that can be read,
+including the gamma tables of the selected custom gamma table and the panel
+alignment data. Snapshots are saved as gzip compressed json.
+
+Picture settings and gamma tables are only read for the active picture mode
+and gamma table slot. Other picture modes and custom gamma slots are not
+saved or restored.
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import time
+
+import dumpdata
+import jvc_network
+from jvc_command import (
+    JVCCommand, Command, CommandNack, BinaryData, ReadOnly, NoVerify,
+    CACHE_DEPENDENCIES, get_request)
+from jvc_protocol import SESSION_POLICY
+
+FORMAT = 'jvc-snapshot'
+VERSION = 1
+
+# Gamma data is read with the Gamma* commands and written with the PMGamma* commands
+GAMMA_WRITE_COMMANDS = {
+    Command.GammaRed: Command.PMGammaRed,
+    Command.GammaGreen: Command.PMGammaGreen,
+    Command.GammaBlue: Command.PMGammaBlue,
+    }
+
+# Operational state that is saved but not restored
+NO_RESTORE_COMMANDS = {Command.Power, Command.Input}
+
+# Settings that change other settings are restored first, in this order
+RESTORE_FIRST = [Command.PictureMode, Command.GammaTable, Command.GammaCorrection]
+
+def snapshot_commands():
+    """Return list of commands saved in a snapshot"""
+    commands = []
+    for cmd in Command:
+        if cmd in GAMMA_WRITE_COMMANDS.values():
+            continue
+        try:
+            get_request(cmd)
+        except (TypeError, NotImplementedError):
+            continue
+        commands.append(cmd)
+    return commands
+
+def restore_command(cmd):
+    """Return command used to restore value read with cmd, or None if it is not restored"""
+    if cmd in NO_RESTORE_COMMANDS:
+        return None
+    cmd = GAMMA_WRITE_COMMANDS.get(cmd, cmd)
+    valtype = cmd.value[1]
+    if issubclass(valtype, (ReadOnly, NoVerify)):
+        return None
+    return cmd
+
+def restore_order(cmds):
+    """Return cmds sorted so settings are restored before settings that depend on them"""
+    first = {cmd: i for i, cmd in enumerate(RESTORE_FIRST)}
+    return sorted(cmds, key=lambda cmd: first.get(cmd, len(first)))
+
+def read_values(jvc, cmds):
+    """Return dict of raw response data for the commands that could be read"""
+    values = dict()
+    cmds = [cmd for cmd in cmds if jvc.supported(cmd)]
+    text = [cmd for cmd in cmds if not issubclass(cmd.value[1], BinaryData)]
+    for cmd, res in zip(text, jvc.conn.cmd_ref_many([cmd.value[0] for cmd in text])):
+        if not isinstance(res, Exception):
+            values[cmd] = res
+    for cmd in cmds:
+        valtype = cmd.value[1]
+        if not issubclass(valtype, BinaryData):
+            continue
+        try:
+            values[cmd] = jvc.conn.cmd_ref_bin(cmd.value[0], size=valtype.size)
+        except (CommandNack, jvc_network.Timeout):
+            pass
+    return values
+
+def display_value(cmd, data):
+    """Return printable value of raw response data"""
+    valtype = cmd.value[1]
+    try:
+        value = valtype(data)
+    except Exception:
+        return repr(data)
+    if isinstance(value, list):
+        return '[{}, ... {}]'.format(', '.join(str(v) for v in value[:4]), value[-1])
+    return getattr(value, 'name', str(value))
+
+class Snapshot:
+    """Raw values of projector settings"""
+    def __init__(self, values=None, created=None, host=None):
+        self.values = values or dict()
+        self.created = created if created is not None else time.time()
+        self.host = host
+
+    @classmethod
+    def take(cls, jvc):
+        """Read all settings from projector"""
+        return cls(read_values(jvc, snapshot_commands()), host=jvc.conn.conn.host_port[0])
+
+    def save(self, filename):
+        """Save snapshot to gzip compressed json file"""
+        values = dict()
+        for cmd, data in self.values.items():
+            if issubclass(cmd.value[1], BinaryData):
+                values[cmd.name] = base64.b64encode(data).decode('ascii')
+            else:
+                values[cmd.name] = data.decode('latin-1')
+        conf = {'format': FORMAT, 'version': VERSION, 'created': self.created,
+                'host': self.host, 'values': values}
+        with gzip.open(filename, 'wt') as file:
+            json.dump(conf, file, indent=0)
+
+    @classmethod
+    def load(cls, filename):
+        """Load snapshot saved with save"""
+        with gzip.open(filename, 'rt') as file:
+            conf = json.load(file)
+        if conf.get('format') != FORMAT:
+            raise ValueError('{} is not a projector snapshot'.format(filename))
+        if conf.get('version', 0) > VERSION:
+            raise ValueError('{} has unsupported version {}'.format(filename, conf['version']))
+        values = dict()
+        for name, data in conf['values'].items():
+            try:
+                cmd = Command[name]
+            except KeyError:
+                print('Ignore unknown command', name)
+                continue
+            if issubclass(cmd.value[1], BinaryData):
+                values[cmd] = base64.b64decode(data)
+            else:
+                values[cmd] = data.encode('latin-1')
+        return cls(values, conf.get('created'), conf.get('host'))
+
+def diff(old, new):
+    """Return list of (command, old data, new data) for values that differ
+
+    Data is None for values missing from one of the snapshots.
+    """
+    return [(cmd, old.values.get(cmd), new.values.get(cmd))
+            for cmd in Command
+            if cmd in old.values or cmd in new.values
+            if old.values.get(cmd) != new.values.get(cmd)]
+
+def print_diff(changes):
+    """Print list returned by diff"""
+    if not changes:
+        print('No differences')
+    for cmd, old, new in changes:
+        print('{}: {} -> {}'.format(
+            cmd.name,
+            '-' if old is None else display_value(cmd, old),
+            '-' if new is None else display_value(cmd, new)))
+        if old is not None and new is not None and issubclass(cmd.value[1], BinaryData):
+            changed = [i for i, (a, b) in enumerate(zip(cmd.value[1](old), cmd.value[1](new)))
+                       if a != b]
+            dumpdata.dumpdata('  {} entries differ:'.format(len(changed)), '{:4}', changed[:16])
+
+def set_raw(jvc, cmd, data, verify=True):
+    """Set cmd to raw response data its type cannot decode, like values of newer firmware"""
+    if jvc.cache is not None:
+        jvc.cache.invalidate(cmd)
+    try:
+        jvc.conn.cmd_op(cmd.value[0] + data)
+    except CommandNack as err:
+        raise CommandNack('Set: ' + err.args[0], cmd.name, data)
+    if verify:
+        verify_data = jvc.conn.cmd_ref(cmd.value[0])
+        if verify_data != data:
+            raise CommandNack('Verify error: ' + cmd.name, data, verify_data)
+
+def restore(jvc, snapshot, verify=True, dry_run=False):
+    """Set projector settings that differ from snapshot and return list of commands set
+
+    Settings that change other settings, like PictureMode, are set first and
+    the settings that depend on them are read again after they change. A
+    dependent setting that cannot be read again is treated as unknown and set.
+    """
+    target = {cmd: data for cmd, data in snapshot.values.items() if restore_command(cmd)}
+    live = read_values(jvc, list(target))
+    ordered = restore_order(target)
+    changed = []
+    for i, cmd in enumerate(ordered):
+        if live.get(cmd) == target[cmd]:
+            continue
+        setcmd = restore_command(cmd)
+        print('Set {}: {} -> {}'.format(
+            setcmd.name, '-' if cmd not in live else display_value(cmd, live[cmd]),
+            display_value(cmd, target[cmd])))
+        changed.append(setcmd)
+        if dry_run:
+            continue
+        try:
+            try:
+                value = setcmd.value[1](target[cmd])
+            except ValueError:
+                set_raw(jvc, setcmd, target[cmd], verify=verify)
+            else:
+                jvc.set(setcmd, value, verify=verify)
+        except (CommandNack, jvc_network.Timeout) as err:
+            print('Failed to set {}: {!s}'.format(setcmd.name, err))
+            continue
+        dependencies = CACHE_DEPENDENCIES.get(cmd, set())
+        reread = [dep for dep in ordered[i + 1:] if dep in dependencies]
+        if reread:
+            values = read_values(jvc, reread)
+            for dep in reread:
+                if dep in values:
+                    live[dep] = values[dep]
+                else:
+                    live.pop(dep, None)
+    return changed
+
+def main():
+    """Save, compare or restore projector settings"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', help='projector hostname or ip address (default from {})'.format(
+        jvc_network.conf_file))
+    parser.add_argument('--port', type=int, default=jvc_network.DEFAULT_PORT, help='projector port')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    parser_save = subparsers.add_parser('save', help='save projector settings to file')
+    parser_save.add_argument('file')
+    parser_diff = subparsers.add_parser(
+        'diff', help='compare snapshot with another snapshot or with the projector')
+    parser_diff.add_argument('file')
+    parser_diff.add_argument('file2', nargs='?')
+    parser_restore = subparsers.add_parser(
+        'restore', help='set projector settings that differ from snapshot')
+    parser_restore.add_argument('file')
+    parser_restore.add_argument('--dry-run', action='store_true',
+                                help='only show settings that would be set')
+    parser_restore.add_argument('--no-verify', action='store_true',
+                                help='do not read back settings after setting them')
+    args = parser.parse_args()
+
+    if args.action == 'diff' and args.file2:
+        print_diff(diff(Snapshot.load(args.file), Snapshot.load(args.file2)))
+        return
+
+    host_port = (args.host, args.port) if args.host else None
+    try:
+        with JVCCommand(host_port=host_port, capabilities=True, policy=SESSION_POLICY) as jvc:
+            start = time.perf_counter()
+            if args.action == 'save':
+                snapshot = Snapshot.take(jvc)
+                snapshot.save(args.file)
+                print('Saved {} settings to {}'.format(len(snapshot.values), args.file))
+            elif args.action == 'diff':
+                print_diff(diff(Snapshot.load(args.file), Snapshot.take(jvc)))
+            else:
+                snapshot = Snapshot.load(args.file)
+                model = jvc.conn.cmd_ref(Command.Model.value[0])
+                if Command.Model in snapshot.values and snapshot.values[Command.Model] != model:
+                    raise ValueError('Snapshot is from a different projector model')
+                changed = restore(jvc, snapshot, verify=not args.no_verify,
+                                  dry_run=args.dry_run)
+                print('{} {} settings'.format('Would set' if args.dry_run else 'Set',
+                                              len(changed)))
+            print('Done in {:.3f}s'.format(time.perf_counter() - start))
+    except CommandNack as err:
+        print('Nack', err)
+    except jvc_network.Error as err:
+        print('Error', err)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""JVC projector connection latency statistics"""
+
+import atexit
+import math
+
+BUCKETS_PER_OCTAVE = 4
+
+global_stats = None
+
+def code_name(code):
+    """Return printable command code, or name like a request priority"""
+    if code is None:
+        return '-'
+    if isinstance(code, str):
+        return code
+    return repr(code)[2:-1]
+
+class Histogram:
+    """Log scale latency histogram"""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.buckets = dict()
+
+    def add(self, seconds):
+        """Add a single sample"""
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        mantissa, exponent = math.frexp(seconds)
+        bucket = exponent * BUCKETS_PER_OCTAVE + int((mantissa - 0.5) * 2 * BUCKETS_PER_OCTAVE)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, percent):
+        """Return upper bound of bucket containing percentile"""
+        if not self.count:
+            return None
+        remaining = self.count * percent / 100
+        for bucket in sorted(self.buckets):
+            remaining -= self.buckets[bucket]
+            if remaining <= 0:
+                exponent, step = divmod(bucket, BUCKETS_PER_OCTAVE)
+                return min(self.max, math.ldexp(0.5 + (step + 1) / (2 * BUCKETS_PER_OCTAVE),
+                                                exponent))
+        return self.max
+
+    def summary(self):
+        """Return dict with count, mean, min, max and percentiles"""
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            }
+
+class Stats:
+    """Latency histograms and event counters per phase and command code
+
+    Codes are bytes command codes, or str names for events that are not tied
+    to a command, like scheduler requests by priority.
+    """
+    def __init__(self, dump_at_exit=False):
+        self.histograms = dict()
+        self.counters = dict()
+        if dump_at_exit:
+            atexit.register(self.dump)
+
+    def record(self, phase, code, seconds):
+        """Record duration of phase for command code"""
+        key = (phase, code)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.add(seconds)
+
+    def count(self, event, code=None):
+        """Count event for command code"""
+        key = (event, code)
+        self.counters[key] = self.counters.get(key, 0) + 1
+
+    def clear(self):
+        """Remove all samples and counts"""
+        self.histograms.clear()
+        self.counters.clear()
+
+    def summary(self):
+        """Return nested dicts of histogram summaries and counters by phase/event and code"""
+        phases = dict()
+        for (phase, code), histogram in self.histograms.items():
+            phases.setdefault(phase, dict())[code_name(code)] = histogram.summary()
+        events = dict()
+        for (event, code), count in self.counters.items():
+            events.setdefault(event, dict())[code_name(code)] = count
+        return {'phases': phases, 'events': events}
+
+    def dump(self):
+        """Print summary"""
+        if not self.histograms and not self.counters:
+            return
+        print('{:<12} {:<11} {:>6} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+            'phase', 'code', 'count', 'mean ms', 'min ms', 'p50 ms', 'p99 ms', 'max ms'))
+        for (phase, code), histogram in sorted(self.histograms.items(),
+                                               key=lambda item: (item[0][0], code_name(item[0][1]))):
+            summary = histogram.summary()
+            print('{:<12} {:<11} {:>6} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}'.format(
+                phase, code_name(code), summary['count'],
+                *(summary[key] * 1000 for key in ('mean', 'min', 'p50', 'p99', 'max'))))
+        for (event, code), count in sorted(self.counters.items(),
+                                           key=lambda item: (item[0][0], code_name(item[0][1]))):
+            print('{:<12} {:<11} {:>6}'.format(event, code_name(code), count))
+
+def enable(dump_at_exit=False):
+    """Enable statistics for all new connections and return Stats object"""
+    global global_stats
+    if global_stats is None:
+        global_stats = Stats(dump_at_exit=dump_at_exit)
+    return global_stats
+
+def disable():
+    """Disable statistics for new connections"""
+    global global_stats
+    global_stats = None
+
+def main():
+    """Histogram test"""
+    stats = Stats()
+    for i in range(1, 1001):
+        stats.record('ack', b'PMPM', i / 100000)
+    stats.count('nack', b'PMU1')
+    stats.dump()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""Adaptive command timeouts derived from measured round trip times"""
+
+import json
+
+conf_file = 'jvc_timeouts.conf'
+
+# Timeout floor and ceiling in seconds for each command class. The ceiling is
+# used until enough round trip times have been measured.
+TIMEOUT_LIMITS = {
+    'ack': (0.25, 1.0),          # Reference command ack
+    'set_ack': (1.0, 5.0),       # Operation command ack
+    'slow_ack': (5.0, 10.0),     # Operation command ack that waits for the picture to settle
+    'null_ack': (1.0, 5.0),      # Null command ack, used as keep-alive
+    'response': (0.25, 5.0),     # Reference command response after ack
+    'bin_response': (1.0, 10.0), # Binary reference command response after ack
+    'data_ack': (2.0, 20.0),     # Binary data ack
+    }
+
+def default_timeout(cmdclass):
+    """Return fixed timeout for command class"""
+    return TIMEOUT_LIMITS[cmdclass][1]
+
+class RTTEstimator:
+    """Smoothed round trip time and variance as used for the TCP retransmission timeout"""
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(self, srtt=None, rttvar=None, samples=0):
+        self.srtt = srtt
+        self.rttvar = rttvar
+        self.samples = samples
+        self.backoff = 1
+
+    def sample(self, rtt):
+        """Add measured round trip time"""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.samples += 1
+        self.backoff = 1
+
+    def expired(self):
+        """Double timeout after a timeout until the next successful sample"""
+        self.backoff *= 2
+
+    def timeout(self, floor, ceiling, min_samples):
+        """Return timeout limited by floor and ceiling"""
+        if self.samples < min_samples:
+            return ceiling
+        timeout = (self.srtt + self.K * self.rttvar) * self.backoff
+        return max(floor, min(ceiling, timeout))
+
+class AdaptiveTimeouts:
+    """Round trip time estimates and timeouts per command class for one projector"""
+    def __init__(self, limits=None, min_samples=5, persist=True):
+        self.limits = dict(TIMEOUT_LIMITS, **(limits or {}))
+        self.min_samples = min_samples
+        self.persist = persist
+        self.key = None
+        self.estimators = {cmdclass: RTTEstimator() for cmdclass in self.limits}
+
+    def timeout(self, cmdclass):
+        """Return current timeout for command class"""
+        floor, ceiling = self.limits[cmdclass]
+        return self.estimators[cmdclass].timeout(floor, ceiling, self.min_samples)
+
+    def sample(self, cmdclass, seconds):
+        """Add measured time for command class"""
+        self.estimators[cmdclass].sample(seconds)
+
+    def expired(self, cmdclass):
+        """Report that a timeout for command class expired"""
+        self.estimators[cmdclass].expired()
+
+    def load(self, host_port):
+        """Load saved estimates for projector"""
+        self.key = '{}:{}'.format(*host_port)
+        if not self.persist:
+            return
+        try:
+            with open(conf_file, 'r') as f:
+                saved = json.load(f).get(self.key, {})
+        except Exception:
+            return
+        for cmdclass, (srtt, rttvar, samples) in saved.items():
+            if cmdclass in self.estimators:
+                self.estimators[cmdclass] = RTTEstimator(srtt, rttvar, samples)
+
+    def save(self):
+        """Save estimates for projector"""
+        if not self.persist or self.key is None:
+            return
+        try:
+            with open(conf_file, 'r') as f:
+                conf = json.load(f)
+        except Exception:
+            conf = dict()
+        conf[self.key] = {cmdclass: (est.srtt, est.rttvar, est.samples)
+                          for cmdclass, est in self.estimators.items() if est.samples}
+        with open(conf_file, 'w') as f:
+            json.dump(conf, f, indent=2)
+
+    def summary(self):
+        """Return dict of srtt, rttvar and timeout per command class"""
+        return {cmdclass: {'srtt': est.srtt, 'rttvar': est.rttvar, 'samples': est.samples,
+                           'timeout': self.timeout(cmdclass)}
+                for cmdclass, est in self.estimators.items()}
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+"""JVC projector state watcher
+
+A Watcher polls the commands of all its subscriptions together, reading the
+power state and then the other commands in one pipelined read, and calls the
+subscribers of each command whose value changed. Polling is fast while the projector is changing state, like
+warming up or cooling down, and slows down while nothing changes.
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+
+import jvc_network
+from jvc_command import JVCCommand, Command, CommandNack, PowerState, get_request
+from jvc_scheduler import Expired
+from jvc_protocol import SESSION_POLICY
+
+# Commands watched by default
+DEFAULT_COMMANDS = [Command.Power, Command.Input, Command.InfoSource, Command.InfoDeepColor,
+                    Command.InfoColorSpace]
+
+# Values that are expected to change soon
+TRANSITION_VALUES = {PowerState.Starting, PowerState.Cooling}
+
+# Commands the projector answers when the lamp is not on
+STANDBY_COMMANDS = {Command.Power, Command.Model}
+
+class Subscription:
+    """Commands and callback of a Watcher subscriber"""
+    def __init__(self, watcher, cmds, callback):
+        self.watcher = watcher
+        self.cmds = list(cmds)
+        self.callback = callback
+
+    def cancel(self):
+        """Stop calling callback"""
+        self.watcher.unsubscribe(self)
+
+class Watcher:
+    """Poll projector state and call subscribers when values change
+
+    Values that cannot be read, for instance most settings while the
+    projector is in standby, are reported as None. Callbacks are called as
+    callback(cmd, old, new) from the thread that polls.
+    """
+    def __init__(self, jvc, min_interval=0.5, max_interval=5.0, backoff=1.5):
+        self.jvc = jvc
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.lock = threading.Lock()
+        self.subscriptions = []
+        self.values = dict()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exception, value, traceback):
+        self.stop()
+
+    def commands(self):
+        """Return list of commands polled for all subscribers"""
+        with self.lock:
+            return list(dict.fromkeys(cmd for sub in self.subscriptions for cmd in sub.cmds))
+
+    def subscribe(self, cmds, callback):
+        """Call callback(cmd, old, new) when the value of any of cmds changes
+
+        Values already known are reported to the new subscriber right away,
+        with None as old value.
+        """
+        for cmd in cmds:
+            if get_request(cmd).size is not None:
+                raise TypeError('{} is binary data, it cannot be watched'.format(cmd.name))
+        sub = Subscription(self, cmds, callback)
+        with self.lock:
+            self.subscriptions.append(sub)
+            known = [(cmd, self.values[cmd]) for cmd in sub.cmds if cmd in self.values]
+        for cmd, value in known:
+            self.dispatch(sub, cmd, None, value)
+        if len(known) < len(sub.cmds):
+            self.interval = self.min_interval
+            self.wakeup.set()
+        return sub
+
+    def unsubscribe(self, sub):
+        """Remove subscription"""
+        with self.lock:
+            if sub in self.subscriptions:
+                self.subscriptions.remove(sub)
+
+    def dispatch(self, sub, cmd, old, new):
+        """Call subscriber, a failing callback does not stop the watcher"""
+        try:
+            sub.callback(cmd, old, new)
+        except Exception as err:
+            print('Watch callback for {} failed: {!r}'.format(cmd.name, err))
+
+    def poll(self):
+        """Read all watched commands once, call subscribers and return list of changes"""
+        cmds = self.commands()
+        if not cmds:
+            return []
+        values = dict.fromkeys(cmds)
+        read = cmds
+        if not STANDBY_COMMANDS.issuperset(cmds):
+            # Other commands are not acknowledged in standby, read power first
+            # and skip them instead of waiting for a timeout each
+            power = self.jvc.get_many([Command.Power], cached=False)
+            values[Command.Power] = power[Command.Power]
+            read = [cmd for cmd in cmds if cmd != Command.Power]
+            if power[Command.Power] != PowerState.LampOn:
+                read = [cmd for cmd in read if cmd in STANDBY_COMMANDS]
+        values.update(self.jvc.get_many(read, cached=False))
+        changes = []
+        with self.lock:
+            for cmd, value in values.items():
+                if isinstance(value, Exception):
+                    value = None
+                if cmd not in self.values or self.values[cmd] != value:
+                    changes.append((cmd, self.values.get(cmd), value))
+                    self.values[cmd] = value
+            subscriptions = list(self.subscriptions)
+        for cmd, old, new in changes:
+            for sub in subscriptions:
+                if cmd in sub.cmds:
+                    self.dispatch(sub, cmd, old, new)
+        if changes or TRANSITION_VALUES.intersection(values.values()):
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        return changes
+
+    def run(self):
+        """Poll until stop is called"""
+        while not self.stopping:
+            try:
+                self.poll()
+            except Expired:
+                # Polling through a busy Scheduler, try again next interval
+                pass
+            except (CommandNack, jvc_network.Error, jvc_network.Closed) as err:
+                print('Watch poll failed:', err)
+                self.interval = self.max_interval
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def start(self):
+        """Start polling in a background thread"""
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop background polling"""
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    async def changes(self, cmds):
+        """Asynchronously iterate over (cmd, old, new) changes of cmds
+
+        The watcher must be running, use async for ... in watcher.changes(cmds).
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        sub = self.subscribe(cmds, lambda *change: loop.call_soon_threadsafe(
+            queue.put_nowait, change))
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            sub.cancel()
+
+def print_change(cmd, old, new):
+    """Print changed value"""
+    print('{} {}: {} -> {}'.format(
+        time.strftime('%H:%M:%S'), cmd.name,
+        '-' if old is None else getattr(old, 'name', old),
+        '-' if new is None else getattr(new, 'name', new)))
+
+def main():
+    """Print projector state changes"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', help='projector hostname or ip address (default from {})'.format(
+        jvc_network.conf_file))
+    parser.add_argument('--port', type=int, default=jvc_network.DEFAULT_PORT, help='projector port')
+    parser.add_argument('--min-interval', type=float, default=0.5,
+                        help='seconds between polls while state is changing')
+    parser.add_argument('--max-interval', type=float, default=5.0,
+                        help='seconds between polls while state is stable')
+    parser.add_argument('commands', nargs='*', help='command names to watch (default {})'.format(
+        ', '.join(cmd.name for cmd in DEFAULT_COMMANDS)))
+    args = parser.parse_args()
+    cmds = [Command[name] for name in args.commands] or DEFAULT_COMMANDS
+
+    host_port = (args.host, args.port) if args.host else None
+    try:
+        with JVCCommand(host_port=host_port, policy=SESSION_POLICY) as jvc:
+            with Watcher(jvc, args.min_interval, args.max_interval) as watcher:
+                watcher.subscribe(cmds, print_change)
+                input('Watching, press enter to stop\n')
+    except CommandNack as err:
+        print('Nack', err)
+    except jvc_network.Error as err:
+        print('Error', err)
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@
 
 """JVC projector tool menu"""
 
+import argparse
 import math
 import re
 import sys
@@ -10,11 +11,15 @@ import traceback
 from distutils.util import strtobool
 
 import eotf
+import jvc_gamma_fit
+import jvc_plan
+import jvc_stats
 import plot
-from jvc_gamma import GammaCurve, Highlight
+from jvc_gamma import GammaCurve, Highlight, WRITE_CHANGES
+from jvc_protocol import SESSION_POLICY
 from jvc_command import(
     JVCCommand, CommandNack, Command, HDMIInputLevel, PictureMode, PowerState, RemoteCode,
-    GammaTable, GammaCorrection)
+    GammaTable, GammaCorrection, POWER_DEADLINE)
 
 DEBUG_MENU = False
 
@@ -265,6 +270,13 @@ class Menu():
             else:
                 print('ERROR: not a valid VCGT input file\n')
 
+    def fit_raw_table(self, _):
+        """Fit gamma curve parameters to raw table"""
+        result = jvc_gamma_fit.fit_table(self.gamma.table, self.gamma)
+        print(result.summary())
+        if strtobool(input('Use fitted parameters (y/n)? ')):
+            self.gamma.conf_load(result.gamma.conf_save(generated=False))
+
     def load(self, basename):
         """Load gamma curve from file"""
         self.gamma.file_load(basename)
@@ -295,7 +307,7 @@ class Menu():
     def setup_hdr(self, _):
         """HDR setup helper"""
         try:
-            with JVCCommand() as jvc:
+            with JVCCommand(cache=True, policy=SESSION_POLICY) as jvc:
                 try:
                     model = jvc.get(Command.Model)
                     print('Found projector model:', model.name)
@@ -303,25 +315,27 @@ class Menu():
                     if not strtobool(input('Unknown projector model.\n'
                                            'Ignore and continue (y/n)? ')):
                         raise
-                while True:
-                    power_state = jvc.get(Command.Power)
-                    if power_state != PowerState.LampOn:
-                        print('Make sure projector is powered on and ready. Current state is:',
-                              power_state.name)
-                        res = input('Press enter to retry '
-                                    '(or enter "on" to send power on command): ')
-                        if res == 'on':
-                            if jvc.get(Command.Power) == PowerState.StandBy:
-                                jvc.set(Command.Power, PowerState.LampOn)
-                            else:
-                                print('Not in StandBy, try again')
-                        continue
-                    input_level = jvc.get(Command.HDMIInputLevel)
-                    break
+                power_state = jvc.get(Command.Power)
+                if power_state == PowerState.Starting:
+                    print('Waiting for projector to warm up...')
+                    power_state = jvc.wait_for(Command.Power, PowerState.LampOn, POWER_DEADLINE)
+                while power_state != PowerState.LampOn:
+                    print('Make sure projector is powered on and ready. Current state is:',
+                          power_state.name)
+                    res = input('Press enter to retry '
+                                '(or enter "on" to send power on command): ')
+                    jvc.cache_clear()
+                    if res == 'on':
+                        print('Waiting for projector to turn on...')
+                        power_state = jvc.power_on()
+                    else:
+                        power_state = jvc.get(Command.Power)
+                input_level = jvc.get(Command.HDMIInputLevel)
                 while True:
                     print('Set "Picture Mode" to the User mode you want to program for HDR')
                     print('Set "Gamma" to "Custom 1", "Custom 2" or "Custom 3"')
                     input('Press enter when ready: ')
+                    jvc.cache_clear()
                     user_mode = jvc.get(Command.PictureMode)
                     gamma_table = jvc.get(Command.GammaTable)
                     if user_mode not in {PictureMode.User1, PictureMode.User2,
@@ -366,7 +380,7 @@ class Menu():
         input('Press enter when ready load test gamma curve: ')
         saved_input_level = None
         try:
-            with JVCCommand() as jvc:
+            with JVCCommand(cache=True, policy=SESSION_POLICY) as jvc:
                 saved_input_level = jvc.get(Command.HDMIInputLevel)
                 if saved_input_level != HDMIInputLevel.Enhanced:
                     print('Changing input level from {} to Enhanced'.format(saved_input_level.name))
@@ -379,7 +393,7 @@ class Menu():
             input('Press enter when done: ')
         finally:
             if saved_input_level:
-                with JVCCommand() as jvc:
+                with JVCCommand(cache=True, policy=SESSION_POLICY) as jvc:
                     if saved_input_level != jvc.get(Command.HDMIInputLevel):
                         print('Changing input level from Enhanced to {}'.format(
                             saved_input_level.name))
@@ -403,9 +417,12 @@ class Menu():
               'adustments\n'
               'When done, leave the contrast at 0')
         while True:
-            with JVCCommand() as jvc:
+            with JVCCommand(cache=True, policy=SESSION_POLICY) as jvc:
+                plan = jvc_plan.Plan('hdr_contrast_menu')
                 if gamma_table_loaded:
-                    contrast = jvc.get(Command.Contrast)
+                    contrast = plan.get(Command.Contrast)
+                    plan.run(jvc)
+                    contrast = contrast.result()
                     print('Contrast', contrast)
                     if contrast == 0:
                         jvc.set(Command.Remote, RemoteCode.Back)
@@ -415,11 +432,13 @@ class Menu():
 
                 print('Please wait while loading gamma table')
                 try:
-                    jvc.set(Command.Remote, RemoteCode.Back)
-                    self.gamma.write_jvc(jvc, verify=self.verify)
-                    jvc.set(Command.Contrast, 0)
+                    plan.set(Command.Remote, RemoteCode.Back)
+                    plan.call(lambda jvc: self.gamma.write_jvc(jvc, verify=self.verify),
+                              changes=WRITE_CHANGES)
+                    plan.set(Command.Contrast, 0, verify=True)
+                    plan.set(Command.Remote, RemoteCode.PictureAdjust)
+                    plan.run(jvc)
                     gamma_table_loaded = True
-                    jvc.set(Command.Remote, RemoteCode.PictureAdjust)
                 except Exception as err:
                     print('Failed to load gamma table', err)
                     ret = input('Press enter to retry or enter "a" to abort: ')
@@ -750,6 +769,12 @@ class Menu():
             ('bwc', 'Scale ref white brightness from contrast (-50 - 50)',
              self.contrast_to_brefwhite),
             ('Pr', 'Read raw table from projector', lambda _: self.gamma.read()),
+            ]
+        if self.gamma.raw_gamma_table():
+            menu += [
+                ('fr', 'Fit gamma curve parameters to raw table', self.fit_raw_table),
+                ]
+        menu += [
             ('ig', 'Import gamma curve from VCGT file [filename]', self.import_vcgt),
             ]
 
@@ -782,6 +807,8 @@ class Menu():
                 ('lf', 'Load gamma curve from file [confname]', self.load),
                 ('Pw', 'Write gamma curve to projector',
                  lambda _: self.gamma.write(verify=self.verify)),
+                ('Pf', 'Write all colors of gamma curve to projector',
+                 lambda _: self.gamma.write(verify=self.verify, force=True)),
                 ('q!', 'Quit and discard changes', lambda _: None),
                 ('s', 'Save save current gamma parameters [confname]', self.save),
                 ('x', 'Quit and save current gamma parameters [confname]', self.save),
@@ -832,6 +859,12 @@ class Menu():
 
 def main():
     """JVC Projector tools main menu"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--stats', action='store_true',
+                        help='print projector command latency and retry statistics at exit')
+    args = parser.parse_args()
+    if args.stats:
+        jvc_stats.enable(dump_at_exit=True)
     while True:
         try:
             Menu()